@@ -10,6 +10,8 @@ import scipy as sp
 import copy
 import os.path
 import time
+import libhookecurve as lhc
+import libpool as lpool
 
 import warnings
 warnings.simplefilter('ignore',np.RankWarning)
@@ -29,7 +31,7 @@ class autopeakCommands:
         Requires flatten plotmanipulator , fit.py plugin , flatfilts.py plugin with convfilt
         
         Syntax:
-        autopeak [rebase] [pl=value] [manual=value] [t=value] [noauto] [reclick]
+        autopeak [rebase] [pl=value] [manual=value] [t=value] [noauto] [reclick] [joint]
         
         rebase : Re-asks baseline interval
         
@@ -57,6 +59,8 @@ class autopeakCommands:
         usepoints : fit interval by number of points instead than by nanometers
         
         noflatten : does not use the "flatten" plot manipulator
+        
+        joint : fits all the peaks at once, with a shared persistence length (WLC only)
 
 	nocontact : when there is a curve without the contact region we have to put this flag
 
@@ -93,7 +97,6 @@ class autopeakCommands:
         T=self.config['temperature']
         
         slope_span=int(self.config['auto_slope_span'])
-        delta_force=10
         rebase=False #if true=we select rebase
         noflatten=False #if true=we avoid flattening
 	nocontact=False
@@ -125,6 +128,8 @@ class autopeakCommands:
         
         if 'noflatten' in args:
             noflatten=True
+        
+        joint='joint' in args.split()
 
         if 'nocontact' in args:
             nocontact=True 
@@ -193,79 +198,33 @@ class autopeakCommands:
             except:
                 avg=displayed_plot.vectors[1][1][cindex]
         
-        for peak in peak_location:
-            #WLC FITTING
-            #define fit interval
-            if not usepoints:
-                fit_points=self.fit_interval_nm(peak, displayed_plot, self.config['auto_fit_nm'], True)
-            peak_point=self._clickize(displayed_plot.vectors[1][0],displayed_plot.vectors[1][1],peak)
-            other_fit_point=self._clickize(displayed_plot.vectors[1][0],displayed_plot.vectors[1][1],peak-fit_points)
-            
-            #points for the fit
-            points=[contact_point, peak_point, other_fit_point]
-            
-            if abs(peak_point.index-other_fit_point.index) < 2:
-                continue
+        if self.config['fit_function'] not in ('wlc','fjc'):
+            print 'Unknown fit function'
+            print 'Please set fit_function as wlc or fjc'
+            return
+        if joint and self.config['fit_function']!='wlc':
+            print 'The joint fit is available for the WLC only'
+            return
+        
+        line_fits=self._line_fits(1)
+        for peak,measured in self.measure_peaks(displayed_plot, peak_location, contact_point, avg, pl_value, T, fit_points, slope_span, line_fits, joint=joint):
+            (c_length,p_length,force,slope,sigma_c_length,sigma_p_length,qstd),xfit,yfit=measured
+            c_lengths.append(c_length)
+            p_lengths.append(p_length)
+            forces.append(force)
+            slopes.append(slope)
+            sigma_c_lengths.append(sigma_c_length)
+            sigma_p_lengths.append(sigma_p_length)
+            qstds.append(qstd)
             
-            if self.config['fit_function']=='wlc':
-                
-                params, yfit, xfit, fit_errors, qstd = self.wlc_fit(points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1], pl_value, T, return_errors=True)
-            elif self.config['fit_function']=='fjc':
-                params, yfit, xfit, fit_errors, qstd = self.fjc_fit(points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1], pl_value, T, return_errors=True)
+            #Add WLC fit lines to plot
+            fitplot.add_set(xfit,yfit)
+            if len(fitplot.styles)==0:
+                fitplot.styles=[]
+                fitplot.colors=[]
             else:
-                print 'Unknown fit function'
-                print 'Please set fit_function as wlc or fjc'
-                return
-            
-            
-            #Measure forces
-            delta_to_measure=displayed_plot.vectors[1][1][peak-delta_force:peak+delta_force]
-            y=min(delta_to_measure)
-            #save force values (pN)   
-            #Measure slopes
-            slope=self.linefit_between(peak-slope_span,peak)[0]
-            
-            
-            #check fitted data and, if right, add peak to the measurement
-            #FIXME: code duplication
-            if len(params)==1: #if we did choose 1-value fit
-                p_lengths.append(pl_value)
-                c_lengths.append(params[0]*(1.0e+9))
-                sigma_p_lengths.append(0)
-                sigma_c_lengths.append(fit_errors[0]*(1.0e+9))
-                forces.append(abs(y-avg)*(1.0e+12))
-                slopes.append(slope)
-                qstds.append(qstd)     
-                #Add WLC fit lines to plot
-                fitplot.add_set(xfit,yfit)
-                if len(fitplot.styles)==0:
-                    fitplot.styles=[]
-                    fitplot.colors=[]
-                else:
-                    fitplot.styles.append(None)
-                    fitplot.colors.append(None)
-            else: #2-value fit
-                p_leng=params[1]*(1.0e+9)
-                #check if persistent length makes sense. otherwise, discard peak.
-                if p_leng>self.config['auto_min_p'] and p_leng<self.config['auto_max_p']:
-                    p_lengths.append(p_leng)       
-                    c_lengths.append(params[0]*(1.0e+9))
-                    sigma_c_lengths.append(fit_errors[0]*(1.0e+9))
-                    sigma_p_lengths.append(fit_errors[1]*(1.0e+9))
-                    forces.append(abs(y-avg)*(1.0e+12))
-                    slopes.append(slope)
-                    qstds.append(qstd)     
-                    
-                    #Add WLC fit lines to plot
-                    fitplot.add_set(xfit,yfit)
-                    if len(fitplot.styles)==0:
-                        fitplot.styles=[]
-                        fitplot.colors=[]
-                    else:
-                        fitplot.styles.append(None)
-                        fitplot.colors.append(None)
-                else:
-                    pass
+                fitplot.styles.append(None)
+                fitplot.colors.append(None)
  
             
         #add basepoints to fitplot
@@ -352,4 +311,229 @@ class autopeakCommands:
             
         f.close()
         self.do_note('autopeak')
+    
+    def peak_fit_points(self, plot, peak, contact_point, fit_points):
+        '''
+        The points to fit a peak of the return trace of plot with, as if clicked: the contact point, the peak
+        and the point fit_points points before it (if fit_points is None, auto_fit_nm nm before it).
+        Returns None if there is nothing to fit.
+        '''
+        xvector,yvector=plot.vectors[1][0],plot.vectors[1][1]
+        
+        #define fit interval
+        if fit_points is None:
+            fit_points=self.fit_interval_nm(peak, plot, self.config['auto_fit_nm'], True)
+        peak_point=self._clickize(xvector,yvector,peak)
+        other_fit_point=self._clickize(xvector,yvector,peak-fit_points)
+        
+        if abs(peak_point.index-other_fit_point.index) < 2:
+            return None
+        return [contact_point, peak_point, other_fit_point]
+    
+    def measure_peak(self, plot, peak, contact_point, avg, pl_value, T, fit_points, slope_span, line_fits, current=None, fit=None):
+        '''
+        Measures a peak of the return trace of plot, as autopeak does:
+        - fits it with the fit_function, from the peak to fit_points points before it
+          (if fit_points is None, to auto_fit_nm nm before it), unless fit already holds
+          the results of its fit (as wlc_fit() returns them)
+        - measures its force from the avg baseline, and the slope of the slope_span points before it
+          (line_fits is the lhc.LineFits of the return trace)
+        current is the HookeCurve of the plot (default: the current curve), whose fit cache is used.
+        
+        Returns None if the peak is discarded, otherwise
+        ((contour, persistence, force, slope, sigma contour, sigma persistence, qstd), xfit, yfit)
+        with the lengths in nm and the force in pN.
+        '''
+        delta_force=10
+        xvector,yvector=plot.vectors[1][0],plot.vectors[1][1]
+        
+        if fit is None:
+            points=self.peak_fit_points(plot, peak, contact_point, fit_points)
+            if points is None:
+                return None
+            if self.config['fit_function']=='wlc':
+                fit=self.cached_fit('wlc', points, xvector, yvector, pl_value, T, current)
+            else:
+                fit=self.cached_fit('fjc', points, xvector, yvector, pl_value, T, current)
+        params, yfit, xfit, fit_errors, qstd = fit
+        
+        #Measure forces
+        y=min(yvector[peak-delta_force:peak+delta_force])
+        #Measure slopes
+        slope=line_fits.fit(peak-slope_span,peak)[0]
+        
+        if len(params)==1: #if we did choose 1-value fit
+            p_leng=pl_value
+            sigma_p_leng=0
+        else: #2-value fit
+            p_leng=params[1]*(1.0e+9)
+            #check if persistent length makes sense. otherwise, discard peak.
+            if not (p_leng>self.config['auto_min_p'] and p_leng<self.config['auto_max_p']):
+                return None
+            sigma_p_leng=fit_errors[1]*(1.0e+9)
+        
+        measurements=(params[0]*(1.0e+9), p_leng, abs(y-avg)*(1.0e+12), slope, fit_errors[0]*(1.0e+9), sigma_p_leng, qstd)
+        return measurements, xfit, yfit
+    
+    def measure_peaks(self, plot, peak_location, contact_point, avg, pl_value, T, fit_points, slope_span, line_fits, current=None, joint=False):
+        '''
+        measure_peak() on all the peaks: returns the list of (peak, measure_peak() results) of the peaks kept.
+        If joint is True, the peaks are fitted together by wlc_joint_fit() (shared persistence length).
+        '''
+        fits={}
+        if joint:
+            peaks=[]
+            chunk_points=[]
+            for peak in peak_location:
+                points=self.peak_fit_points(plot, peak, contact_point, fit_points)
+                if points is not None:
+                    peaks.append(peak)
+                    chunk_points.append(points[1:])
+            if len(peaks)==0:
+                return []
+            results=self.wlc_joint_fit(contact_point, chunk_points, plot.vectors[1][0], plot.vectors[1][1], pl_value, T)
+            fits=dict(zip(peaks,results))
+            peak_location=peaks
+        
+        measured=[]
+        for peak in peak_location:
+            measurements=self.measure_peak(plot, peak, contact_point, avg, pl_value, T, fit_points, slope_span, line_fits, current, fits.get(peak))
+            if measurements is not None:
+                measured.append((peak,measurements))
+        return measured
+    
+    def autopeak_curve(self, item, pl_value, T, usepoints, noflatten, nocontact, joint=False):
+        '''
+        autopeak measurements of a curve of the playlist, without any interaction: automatic contact point
+        and baseline, all the peaks found (fitted together if joint is True).
+        Returns a list of (peak index, measurements), the measurements as measure_peak() gives them.
+        '''
+        if not item.identify(self.drivers):
+            raise IOError('unknown file format')
+        
+        try:
+            #the processed plot, as autopeak would see it displayed
+            plot=self._process(item)[-1][1][0]
+            xvector,yvector=plot.vectors[1][0],plot.vectors[1][1]
+            
+            cindex=self.find_contact_point(plot,item)
+            contact_point=self._clickize(xvector,yvector,cindex)
+            
+            peak_location, peak_size = self.find_current_peaks(noflatten, True, True, nocontact, item)
+            if len(peak_location) == 0:
+                return []
+            
+            if self.config['baseline_clicks']==-1:
+                avg=yvector[cindex]
+            else:
+                basepoints=self.auto_baseline_points(peak_location, plot)
+                boundaries=[basepoints[0].index, basepoints[1].index]
+                boundaries.sort()
+                avg=np.mean(yvector[boundaries[0]:boundaries[1]])
+            
+            if usepoints:
+                fit_points=int(self.config['auto_fit_points'])
+            else:
+                fit_points=None
+            slope_span=int(self.config['auto_slope_span'])
+            line_fits=lhc.LineFits(xvector,yvector)
+            
+            measured=self.measure_peaks(plot, peak_location, contact_point, avg, pl_value, T, fit_points, slope_span, line_fits, item, joint)
+            return [(peak,measurements[0]) for peak,measurements in measured]
+        finally:
+            #close all open files, and free the curve (but the displayed one)
+            item.curve.close_all()
+            if item is not self.current:
+                item.curve=None
+    
+    def do_autopeak_batch(self,args):
+        '''
+        AUTOPEAK_BATCH
+        (autopeak.py)
+        Runs autopeak on all the curves of the playlist, without asking anything, and saves
+        the measurements of all their peaks in a single file.
+        The contact point is always found automatically, all the peaks found are measured
+        (the ones outside auto_min_p and auto_max_p are discarded, as in autopeak) and the
+        baseline is the automatic one: baseline_clicks -1 (f=0 at the contact point) is
+        honoured, the other values are taken as 0.
+        fit_function, temperature and the auto_* variables are used as in autopeak.
+        
+        Syntax:
+        autopeak_batch [filename] [pl=value] [t=value] [usepoints] [noflatten] [nocontact] [joint]
+        
+        filename : the file to save to (by default, the autopeak one, if already given).
+                   If it exists, the measurements are appended to it.
+        The other options are the autopeak ones.
+        
+        Each line of the file is a peak, tagged with its curve and the index of the peak point:
+        ; Curve ; Peak index ; Contour length (nm) ; Persistence length (nm) ; Max.Force (pN) ; Slope (N/m) ; Sigma contour (nm) ; Sigma persistence (nm)
+        
+        Curves are processed in parallel by "set workers" processes
+        (0 = as many as the processors).
+        '''
+        pl_value=None
+        T=self.config['temperature']
+        filename=self.autofile
+        usepoints=False
+        noflatten=False
+        nocontact=False
+        joint=False
+        
+        for arg in args.split():
+            if 'pl=' in arg:
+                pl_value=float(arg.split('=')[1])
+            elif ('t=' in arg[0:3]) or ('T=' in arg[0:3]):
+                T=float(arg.split('=')[1])
+            elif arg=='usepoints':
+                usepoints=True
+            elif arg=='noflatten':
+                noflatten=True
+            elif arg=='nocontact':
+                nocontact=True
+            elif arg=='joint':
+                joint=True
+            else:
+                filename=arg
+        
+        if filename=='':
+            print 'Give the file to save the measurements to: autopeak_batch filename'
+            return
+        if self.config['fit_function'] not in ('wlc','fjc'):
+            print 'Unknown fit function'
+            print 'Please set fit_function as wlc or fjc'
+            return
+        if joint and self.config['fit_function']!='wlc':
+            print 'The joint fit is available for the WLC only'
+            return
+        
+        def autopeak_curve(cli,item):
+            return cli.autopeak_curve(item, pl_value, T, usepoints, noflatten, nocontact, joint)
+        
+        print 'Using fit function: ',self.config['fit_function']
+        print 'Processing playlist...'
+        new_file=not os.path.exists(filename)
+        f=open(filename,'a')
+        try:
+            if new_file:
+                f.write('Analysis started '+time.asctime()+'\n')
+                f.write('----------------------------------------\n')
+                f.write('; Curve ; Peak index ; Contour length (nm)  ;  Persistence length (nm) ;  Max.Force (pN)  ;  Slope (N/m) ;  Sigma contour (nm) ; Sigma persistence (nm)\n')
+            
+            c=0
+            measured_peaks=0
+            for ok,measured in lpool.map_curves(autopeak_curve,self,self.current_list,self.config['workers']):
+                item=self.current_list[c]
+                c+=1
+                
+                if not ok:
+                    print 'Curve',item.path, 'is',c,'of',len(self.current_list),': cannot be measured ('+measured+').'
+                    continue
+                
+                print 'Curve',item.path, 'is',c,'of',len(self.current_list),': '+str(len(measured))+' peaks measured.'
+                for peak,(c_length,p_length,force,slope,sigma_c_length,sigma_p_length,qstd) in measured:
+                    f.write(' ; '+item.path+' ; '+str(peak)+' ; '+str(c_length)+' ; '+str(p_length)+' ; '+str(force)+' ; '+str(slope)+' ; '+str(sigma_c_length)+' ; '+str(sigma_p_length)+'\n')
+                measured_peaks+=len(measured)
+        finally:
+            f.close()
         
+        print 'Saved',measured_peaks,'peaks of',len(self.current_list),'curves to',filename
@@ -20,6 +20,9 @@ import csv
 
 class csvdriverDriver(lhc.Driver):
     
+        #Sniffing rules (see lhc.Driver)
+        first_line='Hooke data'
+    
         def __init__(self, filename):
         
             self.filedata = open(filename,'r')
@@ -32,9 +35,7 @@ class csvdriverDriver(lhc.Driver):
             self.filename=filename
         
         def is_me(self):
-            myfile=file(self.filename)
-            headerline=myfile.readlines()[0]
-            myfile.close()
+            headerline=self.data[0]
             
             #using a custom header makes things much easier...
             #(looking for raw CSV data is at strong risk of confusion)
@@ -60,8 +61,8 @@ class csvdriverDriver(lhc.Driver):
                 temp_y=columns[index+1]
                 
                 #convert to float (the csv gives strings)
-                temp_x=[float(item) for item in temp_x]
-                temp_y=[float(item) for item in temp_y]
+                temp_x=lhc.DataChunk(temp_x)
+                temp_y=lhc.DataChunk(temp_y)
                 
                 main_plot.vectors[-1].append(temp_x)
                 main_plot.vectors[-1].append(temp_y)
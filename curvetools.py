@@ -4,6 +4,7 @@ import wxversion
 wxversion.select(WX_GOOD)
 from wx import PostEvent
 import numpy as np
+import libhookecurve as lhc
 import scipy as sp
 import copy
 import os.path
@@ -33,25 +34,24 @@ class curvetoolsCommands:
 	  whatset=1 #FIXME: should be decidable
 	  x_vect=plot.vectors[1][0]
 	  
-	  c=0
-	  i=start_index
-	  start=x_vect[start_index]
 	  maxlen=len(x_vect)
-	  while abs(x_vect[i]-x_vect[start_index])*(10**9) < nm:
-	      if i==0 or i==maxlen-1: #we reached boundaries of vector!
-		  return c
-	      
+	  if start_index==0 or start_index==maxlen-1: #we start at the boundaries of vector!
+	      return 0
+	  
+	  end_index=lhc.index_at_distance(x_vect,start_index,nm*(10**-9),backwards)
+	  if end_index is None: #we reached boundaries of vector!
 	      if backwards:
-		  i-=1
+		  end_index=0
 	      else:
-		  i+=1
-	      c+=1
-	  return c
+		  end_index=maxlen-1
+	  return abs(end_index-start_index)
 
 
 
-      def find_current_peaks(self,noflatten, a=True, maxpeak=True, nocontact=False):
-	    #Find peaks.
+      def find_current_peaks(self,noflatten, a=True, maxpeak=True, nocontact=False, current=None):
+	    #Find peaks (of the current curve, or of the given HookeCurve).
+	    if current is None:
+		  current=self.current
 	    if a==True:
 		  a=self.convfilt_config['mindeviation']
 	    try:
@@ -60,11 +60,11 @@ class curvetoolsCommands:
 		  print "Bad input, using default."
 		  abs_devs=self.convfilt_config['mindeviation']
 
-	    defplot=self.current.curve.default_plots()[0]
+	    defplot=current.curve.default_plots()[0]
 	    if not noflatten:
 		flatten=self._find_plotmanip('flatten') #Extract flatten plotmanip
-		defplot=flatten(defplot, self.current, customvalue=1) #Flatten curve before feeding it to has_peaks
-	    pk_location,peak_size=self.has_peaks(defplot, abs_devs, maxpeak, 10, nocontact)
+		defplot=flatten(defplot, current, customvalue=1) #Flatten curve before feeding it to has_peaks
+	    pk_location,peak_size=self.has_peaks(defplot, abs_devs, maxpeak, 10, nocontact, current)
 	    return pk_location, peak_size
 
 
@@ -82,11 +82,7 @@ class curvetoolsCommands:
       def baseline_points(self,peak_location, displayed_plot):
             clicks=self.config['baseline_clicks']
             if clicks==0:
-                self.basepoints=[]
-                base_index_0=peak_location[-1]+self.fit_interval_nm(peak_location[-1], displayed_plot, self.config['auto_right_baseline'],False)
-                self.basepoints.append(self._clickize(displayed_plot.vectors[1][0],displayed_plot.vectors[1][1],base_index_0))
-                base_index_1=self.basepoints[0].index+self.fit_interval_nm(self.basepoints[0].index, displayed_plot, self.config['auto_left_baseline'],False)
-                self.basepoints.append(self._clickize(displayed_plot.vectors[1][0],displayed_plot.vectors[1][1],base_index_1))
+                self.basepoints=self.auto_baseline_points(peak_location, displayed_plot)
             elif clicks>0:
                 print 'Select baseline'
                 if clicks==1:
@@ -99,5 +95,17 @@ class curvetoolsCommands:
             self.basecurrent=self.current.path
             return self.basepoints
 
+      def auto_baseline_points(self,peak_location, plot):
+            '''
+            automatic baseline: auto_right_baseline nm after the last peak, auto_left_baseline nm long.
+            returns the two points delimiting it.
+            '''
+            basepoints=[]
+            base_index_0=peak_location[-1]+self.fit_interval_nm(peak_location[-1], plot, self.config['auto_right_baseline'],False)
+            basepoints.append(self._clickize(plot.vectors[1][0],plot.vectors[1][1],base_index_0))
+            base_index_1=basepoints[0].index+self.fit_interval_nm(basepoints[0].index, plot, self.config['auto_left_baseline'],False)
+            basepoints.append(self._clickize(plot.vectors[1][0],plot.vectors[1][1],base_index_1))
+            return basepoints
+
 
 
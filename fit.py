@@ -19,7 +19,9 @@ import scipy
 import scipy.odr
 import numpy as np
 import copy
+import hashlib
 import Queue
+import libfit as lfit
 
 global measure_wlc
 global EVT_MEASURE_WLC
@@ -29,6 +31,9 @@ global EVT_MEASURE_WLC
 global events_from_fit
 events_from_fit=Queue.Queue() #GUI ---> CLI COMMUNICATION
 
+#number of fits kept in the fit cache of each curve
+FIT_CACHE_SIZE=20
+
 
 class fitCommands:
     
@@ -44,6 +49,43 @@ class fitCommands:
                 
         
     
+    def cached_fit(self,model,clicked_points,xvector,yvector,pl_value,T=293,current=None):
+        '''
+        Fits with model ('wlc', 'fjc' or 'efjc') as wlc_fit() and friends do with return_errors,
+        remembering the results in the fit cache of current (the HookeCurve of the vectors, by default
+        the current curve), which is saved with the playlist.
+        A fit is done again only if the model, the clicked points, pl_value, T or the data it depends on
+        (from the contact point to the end of the plotted fit) changed.
+        '''
+        if current is None:
+            current=self.current
+        
+        first_index=min(clicked_points[1].index, clicked_points[2].index)
+        last_index=max(clicked_points[1].index, clicked_points[2].index)
+        contact_index=clicked_points[0].index
+        thule_index=min(last_index+10,len(xvector))
+        if contact_index>=thule_index: #the fit line is then taken from the start of the curve
+            contact_index=0
+        start=min(contact_index,first_index)
+        
+        key=hashlib.sha1(repr((model,int(clicked_points[0].index),[float(coord) for coord in clicked_points[0].graph_coords],
+                               int(first_index),int(last_index),pl_value,float(T))))
+        for vector in (xvector,yvector):
+            key.update(np.ascontiguousarray(vector[start:thule_index],float).tostring())
+        key=key.hexdigest()
+        
+        for cached_key,result in current.fitcache:
+            if cached_key==key:
+                params,yfit,xfit,fit_errors,qstd=result
+                return list(np.array(params)),np.array(yfit),np.array(xfit),list(np.array(fit_errors)),np.float64(qstd)
+        
+        params,yfit,xfit,fit_errors,qstd=getattr(self,model+'_fit')(clicked_points,xvector,yvector,pl_value,T,return_errors=True)
+        #plain numbers and lists, for the playlist
+        result=[[float(item) for item in params],[float(item) for item in yfit],[float(item) for item in xfit],
+                [float(item) for item in fit_errors],float(qstd)]
+        current.fitcache=[item for item in current.fitcache if item[0]!=key][-(FIT_CACHE_SIZE-1):]+[[key,result]]
+        return params,yfit,xfit,fit_errors,qstd
+    
     def wlc_fit(self,clicked_points,xvector,yvector, pl_value, T=293, return_errors=False):
         '''
         Worm-like chain model fitting.
@@ -60,77 +102,20 @@ class fitCommands:
         if pl_value is not None:
             pl_value=pl_value/(10**9)
         
-        #indexes of the selected chunk
-        first_index=min(clicked_points[1].index, clicked_points[2].index)
-        last_index=max(clicked_points[1].index, clicked_points[2].index)
-               
-        #getting the chunk and reverting it
-        xchunk,ychunk=xvector[first_index:last_index],yvector[first_index:last_index]
-        xchunk.reverse()
-        ychunk.reverse()    
-        #put contact point at zero and flip around the contact point (the fit wants a positive growth for extension and force)
-        xchunk_corr_up=[-(x-clicked_points[0].graph_coords[0]) for x in xchunk]
-        ychunk_corr_up=[-(y-clicked_points[0].graph_coords[1]) for y in ychunk]
-        
-        #make them arrays
-        xchunk_corr_up=scipy.array(xchunk_corr_up)
-        ychunk_corr_up=scipy.array(ychunk_corr_up)
-    
+        xchunk_corr_up,ychunk_corr_up,last_index=self._wlc_chunk(clicked_points,xvector,yvector)
         
         #STEP 2: actually do the fit
-    
-        #Find furthest point of chunk and add it a bit; the fit must converge
-        #from an excess!
-        xchunk_high=max(xchunk_corr_up)
-        xchunk_high+=(xchunk_high/10)
-    
-        #Here are the linearized start parameters for the WLC.
-        #[lambd=1/Lo , pii=1/P]
-    
-        p0=[(1/xchunk_high),(1/(3.5e-10))]
-        p0_plfix=[(1/xchunk_high)]
-        '''
-        ODR STUFF
-        fixme: remove these comments after testing
-        '''
-        def dist(px,py,linex,liney):
-            distancesx=scipy.array([(px-x)**2 for x in linex])
-            minindex=np.argmin(distancesx)
-            #print px, linex[0], linex[-1]
-            return (py-liney[minindex])**2
-        
-        def f_wlc(params,x,T=T):
-            '''
-            wlc function for ODR fitting
-            '''
-            lambd,pii=params
-            Kb=(1.38065e-23)
-            therm=Kb*T
-            y=(therm*pii/4.0) * (((1-(x*lambd))**-2) - 1 + (4*x*lambd))
-            return y
-        
-        def f_wlc_plfix(params,x,pl_value=pl_value,T=T):
-            '''
-            wlc function for ODR fitting
-            '''
-            lambd=params
-            pii=1/pl_value
-            Kb=(1.38065e-23)
-            therm=Kb*T
-            y=(therm*pii/4.0) * (((1-(x*lambd))**-2) - 1 + (4*x*lambd))
-            return y
-        
-        #make the ODR fit
-        realdata=scipy.odr.RealData(xchunk_corr_up,ychunk_corr_up)
+        
+        #The linearized parameters for the WLC are [lambd=1/Lo , pii=1/P]: the start ones
+        #are guessed from the chunk (see libfit.wlc_guess)
+        p0=lfit.wlc_guess(xchunk_corr_up,ychunk_corr_up,T,pl_value)
         if pl_value:
-            model=scipy.odr.Model(f_wlc_plfix)
-            o = scipy.odr.ODR(realdata, model, p0_plfix)
+            fixed=1/pl_value
         else:
-            model=scipy.odr.Model(f_wlc)
-            o = scipy.odr.ODR(realdata, model, p0)
+            fixed=None
         
-        o.set_job(fit_type=2)
-        out=o.run()
+        #make the ODR fit, with the analytic derivatives of the WLC
+        out=lfit.odr_fit('wlc',xchunk_corr_up,ychunk_corr_up,p0,T,fixed)
         fit_out=[(1/i) for i in out.beta]
         
         #Calculate fit errors from output standard deviations.
@@ -141,55 +126,124 @@ class fitCommands:
             err_real=sd*(value**2)
             fit_errors.append(err_real)
         
-        def wlc_eval(x,params,pl_value,T):    
-            '''
-            Evaluates the WLC function
-            '''
-            if not pl_value:
-                lambd, pii = params
-            else:
-                lambd = params
-        
-            if pl_value:
-                pii=1/pl_value
-        
-            Kb=(1.38065e-23) #boltzmann constant
-            therm=Kb*T #so we have thermal energy
-        
-            return ( (therm*pii/4.0) * (((1-(x*lambd))**-2.0) - 1 + (4.0*x*lambd)) )
-        
-        
         #STEP 3: plotting the fit
+        yfit_corr_down,xfit_chunk=self._wlc_line(clicked_points,xvector,out.beta,T,fixed,last_index)
         
-        #obtain domain to plot the fit - from contact point to last_index plus 20 points
+        #calculate fit quality 
+        yqeval=lfit.wlc(out.beta,xchunk_corr_up,T,fixed)
+        qstd=np.sqrt(np.sum((yqeval-ychunk_corr_up)**2)/len(ychunk_corr_up))
+        
+        if return_errors:
+            return fit_out, yfit_corr_down, xfit_chunk, fit_errors, qstd
+        else:
+            return fit_out, yfit_corr_down, xfit_chunk, None, qstd
+    
+    def _wlc_chunk(self,clicked_points,xvector,yvector):
+        '''
+        For the WLC fits: returns the chunk between clicked_points[1] and [2], with the contact point
+        clicked_points[0] at zero and flipped (the fit wants a positive growth for extension and force),
+        and the index of its end
+        '''
+        #indexes of the selected chunk
+        first_index=min(clicked_points[1].index, clicked_points[2].index)
+        last_index=max(clicked_points[1].index, clicked_points[2].index)
+               
+        #getting the chunk and reverting it
+        xchunk,ychunk=xvector[first_index:last_index][::-1],yvector[first_index:last_index][::-1]
+        #put contact point at zero and flip around the contact point
+        xchunk_corr_up=-(np.asarray(xchunk,float)-clicked_points[0].graph_coords[0])
+        ychunk_corr_up=-(np.asarray(ychunk,float)-clicked_points[0].graph_coords[1])
+        return xchunk_corr_up,ychunk_corr_up,last_index
+    
+    def _wlc_line(self,clicked_points,xvector,beta,T,fixed,last_index):
+        '''
+        For the WLC fits: returns the (y, x) fit line to plot, from the contact point to last_index plus 10 points
+        '''
         thule_index=last_index+10
         if thule_index > len(xvector): #for rare cases in which we fit something at the END of whole curve.
             thule_index = len(xvector)
         #reverse etc. the domain
-        xfit_chunk=xvector[clicked_points[0].index:thule_index]
-        xfit_chunk.reverse()
-        xfit_chunk_corr_up=[-(x-clicked_points[0].graph_coords[0]) for x in xfit_chunk]
-        xfit_chunk_corr_up=scipy.array(xfit_chunk_corr_up)
+        xfit_chunk=xvector[clicked_points[0].index:thule_index][::-1]
+        xfit_chunk_corr_up=-(np.asarray(xfit_chunk,float)-clicked_points[0].graph_coords[0])
     
         #the fitted curve: reflip, re-uncorrect
-        yfit=wlc_eval(xfit_chunk_corr_up, out.beta, pl_value,T)
-        yfit_down=[-y for y in yfit]
-        yfit_corr_down=[y+clicked_points[0].graph_coords[1] for y in yfit_down]
+        yfit=lfit.wlc(beta,xfit_chunk_corr_up,T,fixed)
+        yfit_corr_down=-yfit+clicked_points[0].graph_coords[1]
+        return yfit_corr_down,xfit_chunk
+    
+    def wlc_joint_fit(self,contact_point,chunk_points,xvector,yvector,pl_value,T=293):
+        '''
+        Worm-like chain fit of several chunks at once (e.g. all the peaks of a sawtooth): a contour length
+        each, and a shared persistence length (fixed to pl_value, in nm, if given). See libfit.wlc_joint_fit.
         
+        contact_point is the contact point, chunk_points a list of (edge, edge) clicked point pairs.
+        Returns a list with, for each chunk, what wlc_fit() returns with return_errors.
+        '''
+        if pl_value is not None:
+            pl_value=pl_value/(10**9)
+        if pl_value:
+            fixed=1/pl_value
+        else:
+            fixed=None
         
-        #calculate fit quality 
-        qsum=0
-        yqeval=wlc_eval(xchunk_corr_up,out.beta,pl_value,T)
-        #we need to cut the extra from thuleindex
-        for qindex in np.arange(0,len(yqeval)):
-            qsum+=(yqeval[qindex]-ychunk_corr_up[qindex])**2        
-        qstd=np.sqrt(qsum/len(ychunk_corr_up))        
+        chunks=[self._wlc_chunk([contact_point,edge1,edge2],xvector,yvector) for edge1,edge2 in chunk_points]
+        beta,sd_beta=lfit.wlc_joint_fit([(xchunk,ychunk) for xchunk,ychunk,last_index in chunks],T,pl_value)
         
+        results=[]
+        for i,(xchunk_corr_up,ychunk_corr_up,last_index) in enumerate(chunks):
+            #the parameters of this chunk, as wlc_fit would have fitted them
+            if fixed is None:
+                chunk_beta=[beta[i],beta[-1]]
+                chunk_sd=[sd_beta[i],sd_beta[-1]]
+            else:
+                chunk_beta=[beta[i]]
+                chunk_sd=[sd_beta[i]]
+            fit_out=[(1/item) for item in chunk_beta]
+            #errors of the inverse parameters, propagated as in wlc_fit
+            fit_errors=[sd*(value**2) for sd,value in zip(chunk_sd,fit_out)]
+            
+            yfit_corr_down,xfit_chunk=self._wlc_line([contact_point]+list(chunk_points[i]),xvector,chunk_beta,T,fixed,last_index)
+            yqeval=lfit.wlc(chunk_beta,xchunk_corr_up,T,fixed)
+            qstd=np.sqrt(np.sum((yqeval-ychunk_corr_up)**2)/len(ychunk_corr_up))
+            results.append((fit_out, yfit_corr_down, xfit_chunk, fit_errors, qstd))
+        return results
     
-        if return_errors:
-            return fit_out, yfit_corr_down, xfit_chunk, fit_errors, qstd
+    def _fit_line(self,clicked_points,yvector,last_index):
+        '''
+        For the fits of the extension as a function of the force (FJC, eFJC):
+        returns the forces to plot the fit on (from the contact point to last_index plus 10 points,
+        corrected as the chunk)
+        '''
+        thule_index=last_index+10
+        if thule_index > len(yvector): #for rare cases in which we fit something at the END of whole curve.
+            thule_index = len(yvector)
+        ychunk=yvector[clicked_points[0].index:thule_index]
+
+        if len(ychunk)>0:
+            y_evalchunk=np.linspace(min(ychunk),max(ychunk),100)
         else:
-            return fit_out, yfit_corr_down, xfit_chunk, None, qstd
+            #Empty y-chunk. It happens whenever we set the contact point after a recognized peak,
+            #or other buggy situations. Kludge to live with it now...
+            ychunk=yvector[:thule_index]
+            y_evalchunk=np.linspace(min(ychunk),max(ychunk),100)
+        
+        return -y_evalchunk
+    
+    def _fit_normalize(self,clicked_points,yfit_down,xfit):
+        '''
+        For the fits of the extension as a function of the force (FJC, eFJC): given the fitted
+        extensions xfit at the forces -yfit_down (see _fit_line), returns the fit line to plot.
+        '''
+        xfit_chunk_corr_up=-(xfit[::-1]-clicked_points[0].graph_coords[0])
+        
+        #This is a terrible, terrible kludge to find the point where it should normalize (and from where it should plot)
+        xxxdists=(clicked_points[0].graph_coords[0]-xfit_chunk_corr_up[1:])**2
+        normalize_index=int(np.argmin(xxxdists))
+        #End of kludge
+        
+        deltay=yfit_down[normalize_index]-clicked_points[0].graph_coords[1]
+        yfit_corr_down=yfit_down-deltay
+        return yfit_corr_down[normalize_index+1:], xfit_chunk_corr_up[normalize_index+1:]
     
     def fjc_fit(self,clicked_points,xvector,yvector, pl_value, T=293, return_errors=False):
         '''
@@ -210,82 +264,23 @@ class fitCommands:
         last_index=max(clicked_points[1].index, clicked_points[2].index)
         
         #getting the chunk and reverting it
-        xchunk,ychunk=xvector[first_index:last_index],yvector[first_index:last_index]
-        xchunk.reverse()
-        ychunk.reverse()    
+        xchunk,ychunk=xvector[first_index:last_index][::-1],yvector[first_index:last_index][::-1]
         #put contact point at zero and flip around the contact point (the fit wants a positive growth for extension and force)
-        xchunk_corr_up=[-(x-clicked_points[0].graph_coords[0]) for x in xchunk]
-        ychunk_corr_up=[-(y-clicked_points[0].graph_coords[1]) for y in ychunk]
-        
-        
-        #make them arrays
-        xchunk_corr_up=scipy.array(xchunk_corr_up)
-        ychunk_corr_up=scipy.array(ychunk_corr_up)
-    
+        xchunk_corr_up=-(np.asarray(xchunk,float)-clicked_points[0].graph_coords[0])
+        ychunk_corr_up=-(np.asarray(ychunk,float)-clicked_points[0].graph_coords[1])
         
         #STEP 2: actually do the fit
-    
-        #Find furthest point of chunk and add it a bit; the fit must converge
-        #from an excess!
-        xchunk_high=max(xchunk_corr_up)
-        xchunk_high+=(xchunk_high/10)
-    
-        #Here are the linearized start parameters for the WLC.
-        #[lambd=1/Lo , pii=1/P]
-    
-        p0=[(1/xchunk_high),(1/(3.5e-10))]
-        p0_plfix=[(1/xchunk_high)]
-        '''
-        ODR STUFF
-        fixme: remove these comments after testing
-        '''
-        def dist(px,py,linex,liney):
-            distancesx=scipy.array([(px-x)**2 for x in linex])
-            minindex=np.argmin(distancesx)
-            #print minindex, px, linex[0], linex[-1]
-            return (py-liney[minindex])**2
-        
-        def coth(z):
-            '''
-            hyperbolic cotangent
-            '''
-            return (np.exp(2*z)+1)/(np.exp(2*z)-1)
-        
-        def x_fjc(params,f,T=T):
-            '''
-            fjc function for ODR fitting
-            '''
-            lambd,pii=params
-            Kb=(1.38065e-23)
-            therm=Kb*T
-            
-            #x=(therm*pii/4.0) * (((1-(x*lambd))**-2) - 1 + (4*x*lambd))
-            x=(1/lambd)*(coth(f*(1/pii)/therm) - (therm*pii)/f)
-            return x
-        
-        def x_fjc_plfix(params,f,pl_value=pl_value,T=T):
-            '''
-            fjc function for ODR fitting
-            '''
-            lambd=params
-            pii=1/pl_value
-            Kb=(1.38065e-23)
-            therm=Kb*T
-            #y=(therm*pii/4.0) * (((1-(x*lambd))**-2) - 1 + (4*x*lambd))
-            x=(1/lambd)*(coth(f*(1/pii)/therm) - (therm*pii)/f)
-            return x
-        
-        #make the ODR fit
-        realdata=scipy.odr.RealData(ychunk_corr_up,xchunk_corr_up)
+        
+        #The linearized parameters are [lambd=1/Lo , pii=1/Kuhn length]: the start ones
+        #are guessed from the chunk (see libfit.fjc_guess)
+        p0=lfit.fjc_guess(ychunk_corr_up,xchunk_corr_up,T,pl_value)
         if pl_value:
-            model=scipy.odr.Model(x_fjc_plfix)
-            o = scipy.odr.ODR(realdata, model, p0_plfix)
+            fixed=1/pl_value
         else:
-            model=scipy.odr.Model(x_fjc)
-            o = scipy.odr.ODR(realdata, model, p0)
+            fixed=None
         
-        o.set_job(fit_type=2)
-        out=o.run()
+        #make the ODR fit (extension as a function of force), with the analytic derivatives of the FJC
+        out=lfit.odr_fit('fjc',ychunk_corr_up,xchunk_corr_up,p0,T,fixed)
         fit_out=[(1/i) for i in out.beta]
         
         #Calculate fit errors from output standard deviations.
@@ -296,80 +291,27 @@ class fitCommands:
             err_real=sd*(value**2)
             fit_errors.append(err_real)
         
-        def fjc_eval(y,params,pl_value,T):    
-            '''
-            Evaluates the WLC function
-            '''
-            if not pl_value:
-                lambd, pii = params
-            else:
-                lambd = params
-        
-            if pl_value:
-                pii=1/pl_value
-        
-            Kb=(1.38065e-23) #boltzmann constant
-            therm=Kb*T #so we have thermal energy
-            #return ( (therm*pii/4.0) * (((1-(x*lambd))**-2.0) - 1 + (4.0*x*lambd)) )
-            return (1/lambd)*(coth(y*(1/pii)/therm) - (therm*pii)/y)
-           
-        
         #STEP 3: plotting the fit
-        #obtain domain to plot the fit - from contact point to last_index plus 20 points
-        thule_index=last_index+10
-        if thule_index > len(xvector): #for rare cases in which we fit something at the END of whole curve.
-            thule_index = len(xvector)
-        #reverse etc. the domain
-        ychunk=yvector[clicked_points[0].index:thule_index]
-
-        if len(ychunk)>0:
-            y_evalchunk=np.linspace(min(ychunk),max(ychunk),100)
-        else:
-            #Empty y-chunk. It happens whenever we set the contact point after a recognized peak,
-            #or other buggy situations. Kludge to live with it now...
-            ychunk=yvector[:thule_index]
-            y_evalchunk=np.linspace(min(ychunk),max(ychunk),100)
-            
-        yfit_down=[-y for y in y_evalchunk]
-        yfit_corr_down=[y+clicked_points[0].graph_coords[1] for y in yfit_down]
-        yfit_corr_down=scipy.array(yfit_corr_down)
+        yfit_down=self._fit_line(clicked_points,yvector,last_index)
+        yfit_corr_down=yfit_down+clicked_points[0].graph_coords[1]
         
         #the fitted curve: reflip, re-uncorrect
-        xfit=fjc_eval(yfit_corr_down, out.beta, pl_value,T)
-        xfit=list(xfit)
-        xfit.reverse()
-        xfit_chunk_corr_up=[-(x-clicked_points[0].graph_coords[0]) for x in xfit]
-        
-        #xfit_chunk_corr_up=scipy.array(xfit_chunk_corr_up)
-        #deltay=yfit_down[0]-yvector[clicked_points[0].index]
-        
-        #This is a terrible, terrible kludge to find the point where it should normalize (and from where it should plot)
-        xxxdists=[]
-        for index in scipy.arange(1,len(xfit_chunk_corr_up),1):
-            xxxdists.append((clicked_points[0].graph_coords[0]-xfit_chunk_corr_up[index])**2)           
-        normalize_index=xxxdists.index(min(xxxdists))
-        #End of kludge
-        
-        deltay=yfit_down[normalize_index]-clicked_points[0].graph_coords[1]
-        yfit_corr_down=[y-deltay for y in yfit_down]
-        
+        xfit=lfit.fjc(out.beta,yfit_corr_down,T,fixed)
+        yfit_corr_down,xfit_chunk_corr_up=self._fit_normalize(clicked_points,yfit_down,xfit)
         
         #calculate fit quality
         #creates dense y vector
         yqeval=np.linspace(np.min(ychunk_corr_up)/2,np.max(ychunk_corr_up)*2,10*len(ychunk_corr_up))
         #corresponding fitted x
-        xqeval=fjc_eval(yqeval,out.beta,pl_value,T)
+        xqeval=lfit.fjc(out.beta,yqeval,T,fixed)
         
-        qsum=0
-        for qindex in np.arange(0,len(ychunk_corr_up)):
-            qsum+=dist(xchunk_corr_up[qindex],ychunk_corr_up[qindex],xqeval,yqeval)        
+        qsum=lfit.nearest_sum(xchunk_corr_up,ychunk_corr_up,xqeval,yqeval)
         qstd=np.sqrt(qsum/len(ychunk_corr_up))        
         
-            
         if return_errors:
-            return fit_out, yfit_corr_down[normalize_index+1:], xfit_chunk_corr_up[normalize_index+1:], fit_errors, qstd
+            return fit_out, yfit_corr_down, xfit_chunk_corr_up, fit_errors, qstd
         else:
-            return fit_out, yfit_corr_down[normalize_index+1:], xfit_chunk_corr_up[normalize_index+1:], None, qstd
+            return fit_out, yfit_corr_down, xfit_chunk_corr_up, None, qstd
     
     def efjc_fit(self,clicked_points,xvector,yvector, pl_value, T=293.0, return_errors=False):
         '''
@@ -382,13 +324,6 @@ class fitCommands:
         clicked_points[1] and [2] are edges of chunk
         
         '''
-        #Fixed parameters from reference
-        Kb=(1.38065e-2) #in pN.nm
-        Lp=0.358 #planar, nm
-        Lh=0.280 #helical, nm
-        Ks=150e3  #pN/nm
-        
-       
         #STEP 1: Prepare the vectors to apply the fit.
         
         #indexes of the selected chunk
@@ -396,108 +331,35 @@ class fitCommands:
         last_index=max(clicked_points[1].index, clicked_points[2].index)
         
         #getting the chunk and reverting it
-        xchunk,ychunk=xvector[first_index:last_index],yvector[first_index:last_index]
-        xchunk.reverse()
-        ychunk.reverse()    
+        xchunk,ychunk=xvector[first_index:last_index][::-1],yvector[first_index:last_index][::-1]
         #put contact point at zero and flip around the contact point (the fit wants a positive growth for extension and force)
-        xchunk_corr_up=[-(x-clicked_points[0].graph_coords[0]) for x in xchunk]
-        ychunk_corr_up=[-(y-clicked_points[0].graph_coords[1]) for y in ychunk]
-        
-        
-        #make them arrays
-        xchunk_corr_up=scipy.array(xchunk_corr_up)
-        ychunk_corr_up=scipy.array(ychunk_corr_up)
+        xchunk_corr_up=-(np.asarray(xchunk,float)-clicked_points[0].graph_coords[0])
+        ychunk_corr_up=-(np.asarray(ychunk,float)-clicked_points[0].graph_coords[1])
         
         xchunk_corr_up_nm=xchunk_corr_up*1e9
         ychunk_corr_up_pn=ychunk_corr_up*1e12
-    
         
         #STEP 2: actually do the fit
-    
-        #Find furthest point of chunk and add it a bit; the fit must converge
-        #from an excess!
-        xchunk_high=max(xchunk_corr_up_nm)
-        xchunk_high+=(xchunk_high/10.0)
-    
-        #Here are the linearized start parameters for the WLC.
-        #[Ns , pii=1/P]
-        #max number of monomers (all helical)for a contour length xchunk_high
-        excessNs=xchunk_high/(Lp) 
-        p0=[excessNs,(1.0/(0.7))]
-        p0_plfix=[(excessNs)]
-    
-        def dist(px,py,linex,liney):
-            distancesx=scipy.array([(px-x)**2 for x in linex])
-            minindex=np.argmin(distancesx)
-            return (py-liney[minindex])**2
-    
-        def deltaG(f):
-            dG0=12.4242 #3kt in pN.nm
-            dL=0.078 #planar-helical
-            return dG0-f*dL
-        
-        def Lfactor(f,T=T):
-            Lp=0.358 #planar, nm
-            Lh=0.280 #helical, nm
-            Kb=(1.38065e-2)
-            therm=Kb*T
-            dG=deltaG(f)
-            
-            return Lp/(np.exp(dG/therm)+1)+Lh/(np.exp(-dG/therm)+1)
-        
-        def coth(z):
-            '''
-            hyperbolic cotangent
-            '''
-            return 1.0/np.tanh(z)
-        
-        def x_efjc(params,f,T=T,Ks=Ks):
-            '''
-            efjc function for ODR fitting
-            '''
-            
-            Ns=params[0]
-            invkl=params[1]
-            Kb=(1.38065e-2)
-            therm=Kb*T            
-            beta=(f/therm)/invkl
-                        
-            x=Ns*Lfactor(f)*(coth(beta)-1.0/beta)+Ns*f/Ks
-            return x
-        
-        def x_efjc_plfix(params,f,kl_value=pl_value,T=T,Ks=Ks):
-            '''
-            efjc function for ODR fitting
-            '''
-            
-            Ns=params
-            invkl=1.0/kl_value
-            Kb=(1.38065e-2)
-            therm=Kb*T
-            beta=(f/therm)/invkl
-            
-            x=Ns*Lfactor(f)*(coth(beta)-1.0/beta)+Ns*f/Ks
-            return x
         
-        #make the ODR fit
-        realdata=scipy.odr.RealData(ychunk_corr_up_pn,xchunk_corr_up_nm)
+        #The parameters are [Ns=number of monomers, 1/Kuhn length]: the start ones
+        #are guessed from the chunk (see libfit.efjc_guess)
+        #With a fixed Kuhn length the eFJC is linear in Ns, and the fit is solved directly.
         if pl_value:
-            model=scipy.odr.Model(x_efjc_plfix)
-            o = scipy.odr.ODR(realdata, model, p0_plfix)
+            fixed=1.0/pl_value
+            beta,sd_beta=lfit.efjc_monomers_fit(ychunk_corr_up_pn,xchunk_corr_up_nm,T,fixed)
         else:
             print 'WARNING eFJC fit with free pl sometimes does not converge'
-            model=scipy.odr.Model(x_efjc)
-            o = scipy.odr.ODR(realdata, model, p0)
-        
-        o.set_job(fit_type=2)
-        out=o.run()
-    
-        
-        Ns=out.beta[0]
-        Lc=Ns*Lp*1e-9 
-        if len(out.beta)>1:
-            kfit=1e-9/out.beta[1]
-            kfitnm=1/out.beta[1]
+            fixed=None
+            p0=lfit.efjc_guess(ychunk_corr_up_pn,xchunk_corr_up_nm,T,pl_value)
+            #make the ODR fit (extension as a function of force), with the analytic derivatives of the eFJC
+            out=lfit.odr_fit('efjc',ychunk_corr_up_pn,xchunk_corr_up_nm,p0,T,fixed)
+            beta,sd_beta=out.beta,out.sd_beta
+        
+        Ns=beta[0]
+        Lc=Ns*lfit.EFJC_LP*1e-9 
+        if len(beta)>1:
+            kfit=1e-9/beta[1]
+            kfitnm=1/beta[1]
         else:
             kfit=1e-9*pl_value
             kfitnm=pl_value
@@ -506,86 +368,31 @@ class fitCommands:
         
         #Calculate fit errors from output standard deviations.
         fit_errors=[]
-        fit_errors.append(out.sd_beta[0]*Lp*1e-9)
-        if len(out.beta)>1:
-            fit_errors.append(1e9*out.sd_beta[1]*kfit**2)
-            
-  
-        
-        def efjc_eval(y,params,pl_value,T=T,Lfactor=Lfactor,Ks=Ks):    
-            '''
-            Evaluates the eFJC function
-            '''
-            if not pl_value:
-                Ns, invkl = params
-            else:
-                Ns = params
-        
-            if pl_value:
-                invkl=1.0/pl_value
-        
-            Kb=(1.38065e-2) #boltzmann constant
-            therm=Kb*T #so we have thermal energy
-            beta=(y/therm)/invkl
-
-            x= Ns*Lfactor(y)*(coth(beta)-1.0/beta)+Ns*y/Ks
-            
-            return x
+        fit_errors.append(sd_beta[0]*lfit.EFJC_LP*1e-9)
+        if len(beta)>1:
+            fit_errors.append(1e9*sd_beta[1]*kfit**2)
             
         #STEP 3: plotting the fit
-        #obtain domain to plot the fit - from contact point to last_index plus 20 points
-        thule_index=last_index+10
-        if thule_index > len(xvector): #for rare cases in which we fit something at the END of whole curve.
-            thule_index = len(xvector)
-        #reverse etc. the domain
-        ychunk=yvector[clicked_points[0].index:thule_index]
-
-        if len(ychunk)>0:
-            y_evalchunk=np.linspace(min(ychunk),max(ychunk),100)
-        else:
-            #Empty y-chunk. It happens whenever we set the contact point after a recognized peak,
-            #or other buggy situations. Kludge to live with it now...
-            ychunk=yvector[:thule_index]
-            y_evalchunk=np.linspace(min(ychunk),max(ychunk),100)
-            
-        yfit_down=[-y for y in y_evalchunk]
-        yfit_corr_down=[y+clicked_points[0].graph_coords[1] for y in yfit_down]
-        yfit_corr_down=scipy.array(yfit_corr_down)
+        yfit_down=self._fit_line(clicked_points,yvector,last_index)
+        yfit_corr_down=yfit_down+clicked_points[0].graph_coords[1]
         
         #the fitted curve: reflip, re-uncorrect
-        xfit=efjc_eval(1e12*yfit_corr_down, out.beta, pl_value,T)*1e-9
-        xfit=list(xfit)
-        xfit.reverse()
-        xfit_chunk_corr_up=[-(x-clicked_points[0].graph_coords[0]) for x in xfit]
-        
-        #xfit_chunk_corr_up=scipy.array(xfit_chunk_corr_up)
-        #deltay=yfit_down[0]-yvector[clicked_points[0].index]
-        
-        #This is a terrible, terrible kludge to find the point where it should normalize (and from where it should plot)
-        xxxdists=[]
-        for index in scipy.arange(1,len(xfit_chunk_corr_up),1):
-            xxxdists.append((clicked_points[0].graph_coords[0]-xfit_chunk_corr_up[index])**2)           
-        normalize_index=xxxdists.index(min(xxxdists))
-        #End of kludge
-        
-        deltay=yfit_down[normalize_index]-clicked_points[0].graph_coords[1]
-        yfit_corr_down=[y-deltay for y in yfit_down]
+        xfit=lfit.efjc(beta,1e12*yfit_corr_down,T,fixed)*1e-9
+        yfit_corr_down,xfit_chunk_corr_up=self._fit_normalize(clicked_points,yfit_down,xfit)
         
         #calculate fit quality
         #creates dense y vector
         yqeval=np.linspace(np.min(ychunk_corr_up_pn)/2,np.max(ychunk_corr_up_pn)*2,10*len(ychunk_corr_up_pn))
         #corresponding fitted x
-        xqeval=efjc_eval(yqeval,out.beta,pl_value)
+        xqeval=lfit.efjc(beta,yqeval,T,fixed)
         
-        qsum=0
-        for qindex in np.arange(0,len(ychunk_corr_up_pn)):
-            qsum+=dist(xchunk_corr_up_nm[qindex],ychunk_corr_up_pn[qindex],xqeval,yqeval)        
+        qsum=lfit.nearest_sum(xchunk_corr_up_nm,ychunk_corr_up_pn,xqeval,yqeval)
         qstd=1e-12*np.sqrt(qsum/len(ychunk_corr_up_pn))
             
         if return_errors:
-            return fit_out, yfit_corr_down[normalize_index+1:], xfit_chunk_corr_up[normalize_index+1:], fit_errors, qstd
+            return fit_out, yfit_corr_down, xfit_chunk_corr_up, fit_errors, qstd
         else:
-            return fit_out, yfit_corr_down[normalize_index+1:], xfit_chunk_corr_up[normalize_index+1:], None, qstd
+            return fit_out, yfit_corr_down, xfit_chunk_corr_up, None, qstd
             
     
    
@@ -650,12 +457,20 @@ class fitCommands:
         
         reclick : redefines by hand the contact point, if noauto has been used before
                   but the user is unsatisfied of the previously choosen contact point.
+        
+        joint=[n] : fits n chunks (e.g. n peaks) together, with a contour length each and a shared
+                    persistence length (WLC only). Click the two edges of each chunk in turn.
         ---------
-        Syntax: fit [pl=(value)] [t=value] [noauto]
+        Syntax: fit [pl=(value)] [t=value] [noauto] [joint=n]
         '''
         pl_value=None
+        joint=0
         T=self.config['temperature']
         for arg in args.split():
+            #look for a joint fit argument.
+            if 'joint=' in arg:
+                joint=int(arg.split('=')[1])
+                continue
             #look for a persistent length argument.
             if 'pl=' in arg:
                 pl_expression=arg.split('=')
@@ -694,19 +509,23 @@ class fitCommands:
             contact_point.find_graph_coords(displayed_plot.vectors[1][0], displayed_plot.vectors[1][1])
             contact_point.is_marker=True
             
+        if joint:
+            self._fit_joint(displayed_plot,contact_point,joint,pl_value,T)
+            return
+        
         print 'Click edges of chunk'
         points=self._measure_N_points(N=2, whatset=1)
         points=[contact_point]+points
       
         try:
             if self.config['fit_function']=='wlc':
-                params, yfit, xfit, fit_errors,qstd = self.wlc_fit(points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T, return_errors=True )
+                params, yfit, xfit, fit_errors,qstd = self.cached_fit('wlc',points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T)
                 name_of_charlength='Persistent length'
             elif self.config['fit_function']=='fjc':
-                params, yfit, xfit, fit_errors,qstd = self.fjc_fit(points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T, return_errors=True )
+                params, yfit, xfit, fit_errors,qstd = self.cached_fit('fjc',points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T)
                 name_of_charlength='Kuhn length'
             elif self.config['fit_function']=='efjc':
-                params, yfit, xfit, fit_errors,qstd = self.efjc_fit(points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T, return_errors=True )
+                params, yfit, xfit, fit_errors,qstd = self.cached_fit('efjc',points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T)
                 name_of_charlength='Kuhn length (e)'                    
             else:
                 print 'No recognized fit function defined!'
@@ -761,12 +580,56 @@ class fitCommands:
         
         self._send_plot([fitplot])
     
+    def _fit_joint(self,displayed_plot,contact_point,count,pl_value,T):
+        '''
+        fit joint=n: asks for the edges of count chunks, and fits them together (see wlc_joint_fit)
+        '''
+        if self.config['fit_function']!='wlc':
+            print 'The joint fit is available for the WLC only: set fit_function wlc'
+            return
+        
+        print 'Click edges of the',count,'chunks'
+        points=self._measure_N_points(N=2*count, whatset=1)
+        chunk_points=[(points[2*i],points[2*i+1]) for i in range(count)]
+        
+        try:
+            results=self.wlc_joint_fit(contact_point, chunk_points, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1], pl_value, T)
+        except:
+            print 'Fit not possible. Probably wrong intervals -did you click *different* points?'
+            return
+        
+        print 'Fit function: wlc, joint fit of',count,'chunks'
+        for i in range(count):
+            params,yfit,xfit,fit_errors,qstd=results[i]
+            print 'Contour length (chunk %d): %.2f nm, standard deviation %.2f' %(i,params[0]*(1.0e+9),fit_errors[0]*(1.0e+9))
+            to_dump='contour '+self.current.path+' %.2f nm'%(params[0]*(1.0e+9))
+            self.outlet.push(to_dump)
+        if len(params)==2: #if we did choose 2-value fit
+            print 'Persistent length: %.2f nm, standard deviation %.2f' %(params[1]*(1.0e+9),fit_errors[1]*(1.0e+9))
+            to_dump='persistent '+self.current.path+' %.2f nm' %(params[1]*(1.0e+9))
+            self.outlet.push(to_dump)
+        
+        #the fits and the clicked points along the curves
+        fitplot=copy.deepcopy(displayed_plot)
+        for params,yfit,xfit,fit_errors,qstd in results:
+            fitplot.add_set(xfit,yfit)
+        fitplot.add_set([item.graph_coords[0] for item in [contact_point]+points],[item.graph_coords[1] for item in [contact_point]+points])
+        
+        if fitplot.styles==[]:
+            fitplot.styles=[None,None]
+        if fitplot.colors==[]:
+            fitplot.colors=[None,None]
+        fitplot.styles+=[None]*count+['scatter']
+        fitplot.colors+=[None]*(count+1)
+        
+        self._send_plot([fitplot])
+    
   
 
     #----------
     
     
-    def find_contact_point(self,plot=False):
+    def find_contact_point(self,plot=False,current=None):
         '''
         Finds the contact point on the curve.
     
@@ -780,68 +643,93 @@ class fitCommands:
         Then, start from the rise of the retraction curve and look at the first point below the
         baseline.
         
+        The contact point is kept in the memo of current (the HookeCurve of the plot, by default
+        the current curve) with a fingerprint of the plot data, and found again only if they change.
+        
         FIXME: should be moved, probably to generalvclamp.py
         '''
         
         if not plot:
             plot=self.plots[0]
+        if current is None:
+            current=self.current
         
-        outplot=self.subtract_curves(1)
-        xret=outplot.vectors[1][0]
-        ydiff=outplot.vectors[1][1]
-
         xext=plot.vectors[0][0]
-        yext=plot.vectors[0][1]
-        xret2=plot.vectors[1][0]
-        yret=plot.vectors[1][1]
+        yext=np.asarray(plot.vectors[0][1],float)
+        xret=plot.vectors[1][0]
+        yret=np.asarray(plot.vectors[1][1],float)
+        
+        fingerprint=hashlib.sha1(repr((len(xext),len(xret))))
+        for vector in (yext,yret):
+            fingerprint.update(np.ascontiguousarray(vector).tostring())
+        memo=current.memo.get('contact_point')
+        if memo is not None and memo[0]==fingerprint.hexdigest():
+            return memo[1]
+        
+        index=self._contact_point(yext,yret,min(len(xext),len(xret)))
+        current.memo['contact_point']=(fingerprint.hexdigest(),index)
+        return index
+    
+    def _contact_point(self,yext,yret,length):
+        '''
+        find_contact_point() on the y vectors; length is the number of points of the
+        retraction minus extension difference.
+        '''
+        ydiff=yret[:length]-yext[:length]
         
         #taking care of the picoforce trigger bug: we exclude portions of the curve that have too much
         #standard deviation. yes, a lot of magic is here.
-        monster=True
-        monlength=len(xret)-int(len(xret)/20)
-        finalength=len(xret)
-        while monster:
-            monchunk=scipy.array(ydiff[monlength:finalength])
-            if abs(np.std(monchunk)) < 2e-10:
-                monster=False
-            else: #move away from the monster
-                monlength-=int(len(xret)/50)
-                finalength-=int(len(xret)/50)
-    
-    
+        #The ydiff[monlength:finalength] windows are moved away from the monster, int(length/50) points
+        #at a time, until one is quiet enough: the standard deviations of all of them are computed at
+        #once, from the prefix sums of ydiff. Windows are python slices: they wrap around once
+        #the indexes become negative, and are all empty when they are below -length.
+        step=int(length/50)
+        if step:
+            moves=np.arange(0,2*length/step+2)*step
+        else:
+            moves=np.zeros(1,int)
+        monlengths=length-int(length/20)-moves
+        finalengths=length-moves
+        starts,stops=[np.clip(np.where(bound<0,bound+length,bound),0,length) for bound in (monlengths,finalengths)]
+        counts=np.maximum(stops-starts,0)
+        stops=starts+counts
+        
+        centred=ydiff-np.mean(ydiff) if length else ydiff
+        sums=np.concatenate(([0.0],np.cumsum(centred)))
+        squares=np.concatenate(([0.0],np.cumsum(centred*centred)))
+        errors=np.seterr(divide='ignore',invalid='ignore')
+        try:
+            means=(sums[stops]-sums[starts])/counts
+            stds=np.sqrt(np.maximum((squares[stops]-squares[starts])/counts-means*means,0))
+            quiet=np.flatnonzero(stds < 2e-10)
+        finally:
+            np.seterr(**errors)
+        if len(quiet):
+            monlength=monlengths[quiet[0]]
+        elif np.isnan(stds).all():
+            monlength=monlengths[0]
+        else:
+            #no window is quiet enough (the loop of old never ended): take the quietest one
+            monlength=monlengths[np.nanargmin(stds)]
+        
         #take half of the thing
-        endlength=int(len(xret)/2)
-    
-        ok=False
-        
-        while not ok:
-            xchunk=yext[endlength:monlength]
-            ychunk=yext[endlength:monlength]
-            regr=scipy.stats.linregress(xchunk,ychunk)[0:2]
-            #we stop if we found an almost-horizontal fit or if we're going too short...
-            #FIXME: 0.1 and 6 here are "magic numbers" (although reasonable)
-            if (abs(regr[1]) > 0.1) and ( endlength < len(xret)-int(len(xret)/6) ) :
-                endlength+=10
-            else:
-                ok=True  
-                  
+        #(the search for an almost-horizontal fit regressed the chunk against itself: its intercept is
+        #always 0, and the first chunk was always kept)
+        endlength=int(length/2)
+        ychunk=yext[endlength:monlength]
+        if len(ychunk)==0:
+            raise ValueError, 'No baseline points to find the contact point.'
         
         ymean=np.mean(ychunk) #baseline
-    
-        index=0
-        point = ymean+1
-    
+        if np.isnan(ymean):
+            return 0
+        
         #find the first point below the calculated baseline
-        while point > ymean:
-            try:
-                point=yret[index]
-                index+=1    
-            except IndexError:
-                #The algorithm didn't find anything below the baseline! It should NEVER happen
-                index=0            
-                return index
-            
-        return index
+        below=np.flatnonzero(~(yret > ymean))
+        if len(below)==0:
+            #The algorithm didn't find anything below the baseline! It should NEVER happen
+            return 0
+        return int(below[0])+1
                         
     
     
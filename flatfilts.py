@@ -25,6 +25,7 @@ from numpy import diff
 
 import libpeakspot as lps
 import libhookecurve as lhc
+import libpool as lpool
 
 
 class flatfiltsCommands:
@@ -60,6 +61,9 @@ class flatfiltsCommands:
 
         If called without arguments, it uses default values, that
         should work most of the times.
+
+        Curves are processed in parallel by "set workers" processes
+        (0 = as many as the processors).
         '''
         median_filter=7
         min_npks=4
@@ -75,14 +79,17 @@ class flatfiltsCommands:
         print 'Processing playlist...'
         notflat_list=[]
         
+        def has_features(cli,item):
+            return cli.has_features(item, median_filter, min_npks, min_deviation)
+        
         c=0
-        for item in self.current_list:
+        for ok,notflat in lpool.map_curves(has_features,self,self.current_list,self.config['workers']):
+            item=self.current_list[c]
             c+=1
-                                   
-            try:
-                notflat=self.has_features(item, median_filter, min_npks, min_deviation)
+            
+            if ok:
                 print 'Curve',item.path, 'is',c,'of',len(self.current_list),': features are ',notflat
-            except:
+            else:
                 notflat=False
                 print 'Curve',item.path, 'is',c,'of',len(self.current_list),': cannot be filtered. Probably unable to retrieve force data from corrupt file.'
             
@@ -148,9 +155,10 @@ class flatfiltsCommands:
     #-----Convolution-based peak recognition and filtering.
     #Requires the libpeakspot.py library
     
-    def has_peaks(self, plot, abs_devs=None, maxpeak=True, window=10, nocontact=False):
+    def has_peaks(self, plot, abs_devs=None, maxpeak=True, window=10, nocontact=False, current=None):
         '''
         Finds peak position in a force curve.
+        current is the HookeCurve of the plot (default: the current curve).
         FIXME: should be moved in libpeakspot.py
         '''
         if abs_devs==None:
@@ -163,19 +171,16 @@ class flatfiltsCommands:
         convoluted=lps.conv_dx(yret, self.convfilt_config['convolution'])
         
         #cut everything before the contact point
-        cut_index=self.find_contact_point(plot)
+        cut_index=self.find_contact_point(plot,current)
 	#with the curves without a contact region we don't want any cut
 	if nocontact==True:
 	  cut_index=0
 
         #cut even more, before the blind window
-        start_x=xret[cut_index]
-        blind_index=0
-        for value in xret[cut_index:]:
-            if abs((value) - (start_x)) > self.convfilt_config['blindwindow']*(10**-9):
-                break
-            blind_index+=1
-        cut_index+=blind_index
+        blind_index=lhc.index_at_distance(xret,cut_index,self.convfilt_config['blindwindow']*(10**-9),strict=True)
+        if blind_index is None:
+            blind_index=len(xret)
+        cut_index=blind_index
         #do the dirty convolution-peak finding stuff
         noise_level=lps.noise_absdev(convoluted[cut_index:], self.convfilt_config['positive'], self.convfilt_config['maxcut'], self.convfilt_config['stable'])               
         above=lps.abovenoise(convoluted,noise_level,cut_index,abs_devs)     
@@ -217,7 +222,7 @@ class flatfiltsCommands:
                     flatten=self._find_plotmanip('flatten') #extract flatten plot manipulator
                     plot=flatten(plot, item, customvalue=1)
         
-        peak_location,peak_size=self.has_peaks(plot,abs_devs)
+        peak_location,peak_size=self.has_peaks(plot,abs_devs,current=item)
         #close all open files
         item.curve.close_all()
         #needed to avoid *big* memory leaks!
@@ -300,6 +305,9 @@ class flatfiltsCommands:
         (to set the default, see convfilt.conf file; CONVCONF and SETCONF commands)
 
         If called without arguments, it uses default values.
+
+        Curves are processed in parallel by "set workers" processes
+        (0 = as many as the processors).
         '''
         
         min_npks=self.convfilt_config['minpeaks']
@@ -316,18 +324,22 @@ class flatfiltsCommands:
         print '(Please wait)'
         notflat_list=[]
         
+        def exec_has_peaks(cli,item):
+            return cli.exec_has_peaks(item,min_deviation)
+        
         c=0
-        for item in self.current_list:
+        for ok,peaks in lpool.map_curves(exec_has_peaks,self,self.current_list,self.config['workers']):
+            item=self.current_list[c]
             c+=1
-                                   
-            try:    
-                peak_location,peak_size=self.exec_has_peaks(item,min_deviation)
+            
+            if ok:
+                peak_location,peak_size=peaks
                 if len(peak_location)>=min_npks:
                     isok='+'
                 else:
                     isok=''
                 print 'Curve',item.path, 'is',c,'of',len(self.current_list),': found '+str(len(peak_location))+' peaks.'+isok
-            except:
+            else:
                 peak_location,peak_size=[],[]
                 print 'Curve',item.path, 'is',c,'of',len(self.current_list),': cannot be filtered. Probably unable to retrieve force data from corrupt file.'
             
@@ -337,9 +349,6 @@ class flatfiltsCommands:
                 item.curve=None #empty the item object, to further avoid memory leak
                 notflat_list.append(item)
 
-            for i in range(1000):
-		 k=0
-
         #Warn that no flattening had been done.
         if not ('flatten' in self.config['plotmanips']):
             print 'Flatten manipulator was not found. Processing was done without flattening.'
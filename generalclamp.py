@@ -32,41 +32,34 @@ class generalclampCommands:
             lower = int((self.config['fc_interesting'])-1)
             upper = int((self.config['fc_interesting'])+1)
             trim = current.curve.trimindexes()[lower:upper]
-            newtime = []
-            newzpiezo = []
-            newphase = []
-            for x in range(trim[0],trim[1]):
-                newtime.append(self.plots[0].vectors[0][0][x])
-                newzpiezo.append(self.plots[0].vectors[0][1][x])
-                newphase.append(self.plots[0].vectors[1][1][x])
-            self.plots[0].vectors[0][0] = newtime
-            self.plots[0].vectors[0][1] = newzpiezo
-            self.plots[0].vectors[1][0] = newtime
-            self.plots[0].vectors[1][1] = newphase
+            newtime = lhc.DataChunk(plot.vectors[0][0])[trim[0]:trim[1]]
+            newzpiezo = lhc.DataChunk(plot.vectors[0][1])[trim[0]:trim[1]]
+            newphase = lhc.DataChunk(plot.vectors[1][1])[trim[0]:trim[1]]
+            plot.vectors[0][0] = newtime
+            plot.vectors[0][1] = newzpiezo
+            plot.vectors[1][0] = newtime
+            plot.vectors[1][1] = newphase
 
         if self.config['fc_interesting'] != 0 and plot.destination==1:
             lower = int((self.config['fc_interesting'])-1)
             upper = int((self.config['fc_interesting'])+1)
             trim = current.curve.trimindexes()[lower:upper]
-            newtime = []
-            newdefl = []
-            newimposed = []
-            for x in range(trim[0],trim[1]):
-                newtime.append(self.plots[1].vectors[0][0][x])
-                newdefl.append(self.plots[1].vectors[0][1][x])
-                newimposed.append(self.plots[1].vectors[1][1][x])
-            self.plots[1].vectors[0][0] = newtime
-            self.plots[1].vectors[0][1] = newdefl
-            self.plots[1].vectors[1][0] = newtime
-            self.plots[1].vectors[1][1] = newimposed            
+            newtime = lhc.DataChunk(plot.vectors[0][0])[trim[0]:trim[1]]
+            newdefl = lhc.DataChunk(plot.vectors[0][1])[trim[0]:trim[1]]
+            newimposed = lhc.DataChunk(plot.vectors[1][1])[trim[0]:trim[1]]
+            plot.vectors[0][0] = newtime
+            plot.vectors[0][1] = newdefl
+            plot.vectors[1][0] = newtime
+            plot.vectors[1][1] = newimposed            
                         
         if self.config['fc_showphase'] == 0 and plot.destination==0:
-            self.plots[0].remove_set(1)
+            plot.remove_set(1)
             
         if self.config['fc_showimposed'] == 0 and plot.destination==1:
-            self.plots[1].remove_set(1)
+            plot.remove_set(1)
                          
         return plot
+    plotmanip_clamp.config_keys=('fc_showphase', 'fc_showimposed', 'fc_interesting')
       
     def do_time(self,args):
         '''
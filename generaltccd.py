@@ -6,6 +6,10 @@ generaltccd.py
 General utilities for TCCD stuff
 '''
 
+import numpy as np
+
+import libhookecurve as lhc
+
 class generaltccdCommands:
     
     def plotmanip_threshold(self, plot, current, customvalue=False):
@@ -26,16 +30,11 @@ class generaltccdCommands:
             thresh=self.config['tccd_threshold']
         
         for set in plot.vectors:
-            newy=[]
-            for value in set[1]:
-                if abs(value) < thresh:
-                    newy.append(0)
-                else:
-                    newy.append(value)
-            
-            set[1]=newy
+            y=lhc.DataChunk(set[1])
+            set[1]=lhc.DataChunk(np.where(abs(y) < thresh, 0, y))
                     
         return plot
+    plotmanip_threshold.config_keys=('tccd_threshold',)
                 
 
     def plotmanip_coincident(self,plot,current, customvalue=False):
@@ -48,17 +47,12 @@ class generaltccdCommands:
         if not self.config['tccd_coincident'] and (not customvalue):
             return plot
         
-        newred=[]
-        newblue=[]
-        for index in range(len(plot.vectors[0][1])):
-            if abs(plot.vectors[0][1][index])>self.config['tccd_threshold'] and abs(plot.vectors[1][1][index])>self.config['tccd_threshold']:
-                newred.append(plot.vectors[0][1][index])
-                newblue.append(plot.vectors[1][1][index])
-            else:
-                newred.append(0)
-                newblue.append(0)
-                
-        plot.vectors[0][1]=newred
-        plot.vectors[1][1]=newblue
+        red=lhc.DataChunk(plot.vectors[0][1])
+        blue=lhc.DataChunk(plot.vectors[1][1])[:len(red)]
+        coincident=(abs(red)>self.config['tccd_threshold']) & (abs(blue)>self.config['tccd_threshold'])
+        
+        plot.vectors[0][1]=lhc.DataChunk(np.where(coincident, red, 0))
+        plot.vectors[1][1]=lhc.DataChunk(np.where(coincident, blue, 0))
      
-        return plot
\ No newline at end of file
+        return plot
+    plotmanip_coincident.config_keys=('tccd_coincident', 'tccd_threshold')
\ No newline at end of file
@@ -14,9 +14,12 @@ from wx import PostEvent
 import numpy as np
 import scipy as sp
 import copy
+import hashlib
 import os.path
 import time
 
+import libhookecurve as lhc
+
 import warnings
 warnings.simplefilter('ignore',np.RankWarning)
 
@@ -27,6 +30,8 @@ class generalvclampCommands:
         self.basecurrent=None
         self.basepoints=None
         self.autofile=''
+        #(x vector, y vector, lhc.LineFits) of the last set fitted with linefit_between()
+        self.line_fits=None
     
     def do_distance(self,args):
         '''
@@ -201,20 +206,18 @@ class generalvclampCommands:
             return plot
         
         #only one set is present...
-        if len(self.plots[0].vectors) != 2:
+        if len(plot.vectors) != 2:
             return plot
         
         #multiplier is 1...
         if (self.config['force_multiplier']==1):
             return plot
 
-        for i in range(len(plot.vectors[0][1])):
-            plot.vectors[0][1][i]=plot.vectors[0][1][i]*self.config['force_multiplier']        
-
-        for i in range(len(plot.vectors[1][1])):
-            plot.vectors[1][1][i]=plot.vectors[1][1][i]*self.config['force_multiplier']
+        plot.vectors[0][1]=lhc.DataChunk(plot.vectors[0][1])*self.config['force_multiplier']
+        plot.vectors[1][1]=lhc.DataChunk(plot.vectors[1][1])*self.config['force_multiplier']
 
         return plot            
+    plotmanip_multiplier.config_keys=('force_multiplier',)
    
     
     def plotmanip_flatten(self, plot, current, customvalue=False):
@@ -231,7 +234,7 @@ class generalvclampCommands:
             return plot
         
         #only one set is present...
-        if len(self.plots[0].vectors) != 2:
+        if len(plot.vectors) != 2:
             return plot
         
         #config is not flatten, and customvalue flag is false too
@@ -246,12 +249,6 @@ class generalvclampCommands:
         else:
             max_cycles=self.config['flatten'] #Using > 1 usually doesn't help and can give artefacts. However, it could be useful too.
         
-        contact_index=self.find_contact_point()
-        
-        valn=[[] for item in range(max_exponent)]
-        yrn=[0.0 for item in range(max_exponent)]
-        errn=[0.0 for item in range(max_exponent)]
-        
         #Check if we have a proper numerical value
         try:
             zzz=int(max_cycles)
@@ -262,38 +259,100 @@ class generalvclampCommands:
             Using zero.'''
             max_cycles=0
         
+        #the baselines found for the same data and number of cycles are kept with the curve
+        fingerprint=hashlib.sha1()
+        for vector in plot.vectors[0][:2]+plot.vectors[1][:2]:
+            fingerprint.update(np.ascontiguousarray(vector,float).tostring())
+        key=(int(max_cycles),fingerprint.hexdigest())
+        memo=current.memo.get('flatten')
+        if memo is not None and memo[0]==key:
+            contact_index,baselines=memo[1]
+        else:
+            try:
+                contact_index=self.find_contact_point(plot,current)
+            except Exception,e:
+                print 'Cannot flatten!'
+                print e
+                return plot
+            baselines=None
+        
+        cycles=[]
         for i in range(int(max_cycles)):
             
             x_ext=plot.vectors[0][0][contact_index+delta_contact:]
             y_ext=plot.vectors[0][1][contact_index+delta_contact:]
             x_ret=plot.vectors[1][0][contact_index+delta_contact:]
             y_ret=plot.vectors[1][1][contact_index+delta_contact:]
-            for exponent in range(max_exponent):
-                try:
-                    valn[exponent]=sp.polyfit(x_ext,y_ext,exponent)
-                    yrn[exponent]=sp.polyval(valn[exponent],x_ret)
-                    errn[exponent]=sp.sqrt(sum((yrn[exponent]-y_ext)**2)/float(len(y_ext)))
-                except Exception,e:
-                    print 'Cannot flatten!'
-                    print e
-                    return plot
-
-            best_exponent=errn.index(min(errn))
+            try:
+                if baselines is None:
+                    cycles.append(self._flatten_fit(x_ext,y_ext,x_ret,max_exponent))
+                else:
+                    cycles.append(baselines[i])
+                baseline=self._flatten_baseline(cycles[-1],x_ret)
+            except Exception,e:
+                print 'Cannot flatten!'
+                print e
+                return plot
             
             #extension
-            ycorr_ext=y_ext-yrn[best_exponent]+y_ext[0] #noncontact part
+            ycorr_ext=y_ext-baseline+y_ext[0] #noncontact part
             yjoin_ext=np.array(plot.vectors[0][1][0:contact_index+delta_contact]) #contact part        
             #retraction
-            ycorr_ret=y_ret-yrn[best_exponent]+y_ext[0] #noncontact part
+            ycorr_ret=y_ret-baseline+y_ext[0] #noncontact part
             yjoin_ret=np.array(plot.vectors[1][1][0:contact_index+delta_contact]) #contact part
                 
             ycorr_ext=np.concatenate((yjoin_ext, ycorr_ext))
             ycorr_ret=np.concatenate((yjoin_ret, ycorr_ret))
         
-            plot.vectors[0][1]=list(ycorr_ext)
-            plot.vectors[1][1]=list(ycorr_ret)
+            plot.vectors[0][1]=lhc.DataChunk(ycorr_ext)
+            plot.vectors[1][1]=lhc.DataChunk(ycorr_ret)
         
+        current.memo['flatten']=(key,(contact_index,cycles))
         return plot
+    plotmanip_flatten.config_keys=('flatten',)
+    
+    def _flatten_fit(self,x_ext,y_ext,x_ret,max_exponent):
+        '''
+        Chooses the flatten baseline among the least squares polynomials of y_ext(x_ext) of degree
+        0 to max_exponent-1: the one that, evaluated on x_ret, is nearest (rms) to y_ext.
+        
+        All the polynomials come from a single QR decomposition of the Vandermonde matrix of
+        x_ext (mapped on [-1,1]): the fit of degree n only needs the first n+1 columns of it.
+        Returns the baseline as (centre, half width, coefficients) for _flatten_baseline().
+        '''
+        x_ext=np.asarray(x_ext,float)
+        y_ext=np.asarray(y_ext,float)
+        x_ret=np.asarray(x_ret,float)
+        if len(x_ext)==0:
+            raise ValueError, 'no points to fit'
+        centre=(x_ext.max()+x_ext.min())/2
+        half=(x_ext.max()-x_ext.min())/2
+        if half==0:
+            half=1.0
+        
+        #a polynomial cannot have more coefficients than distinct points
+        degrees=min(max_exponent,len(np.unique(x_ext)))
+        vander_ext=np.vander((x_ext-centre)/half,degrees)[:,::-1]
+        q,r=np.linalg.qr(vander_ext)
+        qy=np.dot(q.T,y_ext)
+        #coefficients[:n+1,n] are the coefficients (increasing powers) of the fit of degree n
+        coefficients=np.zeros((degrees,degrees))
+        for n in range(degrees):
+            coefficients[:n+1,n]=np.linalg.solve(r[:n+1,:n+1],qy[:n+1])
+        
+        vander_ret=np.vander((x_ret-centre)/half,degrees)[:,::-1]
+        yrn=np.dot(vander_ret,coefficients)
+        errn=np.sqrt(np.sum((yrn-y_ext[:,np.newaxis])**2,axis=0)/float(len(y_ext)))
+        best_exponent=int(np.argmin(errn))
+        
+        return centre,half,coefficients[:best_exponent+1,best_exponent]
+    
+    def _flatten_baseline(self,baseline,x_ret):
+        '''
+        Evaluates on x_ret a baseline found by _flatten_fit()
+        '''
+        centre,half,coefficients=baseline
+        return np.polyval(coefficients[::-1],(np.asarray(x_ret,float)-centre)/half)
             
     #---SLOPE---
     def do_slope(self,args):
@@ -397,11 +456,29 @@ class generalvclampCommands:
         xtofit=self.plots[0].vectors[whatset][0][index1:index2]
         ytofit=self.plots[0].vectors[whatset][1][index1:index2]
         
-        # Does the actual linear fitting (simple least squares with numpy.polyfit)
-        linefit=[]
-        linefit=np.polyfit(xtofit,ytofit,1)
+        # Does the actual linear fitting (simple least squares, from the sums of the set)
+        linefit=self._line_fits(whatset).fit(index1,index2)
 
         return (linefit[0],linefit[1],xtofit,ytofit)
     
+    def slopes_at(self,points,span,whatset=1):
+        '''
+        Slopes (as linefit_between(point-span,point) would give) at each of the points
+        (indexes on the current return trace, e.g. the peaks), at once.
+        Slopes that cannot be fitted are nan.
+        '''
+        return self._line_fits(whatset).slopes_at(points,span)
+    
+    def _line_fits(self,whatset=1):
+        '''
+        The lhc.LineFits of the whatset set of the current plot: the sums are computed
+        once, and kept as long as the plot vectors are the same.
+        '''
+        xvector=self.plots[0].vectors[whatset][0]
+        yvector=self.plots[0].vectors[whatset][1]
+        if self.line_fits is None or self.line_fits[0] is not xvector or self.line_fits[1] is not yvector:
+            self.line_fits=(xvector,yvector,lhc.LineFits(xvector,yvector))
+        return self.line_fits[2]
+    
     
     
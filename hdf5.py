@@ -14,6 +14,11 @@ import libhooke as lh
 
 class hdf5Driver(lhc.Driver):
     
+    @classmethod
+    def sniff(cls,filename,header):
+        #the magic string can be anywhere in the first line (see is_me)
+        return 'IGP-HDF5-Hooke' in lhc.header_first_line(header)
+    
     def __init__(self, filename):
         
         self.filename=filename
@@ -61,7 +66,7 @@ class hdf5Driver(lhc.Driver):
             xret.append(float(spline[2]))
             yret.append(float(spline[3]))
             
-        return [[xext,yext],[xret,yret]]
+        return [[lhc.DataChunk(xext),lhc.DataChunk(yext)],[lhc.DataChunk(xret),lhc.DataChunk(yret)]]
         
     def deflection(self):
         self.data=self._read_columns()
@@ -71,8 +76,8 @@ class hdf5Driver(lhc.Driver):
     def default_plots(self):   
         main_plot=lhc.PlotObject()
         defl_ext,defl_ret=self.deflection()
-        yextforce=[i*self.k for i in defl_ext]
-        yretforce=[i*self.k for i in defl_ret]
+        yextforce=defl_ext*self.k
+        yretforce=defl_ret*self.k
         main_plot.add_set(self.data[0][0],yextforce)
         main_plot.add_set(self.data[1][0],yretforce)
         main_plot.normalize_vectors()
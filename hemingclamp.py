@@ -18,19 +18,11 @@ __changelog__='''
 import string
 import libhookecurve as lhc 
 
-class DataChunk(list):
-    '''Dummy class to provide ext and ret methods to the data list.
-    In this case ext and self can be equal.
-    '''
-    
-    def ext(self):
-        return self
-        
-    def ret(self):
-        return self
-
 class hemingclampDriver(lhc.Driver):
     
+    #Sniffing rules (see lhc.Driver)
+    first_line='#Hemingway'
+    
     def __init__(self, filename):
         
         self.filedata = open(filename,'r')
@@ -50,7 +42,7 @@ class hemingclampDriver(lhc.Driver):
         we define our magic heuristic for HemingClamp files
         '''
         myfile=file(self.filename)
-        headerlines=myfile.readlines()[0:3]
+        headerlines=[myfile.readline() for line in range(3)]
         myfile.close()
         if headerlines[0][0:10]=='#Hemingway' and headerlines[1][0:19]=='#Experiment: FClamp':
             return True
@@ -88,22 +80,22 @@ class hemingclampDriver(lhc.Driver):
         return time,phase,zpiezo,defl,imposed,trim_indexes
         
     def time(self):
-        return DataChunk(self._getdata_all()[0])
+        return lhc.DataChunk(self._getdata_all()[0])
 
     def phase(self):
-        return DataChunk(self._getdata_all()[1])
+        return lhc.DataChunk(self._getdata_all()[1])
     
     def zpiezo(self):
-        return DataChunk(self._getdata_all()[2])
+        return lhc.DataChunk(self._getdata_all()[2])
      
     def deflection(self):
-        return DataChunk(self._getdata_all()[3])
+        return lhc.DataChunk(self._getdata_all()[3])
 
     def imposed(self):
-        return DataChunk(self._getdata_all()[4])
+        return lhc.DataChunk(self._getdata_all()[4])
 
     def trimindexes(self):
-        return DataChunk(self._getdata_all()[5])
+        return lhc.DataChunk(self._getdata_all()[5],int)
     
     def close_all(self):
         '''
@@ -14,6 +14,7 @@ This program is released under the GNU General Public License version 2.
 
 from libhooke import * #FIXME
 import libhookecurve as lhc
+import libcurvecache as lcc
 
 import libinput as linp
 import liboutlet as lout
@@ -33,6 +34,8 @@ import sys, os, os.path, glob, shutil
 import Queue
 import cmd
 import time
+import copy
+import threading
 
 global __version__
 global __codename__
@@ -84,6 +87,17 @@ class HookeCli(cmd.Cmd):
         self.config=config                      #the configuration dictionary
         self.drivers=drivers                    #the file format drivers
         
+        #on-disk cache of decoded curves, if configured
+        if self.config['curvecache']:
+            try:
+                lhc.curve_cache=lcc.CurveCache(self.config['curvecache'],float(self.config['curvecache_size']))
+            except (IOError,OSError), e:
+                print 'Cannot use curve cache directory '+self.config['curvecache']+': '+str(e)
+                lhc.curve_cache=None
+        
+        #recently decoded curves, to go back and forth in the playlist without reading files
+        self.decoded_curves=lcc.DecodedCurves(int(self.config['lru_curves']),self.config['lru_size'])
+        
         #get plot manipulation functions
         plotmanip_functions=[]
         for object_name in dir(self):
@@ -98,7 +112,14 @@ class HookeCli(cmd.Cmd):
                 self.plotmanip[nameindex] = item
             else:
                 pass
-           
+        
+        #background decoding and processing of the curves next to the current one (see _prefetch_loop)
+        self.curve_lock=threading.RLock()          #held while a curve is decoded or processed
+        self.processed_curves={}                   #path --> (file signature, plotmanip stages, see _process)
+        self.prefetch_requests=Queue.Queue()
+        self.prefetch_thread=threading.Thread(target=self._prefetch_loop)
+        self.prefetch_thread.setDaemon(True)
+        self.prefetch_thread.start()
             
         self.playlist_saved=0 #Did we save the playlist?
         self.playlist_name='' #Name of playlist
@@ -154,6 +175,201 @@ class HookeCli(cmd.Cmd):
                 break
         return displayed_plot
     
+    def _identify(self,item):
+        '''
+        identifies a curve of the playlist, taking it from the recently decoded curves if possible.
+        returns the file signature of the curve (see lhc.file_signature), or None if it cannot be read.
+        '''
+        self.decoded_curves.resize(int(self.config['lru_curves']),self.config['lru_size'])
+        try:
+            signature=lhc.file_signature(item.path)
+        except OSError:
+            signature=None
+        decoded=self.decoded_curves.get(item.path,signature)
+        if decoded is not None:
+            item.curve=decoded
+            return signature
+        
+        if not item.identify(self.drivers):
+            return None
+        item.curve=lcc.snapshot(item.path,item.curve)
+        self.decoded_curves.put(item.path,signature,item.curve)
+        return signature
+    
+    def _processing_key(self):
+        '''
+        plotmanips that do not declare their config_keys may depend on the whole configuration
+        '''
+        return repr(sorted(self.config.items()))
+    
+    def _plotmanip_keys(self):
+        '''
+        returns a key for each plotmanip stage: the output of a stage is valid as long as the
+        configuration variables it reads and the stages before it do not change.
+        A plotmanip declares the variables it reads in its config_keys attribute (a tuple of names).
+        '''
+        keys=[]
+        key=None
+        for function in self.plotmanip:
+            config_keys=getattr(function,'config_keys',None)
+            if config_keys is None:
+                values=self._processing_key()
+            else:
+                values=[self.config.get(name) for name in config_keys]
+            key=(key,function.__name__,repr(values))
+            keys.append(key)
+        return keys
+    
+    def _processed(self,stages):
+        '''
+        tells if the stages of a curve (see _process) are up to date with the configuration
+        '''
+        keys=self._plotmanip_keys()
+        return len(stages)==len(keys)+1 and (not keys or stages[-1][0]==keys[-1])
+    
+    def _process(self,item,stages=None):
+        '''
+        runs the plotmanip functions on the default plots of a (identified) curve, as a pipeline.
+        
+        Returns the list of (key, plots) stages: the default plots first (with None key), then the
+        output of each plotmanip; the plots of the last stage are the processed ones.
+        stages is the list returned by a previous run on the same curve, if any: the stages still
+        valid for the configuration are kept, and only the following ones are run again.
+        A plotmanip that leaves the plots as they are (e.g. because it is disabled) costs
+        its call only: its stage shares the plots of the one before.
+        Stage plots must not be changed: plotmanips get copies of the plot objects, and
+        replace the vectors they change, as they always did.
+        '''
+        keys=self._plotmanip_keys()
+        if stages is None:
+            stages=[(None,item.curve.default_plots())]
+        valid=1
+        while valid<len(stages) and valid<=len(keys) and stages[valid][0]==keys[valid-1]:
+            valid+=1
+        stages=stages[:valid]
+        
+        plots=self._copy_plots(stages[-1][1],False)
+        for key,function in zip(keys[valid-1:],self.plotmanip[valid-1:]):
+            #(the replaced vectors are still held by the stage before, so their ids are not reused)
+            before=[(plot,[map(id,vectors) for vectors in plot.vectors]) for plot in plots]
+            plots=[function(plot, item) for plot in plots]
+            unchanged=[(plot,[map(id,vectors) for vectors in plot.vectors]) for plot in plots]==before
+            if unchanged:
+                stages.append((key,stages[-1][1]))
+            else:
+                stages.append((key,plots))
+                plots=self._copy_plots(plots,False)
+        return stages
+    
+    def _copy_plots(self,plots,data=True):
+        '''
+        copies a list of plots, so that commands can modify them freely.
+        If data is False, the new plots share the vectors of the old ones (only the lists holding
+        them are new), and vectors must be replaced rather than changed in place.
+        '''
+        copied=[]
+        for plot in plots:
+            newplot=copy.copy(plot)
+            if data:
+                newplot.vectors=[[copy.copy(vector) for vector in vectors] for vectors in plot.vectors]
+            else:
+                newplot.vectors=[vectors[:] for vectors in plot.vectors]
+            newplot.units=plot.units[:]
+            newplot.styles=plot.styles[:]
+            newplot.colors=plot.colors[:]
+            copied.append(newplot)
+        return copied
+    
+    def _processed_plots(self,stages):
+        '''
+        returns a copy of the processed plots of a curve, ready to be shown
+        '''
+        plots=self._copy_plots(stages[-1][1])
+        for plot in plots:
+            plot.xaxes=self.config['xaxes'] #FIXME: in the future, xaxes and yaxes should be set per-plot
+            plot.yaxes=self.config['yaxes']
+        return plots
+    
+    def _prefetch(self):
+        '''
+        asks the prefetch thread to process the curves around the current one
+        '''
+        if int(self.config['prefetch']) > 0 and len(self.current_list) > 1:
+            self.prefetch_requests.put((self.current_list,self.pointer))
+    
+    def _prefetch_neighbours(self,playlist,pointer):
+        '''
+        returns the curves of playlist to prefetch around the pointer-th one: the next 'prefetch'
+        ones, and the previous ones too if 'prefetch_previous' is set
+        '''
+        count=int(self.config['prefetch'])
+        offsets=range(1,count+1)
+        if self.config['prefetch_previous']:
+            offsets=[offset for pair in zip(offsets,[-item for item in offsets]) for offset in pair]
+        neighbours=[]
+        for offset in offsets:
+            item=playlist[(pointer+offset)%len(playlist)]
+            #short playlists wrap around
+            if item is not playlist[pointer] and item not in neighbours:
+                neighbours.append(item)
+        return neighbours
+    
+    def _forget_processed(self,playlist,pointer,neighbours=None):
+        '''
+        forgets the processed curves that are not around the current one anymore, so that
+        self.processed_curves holds at most the current curve and its prefetch neighbours.
+        To be called holding self.curve_lock.
+        '''
+        if neighbours is None:
+            neighbours=self._prefetch_neighbours(playlist,pointer)
+        wanted=[item.path for item in neighbours]+[playlist[pointer].path]
+        for path in self.processed_curves.keys():
+            if path not in wanted:
+                del self.processed_curves[path]
+    
+    def _prefetch_loop(self):
+        '''
+        prefetch thread: decodes and processes the next 'prefetch' curves of the playlist
+        (and the previous ones too, if 'prefetch_previous' is set), so that next and previous
+        find them ready in self.processed_curves
+        '''
+        while True:
+            playlist,pointer=self.prefetch_requests.get()
+            #only the last request matters
+            while not self.prefetch_requests.empty():
+                playlist,pointer=self.prefetch_requests.get()
+            
+            neighbours=self._prefetch_neighbours(playlist,pointer)
+            
+            self.curve_lock.acquire()
+            try:
+                self._forget_processed(playlist,pointer,neighbours)
+            finally:
+                self.curve_lock.release()
+            
+            for item in neighbours:
+                if not self.prefetch_requests.empty():
+                    break
+                self.curve_lock.acquire()
+                try:
+                    try:
+                        cached=self.processed_curves.get(item.path)
+                        if cached is not None and cached[0]==lhc.file_signature(item.path) and self._processed(cached[1]):
+                            continue
+                        signature=self._identify(item)
+                        if signature is None:
+                            continue
+                        stages=None
+                        if cached is not None and cached[0]==signature:
+                            stages=cached[1]
+                        self.processed_curves[item.path]=(signature,self._process(item,stages))
+                        item.curve.close_all()
+                    except Exception:
+                        #the curve will be processed (and the error reported) when it is plotted
+                        self.processed_curves.pop(item.path,None)
+                finally:
+                    self.curve_lock.release()
+    
     def _send_plot(self,plots):
         '''
         sends a plot to the GUI
@@ -521,28 +737,33 @@ Syntax: plot
         '''
     def do_plot(self,args):
         
-        self.current.identify(self.drivers)
-        self.plots=self.current.curve.default_plots()
+        self.curve_lock.acquire()
         try:
-            self.plots=self.current.curve.default_plots()
-        except Exception, e:
-            print 'Unexpected error occurred in do_plot().'
-            print e
-            return
-            
-        #apply the plotmanip functions eventually present
-        nplots=len(self.plots)
-        c=0
-        while c<nplots:
-            for function in self.plotmanip: #FIXME: something strange happens about self.plotmanip[0]
-                self.plots[c]=function(self.plots[c], self.current)
-                
-            self.plots[c].xaxes=self.config['xaxes'] #FIXME: in the future, xaxes and yaxes should be set per-plot
-            self.plots[c].yaxes=self.config['yaxes']
-                
-            c+=1
+            try:
+                signature=self._identify(self.current)
+                if signature is None:
+                    return
+                stages=None
+                cached=self.processed_curves.get(self.current.path)
+                if cached is not None and cached[0]==signature:
+                    stages=cached[1]
+                stages=self._process(self.current,stages)
+                self.processed_curves[self.current.path]=(signature,stages)
+                self.plots=self._processed_plots(stages)
+                #do not depend on the prefetch thread (which may be off) to bound processed_curves
+                if 0 <= self.pointer < len(self.current_list) and self.current_list[self.pointer] is self.current:
+                    self._forget_processed(self.current_list,self.pointer)
+                else:
+                    self._forget_processed([self.current],0,[])
+            except Exception, e:
+                print 'Unexpected error occurred in do_plot().'
+                print e
+                return
+        finally:
+            self.curve_lock.release()
 
         self._send_plot(self.plots)
+        self._prefetch()
         
     def _delta(self, set=1):
         '''
@@ -975,6 +1196,21 @@ Syntax: current
                 lengths=[len(item) for item in set]
                 print 'Data set size: ',lengths
         
+    def help_cachestats(self):
+        print '''
+CACHESTATS
+Prints the statistics of the on-disk cache of decoded curves
+(see the <curvecache> section of hooke.conf).
+------
+Syntax: cachestats
+        '''
+    def do_cachestats(self,args):
+        if lhc.curve_cache is None:
+            print 'Curve cache disabled.'
+            return
+        for name,value in lhc.curve_cache.stats():
+            print name+': ',value
+        
     def do_version(self,args):
         '''
         VERSION
@@ -3,19 +3,11 @@
 import string
 import libhookecurve as lhc 
 
-class DataChunk(list):
-    #Dummy class to provide ext and ret methods to the data list.
-    
-    def ext(self):
-        halflen=(len(self)/2)
-        return self[0:halflen]
-        
-    def ret(self):
-        halflen=(len(self)/2)
-        return self[halflen:]
-
 class jpkDriver(lhc.Driver):
 
+    #Sniffing rules (see lhc.Driver)
+    first_line='# xPosition'
+
     def __init__(self, filename):
         self.filename=filename #self.filename can always be useful, and should be defined
         self.filedata = open(filename,'r') #We open the file
@@ -44,9 +36,7 @@ class jpkDriver(lhc.Driver):
         '''
         we define our magic heuristic for jpk files
         '''
-        myfile=file(self.filename)
-        headerlines=myfile.readlines()[0:3]
-        myfile.close()
+        headerlines=self.filelines[0:3]
         if headerlines[0][0:11]=='# xPosition' and headerlines[1][0:11]=='# yPosition':
             return True
         else:
@@ -88,24 +78,22 @@ class jpkDriver(lhc.Driver):
                 v_deflection.append(float(dataline[v_deflection_index]))
                 #h_deflection.append(float(dataline[h_deflection_index]))
         
+        height_ms=-lhc.DataChunk(height_ms)
+        height_m=-lhc.DataChunk(height_m)
+        height=-lhc.DataChunk(height)
+        deflection=lhc.DataChunk(v_deflection)
+        
         if self.springconstant != 0:
-            force=[item*self.springconstant for item in v_deflection]
+            force=deflection*self.springconstant
         else: #we have measured no spring constant :(
-            force=v_deflection
-            
-        height_ms=DataChunk([item*-1 for item in height_ms])
-        height_m=DataChunk([item*-1 for item in height_m])
-        height=DataChunk([item*-1 for item in height])
-        deflection=DataChunk(v_deflection)
-        force=DataChunk(force)
+            force=deflection
         
         return height_ms,height_m,height,deflection,force
         
     def deflection(self):
         height_ms,height_m,height,deflection,force=self._read_data_segment()
         deflection_ext=deflection.ext()
-        deflection_ret=deflection.ret()
-        deflection_ret.reverse()
+        deflection_ret=deflection.ret()[::-1]
         return deflection_ext,deflection_ret
         
     def default_plots(self):
@@ -113,12 +101,10 @@ class jpkDriver(lhc.Driver):
         height_ms,height_m,height,deflection,force=self._read_data_segment()
         
         height_ms_ext=height_ms.ext()
-        height_ms_ret=height_ms.ret()
         force_ext=force.ext()
-        force_ret=force.ret()
         #reverse the return data, to make it coherent with hooke standard
-        height_ms_ret.reverse()
-        force_ret.reverse()
+        height_ms_ret=height_ms.ret()[::-1]
+        force_ret=force.ret()[::-1]
         
         main_plot=lhc.PlotObject()  
         main_plot.add_set(height_ms_ext,force_ext)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+libcurvecache.py
+
+Caches of parsed curves: on disk (CurveCache) and in memory (DecodedCurves).
+
+Decoding a curve file into force/extension vectors is the dominant cost when
+reopening a playlist. The cache stores the default_plots() of the driver (and its
+deflection(), if it has one) in a numpy .npz file for each curve, keyed by the
+absolute path, size and mtime of the curve file: a file that changes on disk
+is simply decoded again.
+
+The cache is enabled by the <curvecache> section of hooke.conf.
+
+DecodedCurves keeps the last curves seen in the playlist, so that going back and
+forth between them does not read and decode the files again.
+
+This program is released under the GNU General Public License version 2.
+'''
+
+import libhookecurve as lhc
+
+import numpy
+import os
+import os.path
+import hashlib
+
+
+class CachedDriver(lhc.Driver):
+    '''
+    Stands in for the driver of a curve whose plots come from the cache.
+
+    default_plots() and deflection() are served from the cache; everything else
+    (driver-specific methods and attributes) comes from the real driver, which is
+    built only if needed.
+    '''
+    def __init__(self,path,driver,plots,deflection,filetype,experiment):
+        self.path=path
+        self.driver=driver
+        self.plots=plots
+        self.deflection_vectors=deflection
+        self.filetype=filetype
+        self.experiment=experiment
+        self.realdriver=None
+
+    def __getattr__(self,name):
+        if name.startswith('__') or name=='realdriver':
+            raise AttributeError, name
+        if self.realdriver is None:
+            self.realdriver=self.driver(self.path)
+            self.realdriver.is_me()
+        return getattr(self.realdriver,name)
+
+    def is_me(self):
+        return True
+
+    def close_all(self):
+        #a closed driver may not work anymore: build it again if needed
+        if self.realdriver is not None:
+            self.realdriver.close_all()
+            self.realdriver=None
+
+    def default_plots(self):
+        plots=[]
+        for cached_plot in self.plots:
+            plot=lhc.PlotObject()
+            for vectors in cached_plot.vectors:
+                plot.vectors.append([vector.copy() for vector in vectors])
+            plot.units=cached_plot.units[:]
+            plot.destination=cached_plot.destination
+            plot.title=cached_plot.title
+            plot.xaxes=cached_plot.xaxes
+            plot.yaxes=cached_plot.yaxes
+            plot.styles=cached_plot.styles[:]
+            plot.colors=cached_plot.colors[:]
+            plots.append(plot)
+        return plots
+
+    def deflection(self):
+        if self.deflection_vectors is None:
+            #let the real driver say what's wrong
+            return self.__getattr__('deflection')()
+        return [vector.copy() for vector in self.deflection_vectors]
+
+    def nbytes(self):
+        '''
+        Returns the memory taken by the decoded vectors, in bytes
+        '''
+        total=0
+        for plot in self.plots:
+            for vectors in plot.vectors:
+                total+=sum([vector.nbytes for vector in vectors])
+        if self.deflection_vectors is not None:
+            total+=sum([vector.nbytes for vector in self.deflection_vectors])
+        return total
+
+
+def snapshot(path,driver):
+    '''
+    Decodes a curve with its driver once, and returns a CachedDriver serving it
+    (the driver itself is kept for everything else).
+    '''
+    if isinstance(driver,CachedDriver):
+        return driver
+    plots=[]
+    for plot in driver.default_plots():
+        plot.vectors=[[lhc.DataChunk(vector).copy() for vector in vectors] for vectors in plot.vectors]
+        plots.append(plot)
+    deflection=None
+    try:
+        defl_ext,defl_ret=driver.deflection()
+        deflection=[lhc.DataChunk(defl_ext).copy(),lhc.DataChunk(defl_ret).copy()]
+    except Exception:
+        #not every driver has a deflection
+        pass
+    cached=CachedDriver(path,driver.__class__,plots,deflection,driver.filetype,driver.experiment)
+    cached.realdriver=driver
+    return cached
+
+
+class DecodedCurves:
+    '''
+    In-memory least-recently-used list of decoded curves (CachedDriver objects), keyed by path.
+    It holds at most maxcurves curves, taking at most maxsize megabytes.
+    '''
+    def __init__(self,maxcurves,maxsize):
+        self.maxcurves=maxcurves
+        self.maxsize=maxsize
+        self.items=[] #(path, signature, cached driver), most recently used last
+        self.size=0
+
+    def get(self,path,signature):
+        '''
+        Returns the decoded curve of path, or None if it is not here or the file changed.
+        '''
+        for index,item in enumerate(self.items):
+            if item[0]==path:
+                del self.items[index]
+                if item[1]!=signature:
+                    self.size-=item[2].nbytes()
+                    return None
+                self.items.append(item)
+                return item[2]
+        return None
+
+    def put(self,path,signature,cached):
+        for index,item in enumerate(self.items):
+            if item[0]==path:
+                del self.items[index]
+                self.size-=item[2].nbytes()
+                break
+        self.items.append((path,signature,cached))
+        self.size+=cached.nbytes()
+        self.shrink()
+
+    def resize(self,maxcurves,maxsize):
+        self.maxcurves=maxcurves
+        self.maxsize=maxsize
+        self.shrink()
+
+    def shrink(self):
+        '''
+        Drops the least recently used curves until the limits are respected
+        '''
+        while self.items and (len(self.items) > self.maxcurves or self.size > self.maxsize*1024*1024):
+            path,signature,cached=self.items.pop(0)
+            self.size-=cached.nbytes()
+            cached.close_all()
+
+
+class CurveCache:
+    '''
+    A directory of cached curves, bounded in size: when it grows beyond maxsize
+    megabytes, the least recently used curves are deleted.
+    '''
+    def __init__(self,directory,maxsize):
+        self.directory=directory
+        self.maxsize=maxsize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.hits=0
+        self.misses=0
+        self.stores=0
+        self.evictions=0
+        self.errors=0
+        self.size=sum([os.path.getsize(cachefile) for cachefile in self._cachefiles()])
+
+    def _cachefiles(self):
+        return [os.path.join(self.directory,name) for name in os.listdir(self.directory) if name.endswith('.npz')]
+
+    def _cachefile(self,path,signature):
+        key='%s|%s|%s' %(os.path.abspath(path),signature[0],signature[1])
+        if isinstance(key,unicode):
+            key=key.encode('utf-8')
+        return os.path.join(self.directory,hashlib.sha1(key).hexdigest()+'.npz')
+
+    def load(self,path,signature,drivers):
+        '''
+        Returns a CachedDriver for the curve file, or None if it is not in the cache.
+        signature is the (size, mtime) of the file (see lhc.file_signature).
+        '''
+        cachefile=self._cachefile(path,signature)
+        if not os.path.exists(cachefile):
+            self.misses+=1
+            return None
+        try:
+            data=numpy.load(cachefile)
+            try:
+                arrays=dict([(key,data[key]) for key in data.files])
+            finally:
+                data.close()
+            drivername=str(arrays['driver'])
+            driver=None
+            for item in drivers:
+                if item.__module__==drivername:
+                    driver=item
+            if driver is None:
+                #the driver is not loaded anymore: let identify() do its job
+                self.misses+=1
+                return None
+            cached=CachedDriver(path,driver,self._unpack_plots(arrays),None,str(arrays['filetype']),str(arrays['experiment']))
+            if 'defl_ext' in arrays:
+                cached.deflection_vectors=[lhc.DataChunk(arrays['defl_ext']),lhc.DataChunk(arrays['defl_ret'])]
+        except Exception:
+            #a broken cache file is just a miss
+            self.errors+=1
+            self.misses+=1
+            return None
+
+        #touch the file: the mtime of cache files tells which are the least recently used
+        try:
+            os.utime(cachefile,None)
+        except OSError:
+            pass
+        self.hits+=1
+        return cached
+
+    def store(self,path,signature,driver):
+        '''
+        Decodes a curve with its driver and stores it.
+        Returns a CachedDriver serving the decoded curve, or the driver itself if
+        the curve cannot be cached.
+        '''
+        try:
+            cached=snapshot(path,driver)
+            arrays=self._pack_plots(cached.plots)
+        except Exception:
+            self.errors+=1
+            return driver
+        arrays['driver']=numpy.array(cached.driver.__module__)
+        arrays['filetype']=numpy.array(str(cached.filetype))
+        arrays['experiment']=numpy.array(str(cached.experiment))
+        if cached.deflection_vectors is not None:
+            arrays['defl_ext'],arrays['defl_ret']=[numpy.asarray(vector) for vector in cached.deflection_vectors]
+
+        cachefile=self._cachefile(path,signature)
+        tempfile=cachefile+'.%d.tmp' %os.getpid()
+        try:
+            outfile=open(tempfile,'wb')
+            try:
+                numpy.savez(outfile,**arrays)
+            finally:
+                outfile.close()
+            if os.path.exists(cachefile):
+                self.size-=os.path.getsize(cachefile)
+                os.remove(cachefile)
+            os.rename(tempfile,cachefile)
+            self.size+=os.path.getsize(cachefile)
+            self.stores+=1
+        except (IOError,OSError):
+            self.errors+=1
+            try:
+                os.remove(tempfile)
+            except OSError:
+                pass
+
+        if self.size > self.maxsize*1024*1024:
+            self.evict()
+
+        return cached
+
+    def evict(self):
+        '''
+        Deletes the least recently used curves until the cache fits in maxsize megabytes.
+        '''
+        cachefiles=[]
+        for cachefile in self._cachefiles():
+            try:
+                cachefiles.append((os.path.getmtime(cachefile),os.path.getsize(cachefile),cachefile))
+            except OSError:
+                pass
+        cachefiles.sort()
+        self.size=sum([item[1] for item in cachefiles])
+
+        for mtime,size,cachefile in cachefiles:
+            if self.size <= self.maxsize*1024*1024:
+                break
+            try:
+                os.remove(cachefile)
+            except OSError:
+                continue
+            self.size-=size
+            self.evictions+=1
+
+    def stats(self):
+        '''
+        Returns the cache statistics as a list of (name, value) tuples
+        '''
+        requests=self.hits+self.misses
+        if requests:
+            hitrate='%.1f%%' %(100.0*self.hits/requests)
+        else:
+            hitrate='-'
+        return [('directory',self.directory),
+                ('cached curves',len(self._cachefiles())),
+                ('size (MB)','%.1f of %.1f' %(self.size/(1024.0*1024.0),self.maxsize)),
+                ('hits',self.hits),
+                ('misses',self.misses),
+                ('hit rate',hitrate),
+                ('stored curves',self.stores),
+                ('evicted curves',self.evictions),
+                ('errors',self.errors)]
+
+    def _pack_plots(self,plots):
+        '''
+        Flattens a list of PlotObjects in a dictionary of arrays, for numpy.savez
+        '''
+        arrays={'nplots':numpy.array(len(plots))}
+        for index,plot in enumerate(plots):
+            prefix='p%d_' %index
+            arrays[prefix+'nsets']=numpy.array(len(plot.vectors))
+            for setindex,vectors in enumerate(plot.vectors):
+                for axis,vector in enumerate(vectors):
+                    arrays[prefix+'s%d_%d' %(setindex,axis)]=numpy.asarray(vector)
+                arrays[prefix+'s%d_naxes' %setindex]=numpy.array(len(vectors))
+            arrays[prefix+'units']=numpy.array([str(unit) for unit in plot.units])
+            arrays[prefix+'destination']=numpy.array(plot.destination)
+            arrays[prefix+'title']=numpy.array(plot.title)
+            arrays[prefix+'axes']=numpy.array([plot.xaxes,plot.yaxes])
+            #None (the default) is stored as an empty string
+            arrays[prefix+'styles']=numpy.array([str(item or '') for item in plot.styles]+[''])
+            arrays[prefix+'colors']=numpy.array([str(item or '') for item in plot.colors]+[''])
+            for key in (prefix+'units',prefix+'styles',prefix+'colors'):
+                if arrays[key].dtype.kind not in 'SU':
+                    raise ValueError, 'Cannot cache '+key
+        return arrays
+
+    def _unpack_plots(self,arrays):
+        '''
+        Rebuilds the list of PlotObjects flattened by _pack_plots()
+        '''
+        plots=[]
+        for index in range(int(arrays['nplots'])):
+            prefix='p%d_' %index
+            plot=lhc.PlotObject()
+            for setindex in range(int(arrays[prefix+'nsets'])):
+                naxes=int(arrays[prefix+'s%d_naxes' %setindex])
+                plot.vectors.append([lhc.DataChunk(arrays[prefix+'s%d_%d' %(setindex,axis)]) for axis in range(naxes)])
+            plot.units=[item for item in arrays[prefix+'units'].tolist()]
+            plot.destination=int(arrays[prefix+'destination'])
+            plot.title=arrays[prefix+'title'].item()
+            plot.xaxes,plot.yaxes=[int(item) for item in arrays[prefix+'axes']]
+            plot.styles=[item or None for item in arrays[prefix+'styles'].tolist()[:-1]]
+            plot.colors=[item or None for item in arrays[prefix+'colors'].tolist()[:-1]]
+            plots.append(plot)
+        return plots
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+libfit.py
+
+Entropic elasticity models for the fit plugin, as scipy.odr models with analytic derivatives:
+- worm-like chain (WLC): force as a function of extension (C.Bustamante, J.F.Marko, E.D.Siggia
+  and S.Smith, Science. 1994 Sep 9;265(5178):1599-600.)
+- freely-jointed chain (FJC): extension as a function of force (C.Ray and B.B. Akhremitchev)
+- extended freely-jointed chain (eFJC): extension as a function of force, for polysaccharides
+  with a planar-helical transition (F Oesterhelt, M Rief and H E Gaub, New Journal of Physics 1 (1999))
+
+The fitted parameters are the inverse of the lengths (WLC and FJC: [1/contour length, 1/persistence
+or Kuhn length]; eFJC: [number of monomers, 1/Kuhn length]), as the fits converge better this way.
+If the second length is fixed, only the first parameter is fitted.
+WLC and FJC work in SI units, eFJC in nm and pN.
+
+Each model has a guess function giving initial parameters from the chunk to fit.
+
+wlc_joint_fit fits several WLC chunks (the peaks of a sawtooth) at once, with a shared persistence
+length and a contour length each.
+
+The eFJC monomer length is read from a table of the force, built once per temperature (see
+efjc_table and efjc_table_error for its accuracy); with a fixed Kuhn length the eFJC is linear in
+the number of monomers, which efjc_monomers_fit solves directly.
+
+This program is released under the GNU General Public License version 2.
+'''
+
+import numpy as np
+import scipy.odr
+
+#Boltzmann constant, J/K
+Kb=1.38065e-23
+#Boltzmann constant, pN.nm/K (eFJC)
+Kb_pn_nm=1.38065e-2
+
+#eFJC constants, from the reference
+EFJC_LP=0.358 #planar monomer length, nm
+EFJC_LH=0.280 #helical monomer length, nm
+EFJC_KS=150e3 #monomer elasticity, pN/nm
+EFJC_DG0=12.4242 #planar-helical free energy difference (3 kT), pN.nm
+EFJC_DL=0.078 #planar-helical length difference, nm
+
+#starting persistence (WLC), Kuhn (FJC, in m) and Kuhn (eFJC, in nm) lengths when they are not fixed
+WLC_START_PL=3.5e-10
+FJC_START_KL=3.5e-10
+EFJC_START_KL=0.7
+
+#force range (pN) and step of the eFJC monomer length tables
+EFJC_TABLE_RANGE=(-1000.0,3000.0)
+EFJC_TABLE_STEP=0.5
+
+#below this argument, the Langevin function is computed from its series
+LANGEVIN_SERIES=1e-3
+
+
+def _strong(f,x):
+    '''
+    the points of the chunk with the upper half of the (positive) forces, where the guesses are taken
+    '''
+    upper=np.argsort(f)[len(f)//2:]
+    upper=upper[(f[upper]>0) & (x[upper]>0)]
+    return f[upper],x[upper]
+
+
+def _median(values):
+    '''
+    upper median of a non-empty array (np.median is much slower on the short chunks we fit)
+    '''
+    return np.sort(values)[len(values)//2]
+
+
+def _parameters(beta,fixed):
+    '''
+    splits the fitted parameters: the second one is fixed (given as its inverse) if not None
+    '''
+    if fixed is None:
+        return beta[0],beta[1]
+    return beta[0],fixed
+
+
+def langevin(z):
+    '''
+    Langevin function coth(z)-1/z
+    '''
+    z=np.asarray(z,float)
+    small=abs(z)<LANGEVIN_SERIES
+    safe=np.where(small,1.0,z)
+    return np.where(small,z/3.0,1.0/np.tanh(safe)-1.0/safe)
+
+
+def langevin_derivative(z):
+    '''
+    derivative of the Langevin function, 1/z**2-1/sinh(z)**2
+    '''
+    z=np.asarray(z,float)
+    small=abs(z)<LANGEVIN_SERIES
+    safe=np.where(small,1.0,z)
+    return np.where(small,1.0/3.0-z*z/5.0,1.0/safe**2-1.0/np.sinh(safe)**2)
+
+
+#---WLC: force(extension)
+def wlc(beta,x,T,fixed=None):
+    '''
+    WLC force at extensions x. beta=[1/contour length, 1/persistence length]
+    '''
+    lambd,pii=_parameters(beta,fixed)
+    therm=Kb*T
+    return (therm*pii/4.0) * (((1-(x*lambd))**-2) - 1 + (4*x*lambd))
+
+def wlc_jacb(beta,x,T,fixed=None):
+    lambd,pii=_parameters(beta,fixed)
+    therm=Kb*T
+    slack=1-(x*lambd)
+    rows=[(therm*pii/4.0) * (2*x*slack**-3 + 4*x)]
+    if fixed is None:
+        rows.append((therm/4.0) * ((slack**-2) - 1 + (4*x*lambd)))
+    return np.array(rows)
+
+def wlc_jacd(beta,x,T,fixed=None):
+    lambd,pii=_parameters(beta,fixed)
+    therm=Kb*T
+    return (therm*pii/4.0) * (2*lambd*(1-(x*lambd))**-3 + 4*lambd)
+
+def wlc_guess(x,f,T,pl_value=None):
+    '''
+    Initial parameters for a WLC fit of the (extension x, force f) chunk (pl_value: the fixed persistence
+    length, if any).
+    Each point of the chunk, on a WLC of the starting persistence length, gives a relative extension
+    and thus a contour length: the median of the ones given by the upper half of the forces is taken,
+    but always in excess of the chunk (the fit must converge from an excess).
+    '''
+    x=np.asarray(x,float)
+    f=np.asarray(f,float)
+    if pl_value:
+        persistence=pl_value
+    else:
+        persistence=WLC_START_PL
+
+    longest=max(x)
+    contour=longest+(longest/10)
+    fs,xs=_strong(f,x)
+    if len(fs):
+        #relative extensions r on the WLC: force*P/kT = 1/(4*(1-r)**2) - 1/4 + r, that is
+        #4*s**3 + (4*force*P/kT - 3)*s**2 - 1 = 0 for s=1-r: a few Newton steps from the
+        #asymptotic s=1/(2*sqrt(force*P/kT + 1/4)) are good to 1e-4, plenty for a starting point
+        target=fs*persistence/(Kb*T)
+        slack=1/(2*np.sqrt(target+0.25))
+        for step in range(3):
+            slack=slack-(4*slack**3+(4*target-3)*slack**2-1)/(12*slack**2+2*(4*target-3)*slack)
+        contour=max(_median(xs/(1-slack)),longest*1.02)
+
+    if pl_value:
+        return [1/contour]
+    return [1/contour,1/persistence]
+
+
+#---FJC: extension(force)
+def fjc(beta,f,T,fixed=None):
+    '''
+    FJC extension at forces f. beta=[1/contour length, 1/Kuhn length]
+    '''
+    lambd,pii=_parameters(beta,fixed)
+    therm=Kb*T
+    return langevin(f*(1/pii)/therm)/lambd
+
+def fjc_jacb(beta,f,T,fixed=None):
+    lambd,pii=_parameters(beta,fixed)
+    therm=Kb*T
+    z=f*(1/pii)/therm
+    rows=[-langevin(z)/lambd**2]
+    if fixed is None:
+        rows.append(-langevin_derivative(z)*z/(pii*lambd))
+    return np.array(rows)
+
+def fjc_jacd(beta,f,T,fixed=None):
+    lambd,pii=_parameters(beta,fixed)
+    therm=Kb*T
+    return langevin_derivative(f*(1/pii)/therm)/(pii*therm*lambd)
+
+def fjc_guess(f,x,T,pl_value=None):
+    '''
+    Initial parameters for a FJC fit of the (force f, extension x) chunk (pl_value: the fixed Kuhn length,
+    if any): the median of the contour lengths given by the upper half of the forces, on a FJC of
+    the starting Kuhn length.
+    '''
+    f=np.asarray(f,float)
+    x=np.asarray(x,float)
+    if pl_value:
+        kuhn=pl_value
+    else:
+        kuhn=FJC_START_KL
+
+    longest=max(x)
+    contour=longest+(longest/10)
+    fs,xs=_strong(f,x)
+    if len(fs):
+        contour=_median(xs/langevin(fs*kuhn/(Kb*T)))
+
+    if pl_value:
+        return [1/contour]
+    return [1/contour,1/kuhn]
+
+
+#---eFJC: extension(force), in nm and pN
+def efjc_lfactor(f,T):
+    '''
+    mean monomer length at force f, between the planar and helical lengths
+    '''
+    therm=Kb_pn_nm*T
+    dG=EFJC_DG0-f*EFJC_DL
+    return EFJC_LP/(np.exp(dG/therm)+1)+EFJC_LH/(np.exp(-dG/therm)+1)
+
+def efjc_lfactor_derivative(f,T):
+    therm=Kb_pn_nm*T
+    dG=EFJC_DG0-f*EFJC_DL
+    return (EFJC_LP-EFJC_LH)*(EFJC_DL/therm)/(4*np.cosh(dG/(2*therm))**2)
+
+#eFJC monomer length tables, by temperature
+efjc_tables={}
+
+def efjc_table(T):
+    '''
+    (forces, monomer lengths) table of efjc_lfactor at temperature T, on EFJC_TABLE_RANGE by
+    EFJC_TABLE_STEP; it is built on first use and kept for the following fits
+    '''
+    T=float(T)
+    if T not in efjc_tables:
+        low,high=EFJC_TABLE_RANGE
+        forces=np.arange(low,high+EFJC_TABLE_STEP/2,EFJC_TABLE_STEP)
+        efjc_tables[T]=(forces,efjc_lfactor(forces,T))
+    return efjc_tables[T]
+
+def efjc_table_error(T):
+    '''
+    bound on the error (nm) of the tabulated monomer length at temperature T.
+    The monomer length is LH+(LP-LH)*s(u), s the logistic function of u=(f*DL-DG0)/kT:
+    - inside the table, linear interpolation is off by at most step**2/8*max|l''|,
+      with max|l''|=(LP-LH)*(DL/kT)**2*max|s''| and max|s''|=1/(6*sqrt(3));
+    - outside, the table is clamped to its ends, where the length is within (LP-LH)*s(u)
+      of its limit at either end.
+    At 293 K this is about 9e-8 nm, 3e-7 of the monomer length.
+    '''
+    therm=Kb_pn_nm*T
+    low,high=EFJC_TABLE_RANGE
+    curvature=(EFJC_LP-EFJC_LH)*(EFJC_DL/therm)**2/(6*np.sqrt(3))
+    tails=(EFJC_LP-EFJC_LH)*max(1/(np.exp((EFJC_DG0-low*EFJC_DL)/therm)+1),
+                                1/(np.exp((high*EFJC_DL-EFJC_DG0)/therm)+1))
+    return max(EFJC_TABLE_STEP**2/8*curvature,tails)
+
+def efjc_lfactor_tabulated(f,T):
+    '''
+    efjc_lfactor, interpolated in the table of temperature T (within efjc_table_error(T))
+    '''
+    forces,lengths=efjc_table(T)
+    return np.interp(f,forces,lengths)
+
+def efjc_monomer_extension(f,T,invkl):
+    '''
+    eFJC extension of a single monomer (nm) at forces f (pN), for a Kuhn length 1/invkl
+    '''
+    therm=Kb_pn_nm*T
+    return efjc_lfactor_tabulated(f,T)*langevin((f/therm)/invkl)+f/EFJC_KS
+
+def efjc(beta,f,T,fixed=None):
+    '''
+    eFJC extension (nm) at forces f (pN). beta=[number of monomers, 1/Kuhn length]
+    '''
+    Ns,invkl=_parameters(beta,fixed)
+    return Ns*efjc_monomer_extension(f,T,invkl)
+
+def efjc_jacb(beta,f,T,fixed=None):
+    Ns,invkl=_parameters(beta,fixed)
+    therm=Kb_pn_nm*T
+    z=(f/therm)/invkl
+    lfactor=efjc_lfactor_tabulated(f,T)
+    rows=[lfactor*langevin(z)+f/EFJC_KS]
+    if fixed is None:
+        rows.append(-Ns*lfactor*langevin_derivative(z)*z/invkl)
+    return np.array(rows)
+
+def efjc_jacd(beta,f,T,fixed=None):
+    Ns,invkl=_parameters(beta,fixed)
+    therm=Kb_pn_nm*T
+    z=(f/therm)/invkl
+    return Ns*(efjc_lfactor_derivative(f,T)*langevin(z)+efjc_lfactor_tabulated(f,T)*langevin_derivative(z)/(therm*invkl))+Ns/EFJC_KS
+
+def efjc_guess(f,x,T,kl_value=None):
+    '''
+    Initial parameters for an eFJC fit of the (force f, extension x) chunk, in pN and nm (kl_value: the
+    fixed Kuhn length, if any): the median of the numbers of monomers given by the upper half of the
+    forces, with the starting Kuhn length.
+    '''
+    f=np.asarray(f,float)
+    x=np.asarray(x,float)
+    if kl_value:
+        kuhn=kl_value
+    else:
+        kuhn=EFJC_START_KL
+
+    longest=max(x)
+    monomers=(longest+(longest/10.0))/EFJC_LP
+    fs,xs=_strong(f,x)
+    if len(fs):
+        monomers=_median(xs/efjc_monomer_extension(fs,T,1.0/kuhn))
+
+    if kl_value:
+        return [monomers]
+    return [monomers,1.0/kuhn]
+
+
+MODELS={'wlc':(wlc,wlc_jacb,wlc_jacd),
+        'fjc':(fjc,fjc_jacb,fjc_jacd),
+        'efjc':(efjc,efjc_jacb,efjc_jacd)}
+
+
+def odr_fit(model,x,y,beta0,T,fixed=None):
+    '''
+    Ordinary least squares fit of y(x) to a model of MODELS, with its analytic derivatives.
+    fixed is the inverse of the fixed second length (or None), as the model functions want it.
+    Returns the scipy.odr Output.
+    '''
+    function,jacb,jacd=MODELS[model]
+    odr_model=scipy.odr.Model(function,fjacb=jacb,fjacd=jacd,extra_args=(T,fixed))
+    o=scipy.odr.ODR(scipy.odr.RealData(x,y),odr_model,beta0)
+    o.set_job(fit_type=2,deriv=3)
+    return o.run()
+
+
+def wlc_joint_fit(chunks,T,pl_value=None,max_iterations=100):
+    '''
+    Least squares fit of the WLC to several (extension x, force f) chunks at once, e.g. the peaks
+    of a sawtooth: each chunk has its contour length, the persistence length is shared (or fixed
+    to pl_value). beta=[1/contour length of each chunk..., 1/persistence length (if not fixed)].
+    
+    Each force depends on its own contour length and on the persistence length only: the Jacobian
+    is a block diagonal (one column per chunk) plus a dense last column, and the normal equations
+    are an "arrow" matrix, solved in linear time by eliminating the contour lengths.
+    The fit is a Levenberg-Marquardt on the parameters relative to the start ones; the contour
+    lengths are kept beyond their chunks, where the WLC is defined.
+    Returns beta and its standard deviations (as the sd_beta of odr_fit).
+    '''
+    chunks=[(np.asarray(x,float),np.asarray(f,float)) for x,f in chunks]
+    if pl_value:
+        fixed=1.0/pl_value
+        persistence=pl_value
+    else:
+        fixed=None
+        persistence=WLC_START_PL
+    
+    x=np.concatenate([chunk[0] for chunk in chunks])
+    f=np.concatenate([chunk[1] for chunk in chunks])
+    owner=np.concatenate([np.repeat(i,len(chunk[0])) for i,chunk in enumerate(chunks)])
+    count=len(chunks)
+    
+    lambd0=np.array([wlc_guess(chunk_x,chunk_f,T,persistence)[0] for chunk_x,chunk_f in chunks])
+    upper=1.0/(lambd0*np.array([max(chunk_x) for chunk_x,chunk_f in chunks]))
+    pii0=1.0/persistence
+    
+    def state(scale,pii_scale):
+        #residuals, and their derivatives by the relative contour and persistence parameters
+        beta=[lambd0[owner]*scale[owner],pii0*pii_scale]
+        residuals=wlc(beta,x,T)-f
+        derivatives=wlc_jacb(beta,x,T)
+        return residuals,derivatives[0]*lambd0[owner],derivatives[1]*pii0
+    
+    def normal(residuals,a,b):
+        #the arrow normal matrix (diagonal, last column, corner) and the gradient
+        return (np.bincount(owner,a*a,count),np.bincount(owner,a*b,count),np.dot(b,b),
+                np.bincount(owner,a*residuals,count),np.dot(b,residuals))
+    
+    scale=np.ones(count)
+    pii_scale=1.0
+    residuals,a,b=state(scale,pii_scale)
+    cost=np.dot(residuals,residuals)
+    damping=1e-3
+    for iteration in range(max_iterations):
+        diagonal,column,corner,gradient,pii_gradient=normal(residuals,a,b)
+        while True:
+            damped=diagonal*(1+damping)
+            if fixed is None:
+                schur=corner*(1+damping)-np.sum(column*column/damped)
+                pii_step=(-pii_gradient+np.sum(column*gradient/damped))/schur
+            else:
+                pii_step=0.0
+            step=(-gradient-column*pii_step)/damped
+            new_scale=scale+step
+            new_pii_scale=pii_scale+pii_step
+            if np.all(new_scale>0) and np.all(new_scale<upper) and new_pii_scale>0:
+                new_state=state(new_scale,new_pii_scale)
+                new_cost=np.dot(new_state[0],new_state[0])
+                if new_cost<=cost:
+                    break
+            damping*=10
+            if damping>1e10:
+                break
+        if damping>1e10:
+            break
+        reduction=cost-new_cost
+        scale,pii_scale=new_scale,new_pii_scale
+        residuals,a,b=new_state
+        cost=new_cost
+        damping=max(damping/10,1e-12)
+        if reduction<=1e-12*cost and np.max(abs(step))<1e-10 or reduction<=1e-15*cost:
+            break
+    
+    #standard deviations from the residual variance and the inverse of the normal matrix, as ODRPACK does
+    diagonal,column,corner,gradient,pii_gradient=normal(residuals,a,b)
+    res_var=cost/max(len(x)-count-(fixed is None),1)
+    if fixed is None:
+        schur=corner-np.sum(column*column/diagonal)
+        variances=np.append(1/diagonal+(column/diagonal)**2/schur,1/schur)
+        beta=np.append(lambd0*scale,pii0*pii_scale)
+        start=np.append(lambd0,pii0)
+    else:
+        variances=1/diagonal
+        beta=lambd0*scale
+        start=lambd0
+    return beta,np.sqrt(variances*res_var)*start
+
+
+def efjc_monomers_fit(f,x,T,invkl):
+    '''
+    Least squares fit of the number of monomers of an eFJC of fixed Kuhn length 1/invkl to the
+    extensions x (nm) at forces f (pN). The eFJC is linear in the number of monomers, so this is
+    where the ordinary least squares ODR fit converges, without iterating.
+    Returns the parameters and their standard deviations, as the beta and sd_beta of odr_fit.
+    '''
+    f=np.asarray(f,float)
+    x=np.asarray(x,float)
+    monomer=efjc_monomer_extension(f,T,invkl)
+    norm=np.dot(monomer,monomer)
+    Ns=np.dot(monomer,x)/norm
+    if len(x)>1:
+        res_var=np.sum((x-Ns*monomer)**2)/(len(x)-1)
+    else:
+        res_var=0.0
+    return np.array([Ns]),np.array([np.sqrt(res_var/norm)])
+
+
+def nearest_sum(px,py,linex,liney,block=256):
+    '''
+    For each point (px[i],py[i]), takes the point of the line (linex,liney) nearest in x,
+    and sums the squared y distances.
+    '''
+    px=np.asarray(px,float)
+    py=np.asarray(py,float)
+    linex=np.asarray(linex,float)
+    liney=np.asarray(liney,float)
+    total=0.0
+    for start in range(0,len(px),block):
+        nearest=np.argmin((px[start:start+block,np.newaxis]-linex[np.newaxis,:])**2,axis=1)
+        total+=np.sum((py[start:start+block]-liney[nearest])**2)
+    return total
+
+
+if __name__ == '__main__':
+    #self-check of the eFJC tables against the exact monomer length
+    forces=np.linspace(EFJC_TABLE_RANGE[0]-500,EFJC_TABLE_RANGE[1]+500,200003)
+    for T in (273.0,293.0,310.0,350.0):
+        error=np.max(abs(efjc_lfactor_tabulated(forces,T)-efjc_lfactor(forces,T)))
+        bound=efjc_table_error(T)
+        print 'T=%g K: table error %.3g nm, bound %.3g nm' %(T,error,bound)
+        assert error<=bound
+    print 'eFJC tables OK'
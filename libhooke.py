@@ -22,6 +22,7 @@ import scipy.optimize
 import scipy.stats
 import numpy
 import xml.dom.minidom
+import json
 import os
 import string
 import csv
@@ -41,7 +42,8 @@ class PlaylistXML:
             self.playlist=None #the DOM object representing the playlist data structure
             self.playpath=None #the path of the playlist XML file
             self.plaything=None
-            self.hidden_attributes=['curve'] #This list contains hidden attributes that we don't want to go into the playlist.
+            self.hidden_attributes=['curve','memo'] #This list contains hidden attributes that we don't want to go into the playlist.
+            self.json_attributes=['fitcache'] #These attributes are structured data: they are saved and loaded as JSON.
         
         def export(self, list_of_hooke_curves, generics):
             '''
@@ -72,7 +74,10 @@ class PlaylistXML:
                 playlist_element=newdoc.createElement("element")
                 top_element.appendChild(playlist_element)
                 for key in item.__dict__:
-                    if not (key in self.hidden_attributes):
+                    if key in self.json_attributes:
+                        newdoc.createAttribute(key)
+                        playlist_element.setAttribute(key,json.dumps(item.__dict__[key]))
+                    elif not (key in self.hidden_attributes):
                         newdoc.createAttribute(key)
                         playlist_element.setAttribute(key,str(item.__dict__[key]))    
             
@@ -116,7 +121,13 @@ class PlaylistXML:
                     #rebuild a data structure from the xml attributes
                     the_curve=lhc.HookeCurve(myfile.getAttribute('path'))
                     for attribute in myfile.attributes.keys(): #extract attributes for the single curve
-                        the_curve.__dict__[attribute]=myfile.getAttribute(attribute)
+                        if attribute in self.json_attributes:
+                            try:
+                                the_curve.__dict__[attribute]=json.loads(myfile.getAttribute(attribute))
+                            except ValueError:
+                                print 'libhooke.py : Bad '+attribute+' for '+the_curve.path+', ignored.'
+                        elif not (attribute in self.hidden_attributes):
+                            the_curve.__dict__[attribute]=myfile.getAttribute(attribute)
                     new_playlist.append(the_curve)
                 
                 return new_playlist #this is the true thing returned at the end of this function...(FIXME: clarity)
@@ -183,12 +194,14 @@ class HookeConfig:
             workdir_elements=config.getElementsByTagName("workdir")
             defaultlist_elements=config.getElementsByTagName("defaultlist")
             plotmanip_elements=config.getElementsByTagName("plotmanips")
+            curvecache_elements=config.getElementsByTagName("curvecache")
             handleDisplay(display_elements)
             handlePlugins(plugins_elements)
             handleDrivers(drivers_elements)
             handleWorkdir(workdir_elements)
             handleDefaultlist(defaultlist_elements)
             handlePlotmanip(plotmanip_elements)
+            handleCurvecache(curvecache_elements)
             
         def handleDisplay(display_elements):
             for element in display_elements:
@@ -229,6 +242,19 @@ class HookeConfig:
             '''
             dflist=getText(defaultlist[0].childNodes)
             self.config['defaultlist']=dflist.strip()
+        
+        def handleCurvecache(curvecache):
+            '''
+            directory (and maximum size, in MB) of the on-disk cache of decoded curves.
+            optional: no directory, no cache.
+            '''
+            self.config['curvecache']=''
+            self.config['curvecache_size']='200'
+            if len(curvecache)==0:
+                return
+            self.config['curvecache']=getText(curvecache[0].childNodes).strip()
+            if curvecache[0].hasAttribute('maxsize'):
+                self.config['curvecache_size']=curvecache[0].getAttribute('maxsize')
             
         handleConfig(self.config_tree)
         #making items in the dictionary more machine-readable
@@ -352,11 +378,10 @@ class ClickedPoint:
         Given a clicked point on the plot, finds the nearest point in the dataset that
         corresponds to the clicked point.
         '''
-        dists=[]
-        for index in scipy.arange(1,len(xvector),1):
-            dists.append(((self.absolute_coords[0]-xvector[index])**2)+((self.absolute_coords[1]-yvector[index])**2))
+        #the first point is skipped, and the index is the one in dists (as it has always been)
+        dists=((self.absolute_coords[0]-numpy.asarray(xvector[1:],float))**2)+((self.absolute_coords[1]-numpy.asarray(yvector[1:len(xvector)],float))**2)
                         
-        self.index=dists.index(min(dists))
+        self.index=int(numpy.argmin(dists))
         self.graph_coords=(xvector[self.index],yvector[self.index])
 #-----------------------------------------
 #CSV-HELPING FUNCTIONS        
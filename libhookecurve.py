@@ -1,6 +1,36 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import mmap
+import numpy
+import os.path
+
+#Bytes read from the head of a file to choose its driver (see Driver.sniff)
+HEADER_BLOCK_SIZE=4096
+
+
+def read_header_block(filename):
+    '''
+    Returns the first HEADER_BLOCK_SIZE bytes of a file
+    '''
+    headerfile=open(filename,'rb')
+    try:
+        return headerfile.read(HEADER_BLOCK_SIZE)
+    finally:
+        headerfile.close()
+
+
+def file_signature(filename):
+    '''
+    Returns the (size, mtime) of a file, as strings that survive a trip through a playlist.
+    '''
+    stat=os.stat(filename)
+    return str(stat.st_size),repr(stat.st_mtime)
+
+
+#On-disk cache of the decoded curves (see libcurvecache). None if disabled.
+curve_cache=None
+
 
 class HookeCurve(object):
     
@@ -8,26 +38,84 @@ class HookeCurve(object):
         self.path=path
         self.curve=Driver()
         self.notes=''
+        #driver resolution cache: the driver that reads the file, and the file
+        #size and mtime when it was found. They are saved in the playlist too.
+        self.driver=''
+        self.filesize=''
+        self.mtime=''
+        #results of costly analyses of the curve, kept by the plugins (e.g. plotmanip_flatten)
+        self.memo={}
+        #recent fits of the curve, as [key, results] pairs (see fit.py, cached_fit()). Saved in the playlist.
+        self.fitcache=[]
     
     def identify(self, drivers):
         '''
         identifies a curve and returns the corresponding object
+        
+        If the curve cache is enabled and holds the file, the decoded curve is served from it.
+        If the file did not change since its driver was found, that driver is used straight away.
+        Otherwise only the drivers whose sniffing rules match the head of the file are built
+        and asked with is_me(); drivers without rules are always tried.
         '''
-        for driver in drivers:
-	    try:
-              tempcurve=driver(self.path)
-	    except:
-	      print "Error in the playlist of the files."
-	      return False
-            if tempcurve.is_me():
-                #bring on all the driver, with his load of methods etc.
-                #so we can access the whole of it.
-                self.curve=tempcurve
-                del tempcurve
+        try:
+            signature=file_signature(self.path)
+        except:
+            print "Error in the playlist of the files."
+            return False
+        
+        if curve_cache is not None:
+            cached=curve_cache.load(self.path,signature,drivers)
+            if cached is not None:
+                self.curve=cached
+                self.driver=cached.driver.__module__
+                self.filesize,self.mtime=signature
                 return True
         
+        if self.driver and (self.filesize,self.mtime)==signature:
+            for driver in drivers:
+                if driver.__module__==self.driver:
+                    try:
+                        if self._try_driver(driver,signature):
+                            return True
+                    except:
+                        pass
+                    break
+        
+        try:
+            header=read_header_block(self.path)
+        except:
+            print "Error in the playlist of the files."
+            return False
+        
+        for driver in drivers:
+            sniff=getattr(driver,'sniff',None)
+            if sniff is not None and sniff(self.path,header) is False:
+                continue
+            try:
+                if self._try_driver(driver,signature):
+                    return True
+            except:
+                print "Error in the playlist of the files."
+                return False
+        
         print 'Not a recognizable curve format.'
         return False
+    
+    def _try_driver(self,driver,signature):
+        '''
+        Builds driver on the file: if it is the right one, keeps it and remembers it.
+        '''
+        tempcurve=driver(self.path)
+        if tempcurve.is_me():
+            #bring on all the driver, with his load of methods etc.
+            #so we can access the whole of it.
+            if curve_cache is not None:
+                tempcurve=curve_cache.store(self.path,signature,tempcurve)
+            self.curve=tempcurve
+            self.driver=driver.__module__
+            self.filesize,self.mtime=signature
+            return True
+        return False
         
         
 class Driver:
@@ -35,11 +123,45 @@ class Driver:
     Base class for file format drivers.
     
     To be overridden
+    
+    Drivers should declare cheap sniffing rules as class attributes, so that
+    HookeCurve.identify() needs not build them to know they can't read a file:
+    extensions: tuple of accepted file extensions, lowercase and with the dot (e.g. ('.ibw',))
+    signature: (offset, string) tuple: the string is found at offset in every file of the format
+    first_line: prefix of the first line of every file of the format
+    A driver declaring no rule is built and asked with is_me() for every file.
     '''
+    extensions=None
+    signature=None
+    first_line=None
+    
     def __init__(self):
         self.experiment=''
         self.filetype=''
     
+    @classmethod
+    def sniff(cls,filename,header):
+        '''
+        Tells from the file name and the first HEADER_BLOCK_SIZE bytes of the file (header)
+        if the file can belong to the driver format.
+        Returns True or False, or None if the driver has no sniffing rule.
+        Override it if the declarative rules are not enough: is_me() always has the last word.
+        '''
+        if cls.extensions is None and cls.signature is None and cls.first_line is None:
+            return None
+        
+        if cls.extensions is not None:
+            if os.path.splitext(filename)[1].lower() not in cls.extensions:
+                return False
+        if cls.signature is not None:
+            offset,magic=cls.signature
+            if header[offset:offset+len(magic)] != magic:
+                return False
+        if cls.first_line is not None:
+            if not header_first_line(header).startswith(cls.first_line):
+                return False
+        return True
+    
     def is_me(self):
         '''
         This method must read the file and return True if the filetype can be managed by the driver, False if not.
@@ -58,6 +180,224 @@ class Driver:
         return [dummy_default]
    
 
+def header_first_line(header):
+    '''
+    Returns the first line of a header block, without the line terminator
+    '''
+    end=len(header)
+    for terminator in '\r\n':
+        index=header.find(terminator)
+        if index != -1:
+            end=min(end,index)
+    return header[:end]
+
+
+class MappedFile:
+    '''
+    Read-only memory map of a binary curve file, for drivers.
+    
+    Channels are exposed with array() as read-only numpy views over the mapped file:
+    nothing is copied, and pages are read from disk only when the data is actually used,
+    so that looking at the retraction half of a chunk never touches the extension half.
+    
+    The map itself is a file-like object (seek, tell, read, readline) for parsing headers.
+    '''
+    def __init__(self,filename):
+        self.filename=filename
+        self.file=open(filename,'rb')
+        try:
+            self.map=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        except:
+            #empty files cannot be mapped
+            self.file.close()
+            raise
+    
+    def __len__(self):
+        return len(self.map)
+    
+    def array(self,offset,count,dtype):
+        '''
+        Returns a read-only view of count items of type dtype, starting at offset (in bytes).
+        Truncated files give shorter arrays, as reading them would.
+        '''
+        dtype=numpy.dtype(dtype)
+        count=min(count,max(len(self.map)-offset,0)/dtype.itemsize)
+        if count<=0:
+            return numpy.zeros(0,dtype)
+        return numpy.frombuffer(self.map,dtype=dtype,count=count,offset=offset)
+    
+    def close(self):
+        '''
+        Closes the file. 
+        The mapping is released when the last array view over it is gone, so arrays obtained
+        from array() stay valid.
+        '''
+        self.file.close()
+        self.map=None
+
+
+class DataChunk(numpy.ndarray):
+    '''
+    A vector of curve data, as returned by drivers in PlotObject.vectors:
+    a numpy array (of floats, by default) that can still be used as the lists of old.
+    
+    Indexing, slicing, len(), iteration and index() work as for lists, and whole-array
+    numpy operations work as well. Beware that slicing never copies the data:
+    copy a slice before changing it in place.
+    ext() and ret() return the first and second half of the vector, for drivers storing
+    extension and retraction in a single chunk.
+    '''
+    
+    def __new__(cls,data,dtype=float):
+        return numpy.asarray(data,dtype).view(cls)
+    
+    def __array_wrap__(self,array,context=None):
+        #reductions (sum, mean, max...) give plain numbers, not 0-d DataChunks
+        if array.ndim==0:
+            return array[()]
+        return numpy.ndarray.__array_wrap__(self,array,context)
+    
+    def ext(self):
+        halflen=(len(self)/2)
+        return self[0:halflen]
+        
+    def ret(self):
+        halflen=(len(self)/2)
+        return self[halflen:]
+    
+    def index(self,value):
+        '''
+        index of the first occurrence of value, as list.index()
+        '''
+        found=numpy.flatnonzero(numpy.asarray(self)==value)
+        if len(found)==0:
+            raise ValueError, str(value)+' is not in the vector'
+        return int(found[0])
+
+
+def index_at_distance(vector,start_index,distance,backwards=False,strict=False):
+    '''
+    Walking vector from start_index (forwards, or backwards), returns the index of the first point
+    whose distance from vector[start_index] is at least distance (more than distance if strict),
+    or None if the end of the vector is reached before.
+    
+    Made for the x axes of the curves: on a monotonic stretch the point is found by bisection,
+    then the stretch walked over is checked to be monotonic. Otherwise the distances of all the
+    points are computed, to find the first one.
+    '''
+    vector=numpy.asarray(vector)
+    if backwards:
+        stretch=vector[start_index::-1]
+    else:
+        stretch=vector[start_index:]
+    if len(stretch)==0:
+        return None
+    origin=stretch[0]
+    
+    def beyond(value):
+        if strict:
+            return abs(value-origin) > distance
+        return abs(value-origin) >= distance
+    
+    #bisection for the first point beyond, assuming the distance grows along the stretch
+    low,high=0,len(stretch)
+    while low<high:
+        middle=(low+high)/2
+        if beyond(stretch[middle]):
+            high=middle
+        else:
+            low=middle+1
+    
+    steps=numpy.diff(stretch[:low+1])
+    if not ((steps>=0).all() or (steps<=0).all()):
+        #not monotonic: some point before may be beyond as well
+        if strict:
+            found=numpy.flatnonzero(abs(stretch-origin) > distance)
+        else:
+            found=numpy.flatnonzero(abs(stretch-origin) >= distance)
+        if len(found)==0:
+            return None
+        low=found[0]
+    elif low==len(stretch):
+        return None
+    
+    if backwards:
+        return start_index-int(low)
+    return start_index+int(low)
+
+
+class LineFits:
+    '''
+    Least squares straight lines through windows of a x,y data set, each in constant time.
+    
+    The prefix sums of x, y, x*x and x*y are computed once (over the data shifted to their mean, to
+    keep the sums small); the sums over any window are then differences of two prefix sums.
+    Windows are given as the index1:index2 slices of the vectors they stand for.
+    '''
+    def __init__(self,x,y):
+        x=numpy.asarray(x,float)
+        y=numpy.asarray(y,float)
+        self.x=x
+        self.y=y
+        self.length=min(len(x),len(y))
+        x=x[:self.length]
+        y=y[:self.length]
+        if self.length:
+            self.x_offset=x.mean()
+            self.y_offset=y.mean()
+        else:
+            self.x_offset=self.y_offset=0.0
+        x=x-self.x_offset
+        y=y-self.y_offset
+        self.sums=[numpy.concatenate(([0.0],numpy.cumsum(vector))) for vector in (x,y,x*x,x*y)]
+    
+    def _bounds(self,starts,stops):
+        #as slice.indices(), for arrays of slice bounds
+        bounds=[]
+        for bound in (starts,stops):
+            bound=numpy.asarray(bound,int)
+            bound=numpy.where(bound<0,bound+self.length,bound)
+            bounds.append(numpy.clip(bound,0,self.length))
+        return bounds[0],numpy.maximum(bounds[1],bounds[0])
+    
+    def fits(self,starts,stops):
+        '''
+        Slopes and intercepts of the lines through the starts[i]:stops[i] windows, as two arrays.
+        They are nan for the windows with less than two distinct x values.
+        '''
+        starts,stops=self._bounds(starts,stops)
+        sum_x,sum_y,sum_xx,sum_xy=[sums[stops]-sums[starts] for sums in self.sums]
+        count=(stops-starts).astype(float)
+        errors=numpy.seterr(divide='ignore',invalid='ignore')
+        try:
+            var_x=sum_xx-sum_x*sum_x/count
+            cov_xy=sum_xy-sum_x*sum_y/count
+            slopes=numpy.where((count>=2) & (var_x>0),cov_xy/var_x,numpy.nan)
+            intercepts=(sum_y-slopes*sum_x)/count
+        finally:
+            numpy.seterr(**errors)
+        intercepts=intercepts+self.y_offset-slopes*self.x_offset
+        return slopes,intercepts
+    
+    def fit(self,index1,index2):
+        '''
+        (slope, intercept) of the line through the index1:index2 window.
+        Where the line is not defined, numpy.polyfit() gives (or refuses) the answer, as it always did.
+        '''
+        slopes,intercepts=self.fits([index1],[index2])
+        if numpy.isnan(slopes[0]):
+            linefit=numpy.polyfit(self.x[index1:index2],self.y[index1:index2],1)
+            return linefit[0],linefit[1]
+        return slopes[0],intercepts[0]
+    
+    def slopes_at(self,points,span):
+        '''
+        Slopes of the lines through the span points before each of points (e.g. the peaks).
+        '''
+        points=numpy.asarray(points,int)
+        return self.fits(points-span,points)[0]
+
+
 class PlotObject:
     
     def __init__(self):
@@ -78,6 +418,8 @@ class PlotObject:
         
         2 curves in a x,y plot are:
         [[[x1],[y1]],[[x2],[y2]]]
+        where each vector is a DataChunk (or, from older code, a list: add_set() and
+        normalize_vectors() turn them into DataChunks)
         for example:
             x1          y1              x2         y2
         [[[1,2,3,4],[10,20,30,40]],[[3,6,9,12],[30,60,90,120]]]
@@ -122,8 +464,8 @@ class PlotObject:
         Adds an x,y data set to the vectors.
         '''
         self.vectors.append([])
-        self.vectors[-1].append(x)
-        self.vectors[-1].append(y)
+        self.vectors[-1].append(DataChunk(x))
+        self.vectors[-1].append(DataChunk(y))
         return
     
     def remove_set(self,whichset):
@@ -135,10 +477,11 @@ class PlotObject:
     
     def normalize_vectors(self):
         '''
-        Trims the vector lengths as to be equal in a plot.
+        Trims the vector lengths as to be equal in a plot, and makes them DataChunks.
         '''
         
         for index in range(0,len(self.vectors)):
+            self.vectors[index]=[DataChunk(vector) for vector in self.vectors[index]]
             vectors_to_plot=self.vectors[index]
             lengths=[len(vector) for vector in vectors_to_plot]
             if min(lengths) != max(lengths):
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+libnanoscope.py
+
+Parse-once model of the text header of Veeco Nanoscope (Picoforce) files.
+
+The header is a list of lines like:
+\*Ciao force image list
+\Data offset: 40960
+\@4:Z scale: V [Sens. DeflSens] (0.0003750000 V/LSB) 24.57600 V
+Lines starting with * open a new section, the others are key: value entries.
+
+This program is released under the GNU General Public License version 2.
+'''
+
+import re
+
+END_OF_HEADER='File list end'
+
+_soft_scale_expr=re.compile(r'\[[^\]]*\]')
+_hard_scale_expr=re.compile(r'\(\s*([^\s\)]+)[^\)]*\)')
+
+
+def value_number(value):
+    '''
+    Returns the first number found in a header value, skipping the [soft scale] and
+    (hard scale) parts of Nanoscope parameters:
+    'V [Sens. DeflSens] (0.000375 V/LSB) 24.576 V' --> 24.576
+    'V 45.3 nm/V' --> 45.3
+    '''
+    stripped=_hard_scale_expr.sub(' ',_soft_scale_expr.sub(' ',value))
+    for word in stripped.split():
+        try:
+            return float(word)
+        except ValueError:
+            pass
+    raise ValueError, 'No number in header value: '+value
+
+
+def value_hard_scale(value):
+    '''
+    Returns the hard scale (the LSB-to-volt factor between parentheses) of a Nanoscope parameter:
+    'V [Sens. DeflSens] (0.000375 V/LSB) 24.576 V' --> 0.000375
+    '''
+    match=_hard_scale_expr.search(value)
+    if match is None:
+        raise ValueError, 'No hard scale in header value: '+value
+    return float(match.group(1))
+
+
+class NanoscopeHeader:
+    '''
+    The text header of a Nanoscope file, parsed once.
+
+    self.sections is the ordered list of (section name, [(key, value),...]) tuples.
+    self.entries is the ordered list of all the (section name, key, value) tuples of the file,
+    for getters that depend on the position of a key with respect to the others.
+    '''
+    def __init__(self,headerfile):
+        self.sections=[]
+        self.entries=[]
+        self._chunk_coordinates=None
+
+        headerfile.seek(0)
+        entries=[]
+        self.sections.append(('',entries))
+        while True:
+            line=headerfile.readline()
+            #the header is padded with zeros before the binary data: that ends it as well
+            if (not line) or line[0]!='\\':
+                break
+            line=line[1:].rstrip('\r\n')
+            if line.startswith('*'):
+                name=line[1:]
+                if name==END_OF_HEADER:
+                    break
+                entries=[]
+                self.sections.append((name,entries))
+                continue
+
+            separator=line.find(': ')
+            if separator==-1:
+                key,value=line.rstrip(':'),''
+            else:
+                key,value=line[:separator],line[separator+2:].strip()
+            entries.append((key,value))
+            self.entries.append((self.sections[-1][0],key,value))
+
+    def find(self,key,section=None):
+        '''
+        Returns the list of the values of key, in file order.
+        If section is given, only sections whose name contains it are searched.
+        '''
+        found=[]
+        for name,entries in self.sections:
+            if section is not None and section not in name:
+                continue
+            for entry_key,value in entries:
+                if entry_key==key:
+                    found.append(value)
+        return found
+
+    def get(self,key,section=None,occurrence=0):
+        '''
+        Returns the value of the occurrence-th (default: first, -1: last) key in the header
+        '''
+        found=self.find(key,section)
+        if not found:
+            raise KeyError, key
+        return found[occurrence]
+
+    def get_float(self,key,section=None,occurrence=0):
+        '''
+        Returns the number in the value of key (see value_number())
+        '''
+        return value_number(self.get(key,section,occurrence))
+
+    def get_hard_scale(self,key,section=None,occurrence=0):
+        '''
+        Returns the hard scale in the value of key (see value_hard_scale())
+        '''
+        return value_hard_scale(self.get(key,section,occurrence))
+
+    def chunk_coordinates(self):
+        '''
+        Returns a list of (offset, size) tuples, one for each data chunk in the file.
+        A chunk is described by a section having both a Data offset and a Data length.
+        '''
+        if self._chunk_coordinates is None:
+            coordinates=[]
+            for name,entries in self.sections:
+                keys=dict(entries)
+                if 'Data offset' in keys and 'Data length' in keys:
+                    coordinates.append((int(value_number(keys['Data offset'])),int(value_number(keys['Data length']))))
+            self._chunk_coordinates=coordinates
+        return self._chunk_coordinates
@@ -8,19 +8,46 @@ a library of helping functions for spotting force spectroscopy peaks
 '''
 import numpy as np
 
+#kernels longer than this are convolved through FFTs in conv_dx()
+FFT_MIN_WINDOW=64
+
 def conv_dx(data,vect):
     '''
-    Returns the right-centered convolution of data with vector vect
+    Returns the right-centered convolution of data with vector vect:
+    out[j] = sum(data[j+k]*vect[k]) for j < len(data)-len(vect), and 0 for the last len(vect) points.
+    
+    The result is a numpy array. Sums are accumulated in the same order as the plain double loop
+    of old, so that the result is identical to it; kernels longer than FFT_MIN_WINDOW points are
+    convolved through FFTs instead, which agrees with the direct sum to rounding errors.
+    '''
+    return conv_dx_batch(np.asarray(data,float)[np.newaxis,:],vect)[0]
+
+def conv_dx_batch(stack,vect):
+    '''
+    Right-centered convolution (as conv_dx()) of each row of a 2D array of equal-length traces
+    (e.g. the retraction traces of many curves) with vector vect, all at once.
+    Returns a 2D array of the same shape.
     '''
-    dim=len(data)
+    stack=np.asarray(stack,float)
+    vect=np.asarray(vect,float)
+    dim=stack.shape[1]
     window=len(vect)
-    temparr=[0.0]*dim
+    temparr=np.zeros(stack.shape)
     
     end=dim-window
-
-    for j in range(end):
-     for k in range(window):
-      temparr[j]+=data[j+k]*vect[k]
+    if end<=0:
+        return temparr
+    
+    if window > FFT_MIN_WINDOW:
+        #correlation of the traces with the kernel, as a product of spectra
+        size=1
+        while size < dim+window:
+            size*=2
+        spectra=np.fft.rfft(stack,size,axis=1)*np.conj(np.fft.rfft(vect,size))
+        temparr[:,:end]=np.fft.irfft(spectra,size,axis=1)[:,:end]
+    else:
+        for k in range(window):
+            temparr[:,:end]+=stack[:,k:k+end]*vect[k]
 
     return temparr  
  
@@ -49,23 +76,48 @@ def noise_absdev(data,positive=False,maxcut=0.2,stable=0.005):
     Then calculate the absolute deviation.
     
     If positive=True we cut the most positive data points, False=we cut the negative ones.
+    
+    The absolute deviations of all the cuts (five points after five points) are computed at once
+    from the prefix sums of the sorted data, then the first cut failing the test is looked for.
     '''
-    out=[item for item in data] #we copy just to be sure...
-    out.sort()
+    out=np.sort(np.asarray(data,float))
     if positive:
-        out.reverse()
-        
-    temp_absdev=absdev(out)
-    cut_absdev=0
-    for index in range(len(out)):
-        cutindex=(index+1)*5
-        cut_absdev=absdev(out[cutindex:]) #we jump five points after five points...
-        if 1-(cut_absdev/temp_absdev) < stable and cutindex<(maxcut*len(out)):
-            temp_absdev=cut_absdev
-        else:
-            break
-        
-    return cut_absdev
+        #the absolute deviation does not change with the sign, and the cut points are the first ones
+        out=-out[::-1]
+    dim=len(out)
+    if dim==0:
+        return 0
+    
+    #the loop of old stops at the first cut that reaches maxcut*dim points, at the latest
+    cutindexes=np.arange(1,dim+1)*5
+    last=np.searchsorted(cutindexes,maxcut*dim)
+    cutindexes=cutindexes[:last+1]
+    
+    #absolute deviation of out[cutindex:], for each cutindex (0 where nothing is left)
+    prefix=np.concatenate(([0.0],np.cumsum(out)))
+    kept=cutindexes[cutindexes<dim]
+    counts=dim-kept
+    totals=prefix[dim]-prefix[kept]
+    means=totals/counts
+    #out[kept:split] are below the mean, out[split:] are above it
+    split=np.maximum(np.searchsorted(out,means),kept)
+    below=prefix[split]-prefix[kept]
+    above=totals-below
+    absD=(above-means*(dim-split))+(means*(split-kept)-below)
+    cut_absdevs=np.zeros(len(cutindexes))
+    cut_absdevs[:len(kept)]=absD/counts
+    
+    previous=np.concatenate(([absdev(out)],cut_absdevs[:-1]))
+    errors=np.seterr(divide='ignore',invalid='ignore')
+    try:
+        goes_on=(1-(cut_absdevs/previous) < stable) & (cutindexes<(maxcut*dim))
+    finally:
+        np.seterr(**errors)
+    
+    stops=np.flatnonzero(~goes_on)
+    if len(stops)==0:
+        return cut_absdevs[-1]
+    return cut_absdevs[stops[0]]
         
 def abovenoise(convoluted,noise_level,cut_index=0,abs_devs=4):
     '''
@@ -73,18 +125,12 @@ def abovenoise(convoluted,noise_level,cut_index=0,abs_devs=4):
     '''
     #calculate absolute noise deviation
     #noise_level=noise_absdev(convoluted[cut_index:])
-        
-    above=[]
-        
-    for index in range(len(convoluted)):
-        if index<cut_index:
-            above.append(0)
-        else:
-            #FIXME: should calculate the *average* (here we assume that convolution mean is 0, which is FALSE!)
-            if convoluted[index] < -1*noise_level*abs_devs:
-                above.append(convoluted[index])
-            else:
-                above.append(0)
+    convoluted=np.asarray(convoluted,float)
+    
+    #FIXME: should calculate the *average* (here we assume that convolution mean is 0, which is FALSE!)
+    spikes=convoluted < -1*noise_level*abs_devs
+    spikes[:max(cut_index,0)]=False
+    above=np.where(spikes,convoluted,0.0)
     return above
         
 def find_peaks(above, seedouble=10):
@@ -98,33 +144,33 @@ def find_peaks(above, seedouble=10):
     seedouble=value at which we want to "delete" double peaks. That is, if two peaks have a distance
     < than $seedouble points , only the first is kept.
     '''
-    nonzero=[]
+    above=np.asarray(above,float)
     peaks_location=[]
     peaks_size=[]
-        
-    for index in range(len(above)):
-        if above[index] != 0:
-            nonzero.append(index)
-        else:
-            if len(nonzero) != 0:
-                if len(nonzero)==1:
-                    nonzero.append(nonzero[0]+1)
-                peaks_size.append(min(above[nonzero[0]:nonzero[-1]]))
-                peaks_location.append(above[nonzero[0]:nonzero[-1]].index(peaks_size[-1])+nonzero[0])
-                nonzero=[]
-            else:
-                pass
+    
+    #clusters are the runs of nonzero points; a cluster still open at the end of the vector is not counted
+    nonzero=np.concatenate(([False],above != 0,[False]))
+    edges=np.flatnonzero(nonzero[1:] != nonzero[:-1])
+    starts=edges[0::2]
+    ends=edges[1::2]
+    if len(ends) and ends[-1]==len(above):
+        starts=starts[:-1]
+        ends=ends[:-1]
+    
+    for start,end in zip(starts,ends):
+        #the last point of a cluster is left out, as it always was, unless it is the only one
+        stop=max(end-1,start+1)
+        location=start+int(np.argmin(above[start:stop]))
+        peaks_location.append(location)
+        peaks_size.append(above[location])
                 
-    #recursively eliminate double peaks
-    #(maybe not the smartest of cycles, but i'm asleep...)
-    temp_location=None
-    while temp_location != []:
-        temp_location=[]
-        if len(peaks_location)>1:
-            for index in range(len(peaks_location)-1):
-                if peaks_location[index+1]-peaks_location[index] < seedouble:
-                    temp_location=peaks_location[:index]+peaks_location[index+1:]
-        if temp_location != []:
-            peaks_location=temp_location           
+    #eliminate double peaks: from right to left, a peak closer than seedouble to the next kept one is dropped
+    if len(peaks_location)>1:
+        temp_location=[peaks_location[-1]]
+        for location in peaks_location[-2::-1]:
+            if temp_location[-1]-location >= seedouble:
+                temp_location.append(location)
+        temp_location.reverse()
+        peaks_location=temp_location
         
-    return peaks_location,peaks_size
\ No newline at end of file
+    return peaks_location,peaks_size        
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+libpool.py
+
+Runs an analysis over the curves of a playlist on a pool of worker processes.
+
+Each curve is independent, so the curves are fanned out to the workers in chunks,
+and the results come back in playlist order. The workers are forked: they inherit
+the command line object and the playlist, and only the curve indexes and the results
+travel between processes (results must thus be picklable).
+Where processes cannot be forked (Windows) or with a single worker, the curves are
+processed serially in the calling process.
+The fork happens with the curve lock of the command line held, so that its prefetch
+thread is not decoding a curve meanwhile.
+
+This program is released under the GNU General Public License version 2.
+'''
+
+import sys
+import multiprocessing
+
+#(function, cli, items) of the running map_curves(), inherited by the forked workers
+_context=None
+
+
+def _run(index):
+    '''
+    worker side: processes the index-th curve of the playlist.
+    returns a (True, result) or (False, error message) tuple.
+    '''
+    function,cli,items=_context
+    try:
+        return True,function(cli,items[index])
+    except Exception, e:
+        return False,str(e)
+
+
+def workers_count(configured):
+    '''
+    number of worker processes: the configured one, or as many as the CPUs if it is 0 (or None)
+    '''
+    if configured:
+        return max(1,int(configured))
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def map_curves(function, cli, items, workers=0, chunksize=None):
+    '''
+    Yields a (True, function(cli, item)) tuple for each item of the playlist, in order,
+    or (False, error message) if function raised an exception for that item.
+
+    function must be a plain function (or an unbound method) taking the command line object
+    and a HookeCurve.
+    workers is the number of processes (0: as many as the CPUs); chunksize is the
+    number of curves sent at once to a worker (default: a few chunks per worker).
+    '''
+    global _context
+    workers=min(workers_count(workers),len(items))
+
+    if workers <= 1 or sys.platform=='win32':
+        _context=(function,cli,items)
+        try:
+            for index in range(len(items)):
+                yield _run(index)
+        finally:
+            _context=None
+        return
+
+    if chunksize is None:
+        chunksize=max(1,len(items)/(workers*4))
+
+    _context=(function,cli,items)
+    #the workers are forked when the pool is created. The prefetch thread of the command line
+    #may be decoding a curve at that moment, and the children would inherit its half-done work
+    #(and a curve_lock held by a thread they do not have). Holding curve_lock while forking
+    #makes sure that thread is idle; the children only inherit it held by their own thread.
+    #(Creating the pool before the threads start would not do: a pool lives for one command.)
+    lock=getattr(cli,'curve_lock',None)
+    if lock is not None:
+        lock.acquire()
+    try:
+        pool=multiprocessing.Pool(workers)
+    finally:
+        if lock is not None:
+            lock.release()
+    try:
+        for result in pool.imap(_run,range(len(items)),chunksize):
+            yield result
+        pool.close()
+    finally:
+        _context=None
+        pool.terminate()
+        pool.join()
@@ -10,10 +10,12 @@ Massimo Sandal, Allen Chen (c) 2009
 
 import libhookecurve as lhc
 import libhooke as lh
-import struct
 
 class mcsDriver(lhc.Driver):
     
+    #Sniffing rules (see lhc.Driver)
+    extensions=('.mcs',)
+    
     def __init__(self, filename):
         '''
         Open the RED (A) ones; the BLUE (D) mirror ones will be automatically opened
@@ -29,13 +31,8 @@ class mcsDriver(lhc.Driver):
         
         #print self.filename, self.othername
         
-        self.filedata=open(filename,'rb')
-        self.reddata=self.filedata.read()
-        self.filedata.close()
-        
-        self.filebluedata=open(othername,'rb') #open also the blue ones
-        self.bluedata=self.filebluedata.read()
-        self.filebluedata.close()
+        self.reddata=lhc.MappedFile(filename)
+        self.bluedata=lhc.MappedFile(othername) #open also the blue ones
         
         self.filetype = 'mcs'
         self.experiment = 'smfluo'
@@ -47,14 +44,14 @@ class mcsDriver(lhc.Driver):
             return False
         
     def close_all(self):
-        self.filedata.close()
-        self.filebluedata.close()
+        self.reddata.close()
+        self.bluedata.close()
         
         
     def default_plots(self):
         red_data=self.read_file(self.reddata)
         blue_data=self.read_file(self.bluedata)
-        blue_data=[-1*float(item) for item in blue_data] #visualize blue as "mirror" of red
+        blue_data=-1.0*blue_data #visualize blue as "mirror" of red
         
         main_plot=lhc.PlotObject()
         main_plot.add_set(range(len(red_data)),red_data)
@@ -67,14 +64,12 @@ class mcsDriver(lhc.Driver):
         
         return [main_plot]
     
-    def read_file(self, raw_data):    
-        real_data=[]
-        intervalsperfile=struct.unpack('h', raw_data[10:12])[0] #read in number of intervals in this file
-                                                                #this data is contained in bit offset 10-12 in mcs file
-        #see http://docs.python.org/library/struct.html#module-struct for additional explanation
+    def read_file(self, raw_data):
+        '''
+        Returns the counts of a mapped mcs file (see lhc.MappedFile) as a read-only array
+        '''
+        intervalsperfile=int(raw_data.array(10,1,'<i2')[0]) #read in number of intervals in this file
+                                                            #this data is contained in bit offset 10-12 in mcs file
         
-        numbytes=len(raw_data) #data is stored in 4-byte chunks, starting with pos 256
-        for j in range(0,intervalsperfile): #read in all intervals in file
-            temp=raw_data[256+j*4:256+j*4+4]    #data starts at byte offset 256
-            real_data.append(struct.unpack('i', temp)[0]) #[0] because it returns a 1-element tuple
-        return real_data
\ No newline at end of file
+        #data is stored in 4-byte ints, starting with byte offset 256
+        return raw_data.array(256,intervalsperfile,'<i4')
\ No newline at end of file
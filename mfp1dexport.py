@@ -13,6 +13,9 @@ import libhooke as lh
 
 class mfp1dexportDriver(lhc.Driver):
     
+    #Sniffing rules (see lhc.Driver)
+    first_line='Wave'
+    
     def __init__(self, filename):
         
         self.filename=filename
@@ -66,7 +69,7 @@ class mfp1dexportDriver(lhc.Driver):
             xret.append(float(spline[2]))
             yret.append(float(spline[3]))
             
-        return [[xext,yext],[xret,yret]]
+        return [[lhc.DataChunk(xext),lhc.DataChunk(yext)],[lhc.DataChunk(xret),lhc.DataChunk(yret)]]
         
     def deflection(self):
         self.data=self._read_columns()
@@ -76,8 +79,8 @@ class mfp1dexportDriver(lhc.Driver):
     def default_plots(self):   
         main_plot=lhc.PlotObject()
         defl_ext,defl_ret=self.deflection()
-        yextforce=[i*self.k for i in defl_ext]
-        yretforce=[i*self.k for i in defl_ret]
+        yextforce=defl_ext*self.k
+        yretforce=defl_ret*self.k
         main_plot.add_set(self.data[0][0],yextforce)
         main_plot.add_set(self.data[1][0],yretforce)
         main_plot.normalize_vectors()
@@ -43,19 +43,11 @@ import libhookecurve as lhc
 __version__='0.0.0.20100310'
 
 
-class DataChunk(list):
-    #Dummy class to provide ext and ret methods to the data list.
-    
-    def ext(self):
-        halflen=(len(self)/2)
-        return self[0:halflen]
-        
-    def ret(self):
-        halflen=(len(self)/2)
-        return self[halflen:]
-
 class mfp3dDriver(lhc.Driver):
 
+    #Sniffing rules (see lhc.Driver)
+    extensions=('.ibw',)
+
     #Construction and other special methods
     
     def __init__(self,filename):
@@ -63,9 +55,7 @@ class mfp3dDriver(lhc.Driver):
         constructor method
         '''
            
-	self.textfile    =file(filename)
-        self.binfile=file(filename,'rb')
-	#unnecesary, but some other part of the program expects these to be open     
+        self.mapped=lhc.MappedFile(filename)
 
         self.forcechunk=0
         self.distancechunk=1
@@ -80,10 +70,6 @@ class mfp3dDriver(lhc.Driver):
         self.spring_constant = None
         self.filename = filename
 
-        self.filedata = open(filename,'rU')
-        self.lines = list(self.filedata.readlines())
-        self.filedata.close()
-
         self.filetype = 'mfp3d'
         self.experiment = 'smfs'
              
@@ -91,7 +77,9 @@ class mfp3dDriver(lhc.Driver):
     def _get_data_chunk(self,whichchunk):
 
 	data = None
-        f = open(self.filename, 'rb')
+        #the map works as a file for the header, and we view the data straight from it
+        f = self.mapped.map
+        f.seek(0)
         ####################### ORDERING
         # machine format for IEEE floating point with big-endian
         # byte ordering
@@ -143,7 +131,8 @@ class mfp3dDriver(lhc.Driver):
             modDate = struct.unpack(format+'I', f.read(4))[0]
             ignore = f.read(4) # 1 uint32
             # Numpy algorithm works a lot faster than struct.unpack
-            data = numpy.fromfile(f, dtype, npnts)
+            data = self.mapped.array(f.tell(), npnts, dtype)
+            f.seek(f.tell()+data.nbytes)
 
         elif version == 5:
             # pre header
@@ -196,7 +185,8 @@ class mfp3dDriver(lhc.Driver):
             ignore = f.read(4) # 1 int32
             ignore = f.read(8) # 2 int32
 
-            data = numpy.fromfile(f, dtype, npnts)
+            data = self.mapped.array(f.tell(), npnts, dtype)
+            f.seek(f.tell()+data.nbytes)
             note_str = f.read(noteSize)
             note_lines = note_str.split('\r')
             self.note = {}
@@ -210,7 +200,6 @@ class mfp3dDriver(lhc.Driver):
             assert False, "Fileversion is of type '%i', not supported" % dtype
             data = []
 
-        f.close()
         if len(data) > 0:
             #we have 3 columns: deflection, LVDT, raw
             #TODO detect which is each one
@@ -235,11 +224,11 @@ class mfp3dDriver(lhc.Driver):
     def _force(self):
 	#returns force vector
         Kspring=self.spring_constant
-        return DataChunk([(meter*Kspring) for meter in self._deflection()])
+        return self._deflection()*Kspring
 
     def _deflection(self):
         #for internal use (feeds _force)
-        deflect=self.data_chunks[self.forcechunk]/self.spring_constant      	     
+        deflect=lhc.DataChunk(self.data_chunks[self.forcechunk]/self.spring_constant)
         return deflect
 
     def _flatten(self, tup):
@@ -249,20 +238,17 @@ class mfp3dDriver(lhc.Driver):
         return out            
     
     def _Z(self):   
-        return DataChunk(self.data_chunks[self.distancechunk])
+        return lhc.DataChunk(self.data_chunks[self.distancechunk])
         
     def is_me(self):
-        if len(self.lines) < 34:
-            return False
-
         name, extension = os.path.splitext(self.filename)
         if extension == '.ibw':
-            for line in self.lines:
-                if line.startswith('ForceNote:'):
-		    self.data_chunks=[self._get_data_chunk(num) for num in [0,1,2]]
+            #look for a ForceNote: line, without splitting the whole file in lines
+            for line_start in ('\r','\n'):
+                if self.mapped.map.find(line_start+'ForceNote:') != -1:
+                    self.data_chunks=[self._get_data_chunk(num) for num in [0,1,2]]
                     return True
-            else:
-                return False
+            return False
         else:
             return False
     
@@ -270,8 +256,7 @@ class mfp3dDriver(lhc.Driver):
         '''
         Explicitly closes all files
         '''
-        self.textfile.close()
-        self.binfile.close()
+        self.mapped.close()
     
     def default_plots(self):
         '''
@@ -291,5 +276,5 @@ class mfp3dDriver(lhc.Driver):
 
     def deflection(self):
         #interface for correct plotmanip and others
-        deflectionchunk=DataChunk(self._deflection())
+        deflectionchunk=self._deflection()
         return deflectionchunk.ext(),deflectionchunk.ret()
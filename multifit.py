@@ -191,14 +191,14 @@ class multifitCommands:
 
             #use both fit functions
             try:
-                wlcparams, wlcyfit, wlcxfit, wlcfit_errors,wlc_qstd = self.wlc_fit(fitpoints, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T, return_errors=True )
+                wlcparams, wlcyfit, wlcxfit, wlcfit_errors,wlc_qstd = self.cached_fit('wlc',fitpoints, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],pl_value,T)
                 wlcerror=False	
             except:
                 print 'WLC fit not possible'
                 wlcerror=True
 
             try:
-                fjcparams, fjcyfit, fjcxfit, fjcfit_errors,fjc_qstd = self.efjc_fit(fitpoints, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],kl_value,T, return_errors=True )
+                fjcparams, fjcyfit, fjcxfit, fjcfit_errors,fjc_qstd = self.cached_fit('efjc',fitpoints, displayed_plot.vectors[1][0], displayed_plot.vectors[1][1],kl_value,T)
                 fjcerror=False
             except:
                 print 'eFJC fit not possible'
@@ -1,22 +1,125 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from mdp import pca
 from libhooke import WX_GOOD, ClickedPoint
 import wxversion
 wxversion.select(WX_GOOD)
 from wx import PostEvent
 import numpy as np
 import scipy as sp
+import scipy.stats
+import scipy.signal
+import scipy.ndimage
 import copy
 import os.path
 import time
 import libhookecurve as lhc
+import libpool as lpool
 import pylab as pyl
 
 import warnings
 warnings.simplefilter('ignore',np.RankWarning)
 
+#density filter: beyond KDE_GRID_POINTS points, the kernel density is computed on a grid
+#of KDE_GRID_STEP kernel standard deviations and interpolated, unless the grid would need
+#more than KDE_GRID_MAX steps on a side.
+#The grid error is estimated on each run: KDE_ERROR_FACTOR times the largest error found
+#on KDE_CHECK_POINTS points evaluated exactly.
+KDE_GRID_POINTS=5000
+KDE_GRID_STEP=0.05
+KDE_GRID_MAX=4096
+KDE_CHECK_POINTS=1000
+KDE_ERROR_FACTOR=4.0
+#the automatic density filter: the highest density divided by this
+KDE_AUTO_FILTER=3.242311147
+
+def pca(data, output_dim=2):
+    '''
+    Principal component analysis: projects the rows of data on their first output_dim principal
+    components, as mdp.pca does. The components come from the singular value decomposition
+    of the centered data; the sign of each is chosen so that its largest loading is positive.
+    '''
+    data=np.asarray(data,dtype='float')
+    centered=data-data.mean(axis=0)
+    u,s,vt=np.linalg.svd(centered,full_matrices=False)
+    components=vt[:output_dim]
+    signs=np.sign(components[np.arange(len(components)),abs(components).argmax(axis=1)])
+    return np.dot(centered,(components*signs[:,np.newaxis]).T)
+
+
+def kde_density(kernel, points):
+    '''
+    Evaluates kernel (a 2D scipy.stats.gaussian_kde) at points (a 2 x N array) in one go.
+    Returns (densities, error): error bounds the error of each density (0 if exact).
+    
+    Beyond KDE_GRID_POINTS points the data are whitened with the kernel covariance, so that
+    the kernel is a unit gaussian; the dataset of the kernel is linearly binned on a grid,
+    convolved with the gaussian and the density is interpolated (cubic spline) at the points.
+    The grid error depends on the data (about 1e-4 to 3e-4 of the highest density on clustered
+    and correlated test data), so it is measured each time on a sample of the points.
+    '''
+    points=np.asarray(points,dtype='float')
+    if points.shape[1] <= KDE_GRID_POINTS:
+        return kernel(points),0.0
+    
+    cut=4.0 #kernel standard deviations
+    whitening=np.linalg.inv(np.linalg.cholesky(kernel.covariance))
+    dataset=np.dot(whitening,kernel.dataset)
+    white_points=np.dot(whitening,points)
+    low=np.minimum(dataset.min(axis=1),white_points.min(axis=1))-cut
+    high=np.maximum(dataset.max(axis=1),white_points.max(axis=1))+cut
+    size=np.ceil((high-low)/KDE_GRID_STEP).astype(int)+2
+    if size.max() > KDE_GRID_MAX:
+        #too sparse for a grid (outliers): evaluate directly
+        return kernel(points),0.0
+    
+    #linear binning of the dataset
+    position=(dataset-low[:,np.newaxis])/KDE_GRID_STEP
+    index=np.floor(position).astype(int)
+    weight=position-index
+    grid=np.zeros(size[0]*size[1])
+    for dx,wx in ((0,1-weight[0]),(1,weight[0])):
+        for dy,wy in ((0,1-weight[1]),(1,weight[1])):
+            grid+=np.bincount((index[0]+dx)*size[1]+index[1]+dy,wx*wy,size[0]*size[1])
+    grid=grid.reshape(size)/kernel.n
+    
+    #the unit gaussian, on the grid steps
+    half=int(np.ceil(cut/KDE_GRID_STEP))
+    gaussian=np.exp(-0.5*(np.arange(-half,half+1)*KDE_GRID_STEP)**2)/np.sqrt(2*np.pi)
+    density=sp.signal.fftconvolve(grid,np.outer(gaussian,gaussian),mode='same')
+    density=sp.ndimage.spline_filter(density,3)
+    density=sp.ndimage.map_coordinates(density,(white_points-low[:,np.newaxis])/KDE_GRID_STEP,order=3,prefilter=False)
+    #back from the whitened coordinates
+    density=density*abs(np.linalg.det(whitening))
+    
+    #error estimate, on a (reproducible) sample of the points
+    sample=np.random.RandomState(0).permutation(points.shape[1])[:KDE_CHECK_POINTS]
+    error=KDE_ERROR_FACTOR*np.max(abs(density[sample]-kernel(points[:,sample])))
+    return density,error
+
+
+def density_filter(kernel, points, filter_value=0):
+    '''
+    The density filter of do_pca: returns (densities, tallest, filter) for points (2 x N array),
+    densities being kernel at each point, tallest the highest density and filter the given
+    filter_value, or tallest/KDE_AUTO_FILTER if it is 0.
+    The points are kept if their density is above filter: the densities that kde_density() gives
+    within its error of the highest or of the filter are evaluated exactly, so that the choice
+    is the same as if all were.
+    '''
+    densities,error=kde_density(kernel, points)
+    if error > 0:
+        top=densities >= densities.max()-2*error
+        densities[top]=kernel(points[:,top])
+    tallest=float(densities.max())
+    if filter_value == 0:
+        my_filter=tallest/KDE_AUTO_FILTER
+    else:
+        my_filter=float(filter_value)
+    if error > 0:
+        close=abs(densities-my_filter) <= error
+        densities[close]=kernel(points[:,close])
+    return densities,tallest,my_filter
 
 class pclusterCommands:
     
@@ -24,11 +127,70 @@ class pclusterCommands:
         self.clustplot1=None
         self.clustplot2=None
 
+    def pcluster_curve(self, item, pl_value, T, min_deviation):
+        '''
+        pcluster measurements of a curve of the playlist: the curve is decoded and flattened once,
+        its peaks are found on the flattened plot and each is fitted with the WLC, from the peak to
+        auto_fit_points points before it.
+        Returns None if no peak is found, otherwise the lists
+        (contour lengths, persistence lengths, sigma contour, sigma persistence, forces, slopes)
+        of the peaks kept.
+        '''
+        if not item.identify(self.drivers):
+            raise IOError('unknown file format')
+        
+        try:
+            plot=item.curve.default_plots()[0]
+            flatten=self._find_plotmanip('flatten') #extract flatten plot manipulator
+            plot=flatten(plot, item, customvalue=1)
+            xvector,yvector=plot.vectors[1][0],plot.vectors[1][1]
+            
+            peak_location,peak_size=self.has_peaks(plot,min_deviation,current=item)
+            if len(peak_location)==0:
+                return None
+            
+            fit_points=int(self.config['auto_fit_points']) # number of points to fit before the peak maximum <50>
+            slope_span=int(self.config['auto_slope_span'])
+            cindex=self.find_contact_point(plot,item) #Automatically find contact point
+            contact_point=self._clickize(xvector,yvector,cindex)
+            basepoints=self.auto_baseline_points(peak_location, plot)
+            boundaries=[basepoints[0].index, basepoints[1].index]
+            boundaries.sort()
+            avg=np.mean(yvector[boundaries[0]:boundaries[1]]) #y points to average
+            line_fits=lhc.LineFits(xvector,yvector)
+            
+            c_lengths=[]
+            p_lengths=[]
+            sigma_c_lengths=[]
+            sigma_p_lengths=[]
+            forces=[]
+            slopes=[]
+            for peak in peak_location:
+                points=self.peak_fit_points(plot, peak, contact_point, fit_points)
+                if points is None:
+                    continue
+                fit=self.cached_fit('wlc', points, xvector, yvector, pl_value, T, item)
+                measured=self.measure_peak(plot, peak, contact_point, avg, pl_value, T, fit_points, slope_span, line_fits, item, fit)
+                if measured is None:
+                    continue
+                c_leng, p_leng, force, slope, sigma_c_leng, sigma_p_leng, qstd = measured[0]
+                for var, vector in zip([c_leng, p_leng, sigma_c_leng, sigma_p_leng, force, slope],[c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes]):
+                    vector.append(var)
+            return c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes
+        finally:
+            #close all open files, and free the curve (but the displayed one)
+            item.curve.close_all()
+            if item is not self.current:
+                item.curve=None
+    
     def do_pcluster(self,args):
         '''
         pCLUSTER
         (pcluster.py)
         Automatically measures peaks and extracts informations for further clustering
+        
+        Curves are processed in parallel by "set workers" processes
+        (0 = as many as the processors); the files are written at the end.
         (c)Paolo Pancaldi, Massimo Sandal 2009
         '''
         if self.config['hookedir'][0]=='/':
@@ -48,166 +210,41 @@ class pclusterCommands:
             if 'pl=' in arg:
                 pl_expression=arg.split('=')
                 pl_value=float(pl_expression[1]) #actual value
-            else:
-                pl_value=None
                 
         #configuration variables
-        min_npks = self.convfilt_config['minpeaks']
         min_deviation = self.convfilt_config['mindeviation']
+        T=self.config['temperature'] #temperature of the system in kelvins. By default it is 293 K. <301.0>
         
         pclust_filename = "automeasure_"+self.my_curr_dir+"_blind"+blindw+".txt" #raw_input('Automeasure filename? ')
         realclust_filename = "coordinate_"+self.my_curr_dir+"_blind"+blindw+".txt" #raw_input('Coordinates filename? ')
         peackforce_filename = "peakforce_"+self.my_curr_dir+"_blind"+blindw+".txt"  #raw_input('Peacks and Forces filename? ')
         
-        f=open(self.my_work_dir+pclust_filename,'w+')
-        f.write('Analysis started '+time.asctime()+'\n')
-        f.write('----------------------------------------\n')
-        f.write('; Contour length (nm)  ;  Persistence length (nm) ;  Max.Force (pN)  ;  Slope (N/m) ;  Sigma contour (nm) ; Sigma persistence (nm)\n')
-        f.close()
+        started=time.asctime()
+        #lines of the three files, written once at the end
+        automeasure_lines=[]
+        coordinate_lines=[]
+        peackforce_lines=[]
         
-        f=open(self.my_work_dir+realclust_filename,'w+')
-        f.write('Analysis started '+time.asctime()+'\n')
-        f.write('----------------------------------------\n')
-        f.write('; Peak number ; Mean delta (nm)  ;  Median delta (nm) ;  Mean force (pN)  ;  Median force (pN) ; First peak length (nm) ; Last peak length (nm) ; Max force (pN) ; Min force (pN) ; Max delta (nm) ; Min delta (nm) ; Peaks Diff\n')
-        f.close()
-        
-        f=open(self.my_work_dir+peackforce_filename,'w+')
-        f.write('Analysis started '+time.asctime()+'\n')
-        f.write('----------------------------------------\n')
-        f.write('; Peak number  ;  1 peak Length (nm) ; 1 peak Force (pN) ;  2 peak Length (nm) ; 2 peak Force (pN) ;  3 peak Length (nm) ; 3 peak Force (pN) ;  4 peak Length (nm) ; 4 peak Force (pN) ;  5 peak Length (nm) ; 5 peak Force (pN) ;  6 peak Length (nm) ; 6 peak Force (pN) ;  7 peak Length (nm) ; 7 peak Force (pN) ;  8 peak Length (nm) ; 8 peak Force (pN)\n')
-        f.close()
-        
-
-        def plot_informations(itplot,pl_value):
-            '''
-            OUR VARIABLES
-            contact_point.absolute_coords		(2.4584142802103689e-007, -6.9647135616234017e-009)
-            peak_point.absolute_coords			(3.6047748250571423e-008, -7.7142802788854212e-009)
-            other_fit_point.absolute_coords	(4.1666139243838867e-008, -7.3759393477579707e-009)
-            peak_location										[510, 610, 703, 810, 915, 1103]
-            peak_size												[-1.2729111505202212e-009, -9.1632775347399312e-010, -8.1707438353929907e-010, -8.0335812578148904e-010, -8.7483955226387558e-010, -3.6269619757067322e-009]
-            params													[2.2433999931959462e-007, 3.3230248825175678e-010]
-            fit_errors											[6.5817195369767644e-010, 2.4415923138871498e-011]
-            '''
-            fit_points=int(self.config['auto_fit_points']) # number of points to fit before the peak maximum <50>
-            
-            T=self.config['temperature'] #temperature of the system in kelvins. By default it is 293 K. <301.0>
-            cindex=self.find_contact_point(itplot[0]) #Automatically find contact point <158, libhooke.ClickedPoint>
-            contact_point=self._clickize(itplot[0].vectors[1][0], itplot[0].vectors[1][1], cindex)
-            self.basepoints=[]
-            base_index_0=peak_location[-1]+self.fit_interval_nm(peak_location[-1], itplot[0], self.config['auto_right_baseline'],False)
-            self.basepoints.append(self._clickize(itplot[0].vectors[1][0],itplot[0].vectors[1][1],base_index_0))
-            base_index_1=self.basepoints[0].index+self.fit_interval_nm(self.basepoints[0].index, itplot[0], self.config['auto_left_baseline'],False)
-            self.basepoints.append(self._clickize(itplot[0].vectors[1][0],itplot[0].vectors[1][1],base_index_1))
-            self.basecurrent=self.current.path
-            boundaries=[self.basepoints[0].index, self.basepoints[1].index]
-            boundaries.sort()
-            to_average=itplot[0].vectors[1][1][boundaries[0]:boundaries[1]] #y points to average
-            avg=np.mean(to_average)
-            return fit_points, contact_point, pl_value, T, cindex, avg
-
-        def features_peaks(itplot, peak, fit_points, contact_point, pl_value, T, cindex, avg):
-            '''
-            calculate informations for each peak and add they in 
-            c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes
-            '''
-            c_leng=None
-            p_leng=None
-            sigma_c_leng=None
-            sigma_p_leng=None
-            force=None
-            slope=None
-            
-            delta_force=10
-            slope_span=int(self.config['auto_slope_span'])
-            
-            peak_point=self._clickize(itplot[0].vectors[1][0],itplot[0].vectors[1][1],peak)
-            other_fit_point=self._clickize(itplot[0].vectors[1][0],itplot[0].vectors[1][1],peak-fit_points)
-            
-            points=[contact_point, peak_point, other_fit_point]
-            
-            params, yfit, xfit, fit_errors = self.wlc_fit(points, itplot[0].vectors[1][0], itplot[0].vectors[1][1], pl_value, T, return_errors=True)
-            
-            #Measure forces
-            delta_to_measure=itplot[0].vectors[1][1][peak-delta_force:peak+delta_force]
-            y=min(delta_to_measure)
-            #Measure slopes
-            slope=self.linefit_between(peak-slope_span,peak)[0]
-            #check fitted data and, if right, add peak to the measurement
-            if len(params)==1: #if we did choose 1-value fit
-                p_leng=pl_value
-                c_leng=params[0]*(1.0e+9)
-                sigma_p_leng=0
-                sigma_c_leng=fit_errors[0]*(1.0e+9)
-                force = abs(y-avg)*(1.0e+12)
-            else: #2-value fit
-                p_leng=params[1]*(1.0e+9)
-                #check if persistent length makes sense. otherwise, discard peak.
-                if p_leng>self.config['auto_min_p'] and p_leng<self.config['auto_max_p']:
-                    '''
-                    p_lengths.append(p_leng)       
-                    c_lengths.append(params[0]*(1.0e+9))
-                    sigma_c_lengths.append(fit_errors[0]*(1.0e+9))
-                    sigma_p_lengths.append(fit_errors[1]*(1.0e+9))
-                    forces.append(abs(y-avg)*(1.0e+12))
-                    slopes.append(slope)     
-                    '''
-                    c_leng=params[0]*(1.0e+9)
-                    sigma_c_leng=fit_errors[0]*(1.0e+9)
-                    sigma_p_leng=fit_errors[1]*(1.0e+9)
-                    force=abs(y-avg)*(1.0e+12)
-                else:
-                    p_leng=None
-                    slope=None
-            #return c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes
-            return  c_leng, p_leng, sigma_c_leng, sigma_p_leng, force, slope
-
+        def pcluster_curve(cli,item):
+            return cli.pcluster_curve(item, pl_value, T, min_deviation)
 
         # ------ PROGRAM -------
         c=0
-        for item in self.current_list:
+        for ok,measured in lpool.map_curves(pcluster_curve,self,self.current_list,self.config['workers']):
+            item=self.current_list[c]
             c+=1
-            item.identify(self.drivers)
-            itplot=item.curve.default_plots()
-            flatten=self._find_plotmanip('flatten') #extract flatten plot manipulator
-            itplot[0]=flatten(itplot[0], item, customvalue=1)
-            try:
-                peak_location,peak_size=self.exec_has_peaks(item,min_deviation)
-            except: 
-                #We have troubles with exec_has_peaks (bad curve, whatever).
+            if not ok:
+                #We have troubles with the curve (bad curve, whatever).
                 #Print info and go to next cycle.
                 print 'Cannot process ',item.path
                 continue 
 
-            if len(peak_location)==0:
+            if measured is None:
                 print 'No peaks!'
                 continue
 
-            fit_points, contact_point, pl_value, T, cindex, avg = plot_informations(itplot,pl_value)
-            
-            print '\n\nCurve',item.path, 'is',c,'of',len(self.current_list),': found '+str(len(peak_location))+' peaks.'
-
-            #initialize output data vectors
-            c_lengths=[]
-            p_lengths=[]
-            sigma_c_lengths=[]
-            sigma_p_lengths=[]
-            forces=[]
-            slopes=[]
-
-            #loop each peak of my curve
-            for peak in peak_location:
-                c_leng, p_leng, sigma_c_leng, sigma_p_leng, force, slope = features_peaks(itplot, peak, fit_points, contact_point, pl_value, T, cindex, avg)
-                for var, vector in zip([c_leng, p_leng, sigma_c_leng, sigma_p_leng, force, slope],[c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes]):
-                    if var is not None:
-                        vector.append(var)
-
-            #FIXME: We need a dictionary here...
-            allvects=[c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes]
-            for vect in allvects:
-                if len(vect)==0:
-                    for i in range(len(c_lengths)):
-                        vect.append(0)
+            c_lengths, p_lengths, sigma_c_lengths, sigma_p_lengths, forces, slopes = measured
+            print '\n\nCurve',item.path, 'is',c,'of',len(self.current_list),': '+str(len(c_lengths))+' peaks measured.'
             
             print 'Measurements for all peaks detected:'
             print 'contour (nm)', c_lengths
@@ -218,28 +255,22 @@ class pclusterCommands:
             print 'slopes (N/m)',slopes
             
             '''
-            write automeasure text file
+            automeasure text file
             '''
-            print 'Saving automatic measurement...'
-            f=open(self.my_work_dir+pclust_filename,'a+')
-            f.write(item.path+'\n')
+            automeasure_lines.append(item.path+'\n')
             for i in range(len(c_lengths)):
-                f.write(' ; '+str(c_lengths[i])+' ; '+str(p_lengths[i])+' ; '+str(forces[i])+' ; '+str(slopes[i])+' ; '+str(sigma_c_lengths[i])+' ; '+str(sigma_p_lengths[i])+'\n')
-            f.close()
+                automeasure_lines.append(' ; '+str(c_lengths[i])+' ; '+str(p_lengths[i])+' ; '+str(forces[i])+' ; '+str(slopes[i])+' ; '+str(sigma_c_lengths[i])+' ; '+str(sigma_p_lengths[i])+'\n')
             
             peak_number=len(c_lengths)
             
             '''
-            write peackforce text file
+            peackforce text file
             '''
-            print 'Saving automatic measurement...'
-            f=open(self.my_work_dir+peackforce_filename,'a+')
-            f.write(item.path+'\n')
             peackforce_info = ''
             for i in range(len(c_lengths)):
                 peackforce_info = peackforce_info + ' ; ' + str(c_lengths[i]) + ' ; ' + str(forces[i])
-            f.write(' ; '+str(peak_number)+peackforce_info+'\n')
-            f.close()
+            peackforce_lines.append(item.path+'\n')
+            peackforce_lines.append(' ; '+str(peak_number)+peackforce_info+'\n')
             
             '''
             calculate clustering coordinates
@@ -286,11 +317,10 @@ class pclusterCommands:
                 print 'Peaks difference',peaks_diff
                 
                 '''
-                write clustering coordinates
+                clustering coordinates
                 '''
-                f=open(self.my_work_dir+realclust_filename,'a+')
-                f.write(item.path+'\n')
-                f.write(' ; '+str(peak_number)+     # non considerato
+                coordinate_lines.append(item.path+'\n')
+                coordinate_lines.append(' ; '+str(peak_number)+     # non considerato
                         ' ; '+str(delta_mean)+      # 0
                         ' ; '+str(delta_median)+    # 1 -
                         ' ; '+str(force_mean)+      # 2
@@ -305,8 +335,32 @@ class pclusterCommands:
                         ' ; '+str(forces_stdev)+    # 11
                         ' ; '+str(peaks_diff)+      # 12
                         '\n')
-                f.close()
-                
+        
+        '''
+        write the text files
+        '''
+        print 'Saving automatic measurement...'
+        f=open(self.my_work_dir+pclust_filename,'w+')
+        f.write('Analysis started '+started+'\n')
+        f.write('----------------------------------------\n')
+        f.write('; Contour length (nm)  ;  Persistence length (nm) ;  Max.Force (pN)  ;  Slope (N/m) ;  Sigma contour (nm) ; Sigma persistence (nm)\n')
+        f.writelines(automeasure_lines)
+        f.close()
+        
+        f=open(self.my_work_dir+realclust_filename,'w+')
+        f.write('Analysis started '+started+'\n')
+        f.write('----------------------------------------\n')
+        f.write('; Peak number ; Mean delta (nm)  ;  Median delta (nm) ;  Mean force (pN)  ;  Median force (pN) ; First peak length (nm) ; Last peak length (nm) ; Max force (pN) ; Min force (pN) ; Max delta (nm) ; Min delta (nm) ; Peaks Diff\n')
+        f.writelines(coordinate_lines)
+        f.close()
+        
+        f=open(self.my_work_dir+peackforce_filename,'w+')
+        f.write('Analysis started '+started+'\n')
+        f.write('----------------------------------------\n')
+        f.write('; Peak number  ;  1 peak Length (nm) ; 1 peak Force (pN) ;  2 peak Length (nm) ; 2 peak Force (pN) ;  3 peak Length (nm) ; 3 peak Force (pN) ;  4 peak Length (nm) ; 4 peak Force (pN) ;  5 peak Length (nm) ; 5 peak Force (pN) ;  6 peak Length (nm) ; 6 peak Force (pN) ;  7 peak Length (nm) ; 7 peak Force (pN) ;  8 peak Length (nm) ; 8 peak Force (pN)\n')
+        f.writelines(peackforce_lines)
+        f.close()
+        
         # start PCA
         self.do_pca(pclus_dir+"/"+realclust_filename)
         
@@ -394,7 +448,7 @@ class pclusterCommands:
         # array convert, calculate PCA, transpose
         self.plot_origCoord = np.array(self.plot_origCoord,dtype='float')
         #print self.plot_origCoord.shape
-        self.plot_pcaCoord = pca(self.plot_origCoord, output_dim=2)	#other way -> y = mdp.nodes.PCANode(output_dim=2)(array)
+        self.plot_pcaCoord = pca(self.plot_origCoord, output_dim=2)
         self.plot_pcaCoordTr = np.transpose(self.plot_pcaCoord)
         pca_X=np.array(self.plot_pcaCoordTr[0],dtype='float')
         pca_Y=np.array(self.plot_pcaCoordTr[1],dtype='float')
@@ -435,16 +489,9 @@ class pclusterCommands:
         self.clustplot1=clustplot1
         
         # density and filer estimation
-        kernel = sp.stats.kde.gaussian_kde(sp.c_[pca_X,pca_Y].T)
-        tallest = 0
-        for i in range(len(pca_X)):
-            kern_value = kernel.evaluate([pca_X[i],pca_Y[i]])
-            if tallest < kern_value:
-                    tallest = float(kern_value)
-        if float(config[1]) == 0:
-            my_filter = float(tallest / 3.242311147)
-        else:
-            my_filter = float(config[1])
+        points = sp.c_[pca_X,pca_Y].T
+        kernel = sp.stats.kde.gaussian_kde(points)
+        kern_values, tallest, my_filter = density_filter(kernel, points, float(config[1]))
         '''
         # section useful only for graphic printing
         xmin = pca_X.min()
@@ -458,25 +505,15 @@ class pclusterCommands:
         '''
         
         # density filtering:
-        # tramite "kernel.evaluate" trovo lo score (altezza) di ogni coordinata e decido se mantenerla o no
-        filtered_pca_X = []
-        filtered_pca_Y = []
-        filtered_PcaCoordTr = []
-        filtered_PcaCoord = []
-        for i in range(len(pca_X)):
-            kern_value = kernel.evaluate([pca_X[i],pca_Y[i]])
-            if kern_value > my_filter:
-                filtered_pca_X.append(pca_X[i])
-                filtered_pca_Y.append(pca_Y[i])
-        filtered_PcaCoordTr.append(filtered_pca_X)
-        filtered_PcaCoordTr.append(filtered_pca_Y)
-        filtered_PcaCoord = np.transpose(filtered_PcaCoordTr)
+        # tramite "density_filter" trovo lo score (altezza) di ogni coordinata e decido se mantenerla o no
+        dense = kern_values > my_filter
+        filtered_pca_X = pca_X[dense]
+        filtered_pca_Y = pca_Y[dense]
         
         # creo i due array "plot_FiltOrigCoord" e "plot_FiltPaths" contenenti solo i dati filtrati con alta densita
-        for index in range(len(self.plot_pcaCoord)):
-            if self.plot_pcaCoord[index] in filtered_PcaCoord:
-                self.plot_FiltOrigCoord.append(self.plot_myCoord[index])
-                self.plot_FiltPaths.append(self.plot_paths[index])
+        for index in np.flatnonzero(dense):
+            self.plot_FiltOrigCoord.append(self.plot_myCoord[index])
+            self.plot_FiltPaths.append(self.plot_paths[index])
         
         '''
         # START PCA#2: USELESS!!!
@@ -709,4 +746,24 @@ class pclusterCommands:
         g.close()
         f.close()
         
-        
\ No newline at end of file
+        
+
+
+if __name__ == '__main__':
+    #self-check of the density filter: on the grid it keeps the same points as the exact kernel
+    for seed in range(3):
+        random=np.random.RandomState(seed)
+        for n in (6000,20000):
+            half=n/2
+            clusters=np.c_[random.randn(2,half)*0.3,random.randn(2,n-half)*0.3+[[12.0],[6.0]]]
+            x=random.randn(n)
+            correlated=np.array([3*x+8*(random.rand(n)<0.1),0.9*x+0.3*random.randn(n)])
+            for points in (clusters,correlated):
+                kernel=sp.stats.gaussian_kde(points)
+                densities,tallest,my_filter=density_filter(kernel,points)
+                exact=kernel(points)
+                error=np.max(abs(kde_density(kernel,points)[0]-exact))/exact.max()
+                print 'seed %d, %d points: grid error %.3g of the highest density' %(seed,n,error)
+                assert abs(tallest-exact.max()) <= 1e-12*exact.max()
+                assert ((densities>my_filter)==(exact>exact.max()/KDE_AUTO_FILTER)).all()
+    print 'density filter OK'
@@ -10,27 +10,20 @@ Copyright (C) 2006 Massimo Sandal (University of Bologna, Italy).
 This program is released under the GNU General Public License version 2.
 '''
 
-import re, struct
+import numpy as np
 from scipy import arange
 
 import libhookecurve as lhc
+import libnanoscope as lns
 
 __version__='0.0.0.20080404'
 
 
-class DataChunk(list):
-    #Dummy class to provide ext and ret methods to the data list.
-    
-    def ext(self):
-        halflen=(len(self)/2)
-        return self[0:halflen]
-        
-    def ret(self):
-        halflen=(len(self)/2)
-        return self[halflen:]
-
 class picoforceDriver(lhc.Driver):
 
+    #Sniffing rules (see lhc.Driver)
+    signature=(2,'Force file list')
+
     #Construction and other special methods
     
     def __init__(self,filename):
@@ -38,8 +31,7 @@ class picoforceDriver(lhc.Driver):
         constructor method
         '''
         
-        self.textfile=file(filename)
-        self.binfile=file(filename,'rb')
+        self.mapped=lhc.MappedFile(filename)
         
         #The 0,1,2 data chunks are:
         #0: D (vs T)
@@ -61,20 +53,14 @@ class picoforceDriver(lhc.Driver):
         '''
         Gets the samples per line parameters in the file, to understand trigger behaviour.
         '''
-        self.textfile.seek(0)
-        
-        samps_expr=re.compile(".*Samps")
-        
+        #in the force sections the value is a couple (e.g. "2048 2048"): we need the second one.
+        #single-valued entries are skipped, as the Ciao scan one (e.g. "256") is not ours.
         samps_values=[]
-        for line in self.textfile.readlines():
-            if samps_expr.match(line):
-                try:
-                    samps=int(line.split()[2]) #the third word splitted is the offset (in bytes)
-                    samps_values.append(samps)
-                except:
-                    pass
-                
-                #We raise a flag for the fact we meet an offset, otherwise we would take spurious data length arguments.
+        for value in self.header.find('Samps/line',section='Ciao force'):
+            try:
+                samps_values.append(int(value.split()[1]))
+            except:
+                pass
                         
         return int(samps_values[0])
                     
@@ -90,31 +76,7 @@ class picoforceDriver(lhc.Driver):
         In near future probably each chunk will get its own data structure, with 
         offset, size, type, etc.
         '''
-        self.textfile.seek(0)
-        
-        offset_expr=re.compile(".*Data offset")
-        length_expr=re.compile(".*Data length")
-
-        data_offsets=[]
-        data_sizes=[]
-        flag_offset=0
-
-        for line in self.textfile.readlines():
-
-            if offset_expr.match(line):
-                offset=int(line.split()[2]) #the third word splitted is the offset (in bytes)
-                data_offsets.append(offset)
-                #We raise a flag for the fact we meet an offset, otherwise we would take spurious data length arguments.
-                flag_offset=1 
-    
-            #same for the data length
-            if length_expr.match(line) and flag_offset: 
-                size=int(line.split()[2])
-                data_sizes.append(size)
-                #Put down the offset flag until the next offset is met.
-                flag_offset=0
-
-        return zip(data_offsets,data_sizes)
+        return self.header.chunk_coordinates()
         
     def _get_data_chunk(self,whichchunk):
         '''
@@ -123,18 +85,10 @@ class picoforceDriver(lhc.Driver):
         offset,size=self._get_chunk_coordinates()[whichchunk]
         
         
-        self.binfile.seek(offset)
-        raw_chunk=self.binfile.read(size)
-        
-        my_chunk=[]
-        for data_position in range(0,len(raw_chunk),2):
-            data_unit_bytes=raw_chunk[data_position:data_position+2]
-            #The unpack function converts 2-bytes in a signed int ('h').
-            #we use output[0] because unpack returns a 1-value tuple, and we want the number only
-            data_unit=struct.unpack('h',data_unit_bytes)[0]
-            my_chunk.append(data_unit)                             
+        #Nanoscope data are little-endian 16bit signed ints: we view them straight from the mapped file.
+        my_chunk=self.mapped.array(offset,size/2,'<i2')
         
-        return DataChunk(my_chunk)
+        return lhc.DataChunk(my_chunk,my_chunk.dtype)
              
     def _get_Zscan_info(self,index):
         '''
@@ -148,33 +102,13 @@ class picoforceDriver(lhc.Driver):
         index=1 : returns Zscan_V_start
         index=2 : returns Zscan_V_size
         '''
-        self.textfile.seek(0)
-        
-        ciaoforcelist_expr=re.compile(".*Ciao force")
-        zscanstart_expr=re.compile(".*@Z scan start")
-        zscansize_expr=re.compile(".*@Z scan size")
-                
-        ciaoforce_flag=0
-        theline=0
-        for line in self.textfile.readlines():
-            if ciaoforcelist_expr.match(line):
-                ciaoforce_flag=1 #raise a flag: zscanstart and zscansize params to read are later
- 
-            if ciaoforce_flag and zscanstart_expr.match(line):
-                raw_Zscanstart_line=line.split()
-            
-            if ciaoforce_flag and zscansize_expr.match(line):
-                raw_Zscansize_line=line.split()
-
-        Zscanstart_line=[]
-        Zscansize_line=[]
-        for itemscanstart,itemscansize in zip(raw_Zscanstart_line,raw_Zscansize_line):
-            Zscanstart_line.append(itemscanstart.strip('[]()'))
-            Zscansize_line.append(itemscansize.strip('[]()'))
+        #zscanstart and zscansize params to read are the last ones in the Ciao force sections
+        Zscanstart=self.header.get('@Z scan start',section='Ciao force',occurrence=-1)
+        Zscansize=self.header.get('@Z scan size',section='Ciao force',occurrence=-1)
         
-        Zscan_V_LSB=float(Zscanstart_line[6])
-        Zscan_V_start=float(Zscanstart_line[8])
-        Zscan_V_size=float(Zscansize_line[8])
+        Zscan_V_LSB=lns.value_hard_scale(Zscanstart)
+        Zscan_V_start=lns.value_number(Zscanstart)
+        Zscan_V_size=lns.value_number(Zscansize)
         
         return (Zscan_V_LSB,Zscan_V_start,Zscan_V_size)[index]
     
@@ -188,35 +122,27 @@ class picoforceDriver(lhc.Driver):
         In future, should we divide the *file* itself into chunk descriptions and gain
         true chunk data structures?
         '''
-        self.textfile.seek(0)
-        
-        z_scale_expr=re.compile(".*@4:Z scale")
-        z_magnify_expr=re.compile(".*@Z magnify")
-        
-        ramp_size_expr=re.compile(".*@4:Ramp size")
-        ramp_offset_expr=re.compile(".*@4:Ramp offset")
-                
+        #the parameters we want are the ones between the whichchunk-th Z magnify and the next one
         occurrences=0
         found_right=0
         
-        
-        for line in self.textfile.readlines():
-            if z_magnify_expr.match(line):
+        for section,key,value in self.header.entries:
+            if key=='@Z magnify':
                 occurrences+=1
                 if occurrences==whichchunk:
                     found_right=1
-                    raw_z_magnify_expression=line.split()
+                    z_magnify=value
                 else:
                     found_right=0
                     
-            if found_right and z_scale_expr.match(line):
-                raw_z_scale_expression=line.split()
-            if found_right and ramp_size_expr.match(line):
-                raw_ramp_size_expression=line.split()
-            if found_right and ramp_offset_expr.match(line):
-                raw_ramp_offset_expression=line.split()
+            if found_right and key=='@4:Z scale':
+                z_scale=value
+            if found_right and key=='@4:Ramp size':
+                ramp_size=value
+            if found_right and key=='@4:Ramp offset':
+                ramp_offset=value
                 
-        return float(raw_z_magnify_expression[5]),float(raw_z_scale_expression[7]), float(raw_ramp_size_expression[7]), float(raw_ramp_offset_expression[7]), float(raw_z_scale_expression[5][1:])
+        return lns.value_number(z_magnify),lns.value_number(z_scale), lns.value_number(ramp_size), lns.value_number(ramp_offset), lns.value_hard_scale(z_scale)
        
     
     #Exposed APIs.
@@ -232,7 +158,7 @@ class picoforceDriver(lhc.Driver):
                         
         The voltrange is by default set to 20 V.
         '''
-        return DataChunk([((float(lsb)/65535)*voltrange) for lsb in self.data_chunks[chunknum]])
+        return lhc.DataChunk(self.data_chunks[chunknum]*(float(voltrange)/65535))
         
     def LSB_to_deflection(self,chunknum,deflsensitivity=None,voltrange=20):
         '''
@@ -249,8 +175,8 @@ class picoforceDriver(lhc.Driver):
         if deflsensitivity is None:
             deflsensitivity=self.get_deflection_sensitivity()
             
-        lsbvolt=self.LSB_to_volt(chunknum)     
-        return DataChunk([volt*deflsensitivity for volt in lsbvolt])
+        lsbvolt=self.LSB_to_volt(chunknum,voltrange)     
+        return lsbvolt*deflsensitivity
         
     def deflection(self):
         '''
@@ -273,8 +199,8 @@ class picoforceDriver(lhc.Driver):
         if Kspring is None:
             Kspring=self.get_spring_constant()
             
-        lsbdefl=self.LSB_to_deflection(chunknum)        
-        return DataChunk([(meter*Kspring) for meter in lsbdefl])
+        lsbdefl=self.LSB_to_deflection(chunknum,voltrange=voltrange)        
+        return lsbdefl*Kspring
         
     def get_Zscan_V_start(self):
         return self._get_Zscan_info(1)
@@ -286,13 +212,8 @@ class picoforceDriver(lhc.Driver):
         '''
         gets Z sensitivity
         '''
-        self.textfile.seek(0)
-        
-        z_sensitivity_expr=re.compile(".*@Sens. Zsens")
-        
-        for line in self.textfile.readlines():
-            if z_sensitivity_expr.match(line):
-                z_sensitivity=float(line.split()[3])
+        #the last occurrence is the good one
+        z_sensitivity=self.header.get_float('@Sens. Zsens',occurrence=-1)
         #return it in SI units (that is: m/V, not nm/V)
         return z_sensitivity*(10**(-9))
           
@@ -332,14 +253,7 @@ class picoforceDriver(lhc.Driver):
         '''
         gets deflection sensitivity
         '''    
-        self.textfile.seek(0)
-        
-        def_sensitivity_expr=re.compile(".*@Sens. DeflSens")
-        
-        for line in self.textfile.readlines():
-            if def_sensitivity_expr.match(line):
-                def_sensitivity=float(line.split()[3])
-                break
+        def_sensitivity=self.header.get_float('@Sens. DeflSens')
         #return it in SI units (that is: m/V, not nm/V)
         return def_sensitivity*(10**(-9))
         
@@ -349,15 +263,7 @@ class picoforceDriver(lhc.Driver):
         We actually find *three* spring constant values, one for each data chunk (F/t, Z/t, F/z).
         They are normally all equal, but we retain all three for future...
         '''
-        self.textfile.seek(0)
-        
-        springconstant_expr=re.compile(".*Spring Constant")
-        
-        constants=[]
-        
-        for line in self.textfile.readlines():
-            if springconstant_expr.match(line):
-                constants.append(float(line.split()[2]))
+        constants=[lns.value_number(value) for value in self.header.find('Spring Constant')]
         
         return constants[0]
     
@@ -367,17 +273,10 @@ class picoforceDriver(lhc.Driver):
         
         This is the sensitivity needed to convert the LSB data in nanometers for the Z-vs-T data chunk.
         '''        
-        self.textfile.seek(0)
-        
-        zsensorsens_expr=re.compile(".*Sens. ZSensorSens")
+        #we must take only first occurrence
+        zsensorsens=self.header.get_float('@Sens. ZSensorSens')
         
-        for line in self.textfile.readlines():
-            if zsensorsens_expr.match(line):
-                zsensorsens_raw_expression=line.split()
-                #we must take only first occurrence, so we exit from the cycle immediately
-                break
-        
-        return (float(zsensorsens_raw_expression[3]))*(10**(-9))
+        return zsensorsens*(10**(-9))
         
     def Z_data(self):
         '''
@@ -398,8 +297,7 @@ class picoforceDriver(lhc.Driver):
         '''
         
         #z_curves=[item*Zlsb_zt*zsensorsens for item in self.data_chunks[1].pair['ext']],[item*Zlsb_zt*zsensorsens for item in self.data_chunks[1].pair['ret']]
-        z_curves=[item*Zlsb_zt*zsensorsens for item in self.data_chunks[1].ext()],[item*Zlsb_zt*zsensorsens for item in self.data_chunks[1].ret()]                
-        z_curves=[DataChunk(item) for item in z_curves]
+        z_curves=[self.data_chunks[1].ext()*(Zlsb_zt*zsensorsens),self.data_chunks[1].ret()*(Zlsb_zt*zsensorsens)]
         return z_curves
     
     def Z_extremes(self):
@@ -461,7 +359,7 @@ class picoforceDriver(lhc.Driver):
                 print "Until a solution is found, I substitute the ext domain with the ret domain. Sorry."
             xext=xret
         
-        return DataChunk(xext.tolist()+xret.tolist())
+        return lhc.DataChunk(np.concatenate((xext,xret)))
         
     def Z_scan_size(self):
         return self.get_Zscan_V_size()*self.get_Z_scan_sensitivity()
@@ -503,11 +401,10 @@ class picoforceDriver(lhc.Driver):
         '''
         self-identification of file type magic
         '''
-        curve_file=file(self.filepath)
-        header=curve_file.read(30)
-        curve_file.close()
+        header=self.mapped.map[0:30]
         
         if header[2:17] == 'Force file list': #header of a picoforce file
+            self.header=lns.NanoscopeHeader(self.mapped.map)
             self.data_chunks=[self._get_data_chunk(num) for num in [0,1,2]]
             return True
         else:
@@ -517,8 +414,7 @@ class picoforceDriver(lhc.Driver):
         '''
         Explicitly closes all files
         '''
-        self.textfile.close()
-        self.binfile.close()
+        self.mapped.close()
     
     def default_plots(self):
         '''
@@ -543,3 +439,16 @@ class picoforceDriver(lhc.Driver):
         
         
         return [main_plot]
+
+
+if __name__ == '__main__':
+    #self-check against the example curve: 2048 samples per line, 2047 points per vector
+    import os.path
+    driver=picoforceDriver(os.path.join(os.path.dirname(os.path.abspath(__file__)),'default.000'))
+    assert driver.is_me()
+    assert driver._get_samples_line()==2048
+    plot=driver.default_plots()[0]
+    for xvector,yvector in plot.vectors:
+        assert len(xvector)==2047 and len(yvector)==2047
+    driver.close_all()
+    print 'default.000 OK'
@@ -11,28 +11,20 @@ Copyright (C) 2008 Alberto Gomez-Casado (University of Twente, Netherlands).
 This program is released under the GNU General Public License version 2.
 '''
 
-import re, struct
+import numpy as np
 from scipy import arange
 
 import libhookecurve as lhc
+import libnanoscope as lns
 
 __version__='0.0.0.20081706'
 
 
-
-class DataChunk(list):
-    #Dummy class to provide ext and ret methods to the data list.
-    
-    def ext(self):
-        halflen=(len(self)/2)
-        return self[0:halflen]
-        
-    def ret(self):
-        halflen=(len(self)/2)
-        return self[halflen:]
-
 class picoforcealtDriver(lhc.Driver):
 
+    #Sniffing rules (see lhc.Driver)
+    signature=(2,'Force file list')
+
     #Construction and other special methods
     
     def __init__(self,filename):
@@ -40,8 +32,7 @@ class picoforcealtDriver(lhc.Driver):
         constructor method
         '''
         
-        self.textfile=file(filename)
-        self.binfile=file(filename,'rb')
+        self.mapped=lhc.MappedFile(filename)
         
         #The 0,1,2 data chunks are:
         #0: D (vs T)
@@ -64,20 +55,14 @@ class picoforcealtDriver(lhc.Driver):
         '''
         Gets the samples per line parameters in the file, to understand trigger behaviour.
         '''
-        self.textfile.seek(0)
-        
-        samps_expr=re.compile(".*Samps")
-        
+        #in the force sections the value is a couple (e.g. "2048 2048"): we need the second one.
+        #single-valued entries are skipped, as the Ciao scan one (e.g. "256") is not ours.
         samps_values=[]
-        for line in self.textfile.readlines():
-            if samps_expr.match(line):
-                try:
-                    samps=int(line.split()[2]) #the third word splitted is the offset (in bytes)
-                    samps_values.append(samps)
-                except:
-                    pass
-                
-                #We raise a flag for the fact we meet an offset, otherwise we would take spurious data length arguments.
+        for value in self.header.find('Samps/line',section='Ciao force'):
+            try:
+                samps_values.append(int(value.split()[1]))
+            except:
+                pass
                         
         return int(samps_values[0])
                     
@@ -93,31 +78,7 @@ class picoforcealtDriver(lhc.Driver):
         In near future probably each chunk will get its own data structure, with 
         offset, size, type, etc.
         '''
-        self.textfile.seek(0)
-        
-        offset_expr=re.compile(".*Data offset")
-        length_expr=re.compile(".*Data length")
-
-        data_offsets=[]
-        data_sizes=[]
-        flag_offset=0
-
-        for line in self.textfile.readlines():
-
-            if offset_expr.match(line):
-                offset=int(line.split()[2]) #the third word splitted is the offset (in bytes)
-                data_offsets.append(offset)
-                #We raise a flag for the fact we meet an offset, otherwise we would take spurious data length arguments.
-                flag_offset=1 
-    
-            #same for the data length
-            if length_expr.match(line) and flag_offset: 
-                size=int(line.split()[2])
-                data_sizes.append(size)
-                #Put down the offset flag until the next offset is met.
-                flag_offset=0
-
-        return zip(data_offsets,data_sizes)
+        return self.header.chunk_coordinates()
         
     def _get_data_chunk(self,whichchunk):
         '''
@@ -126,32 +87,24 @@ class picoforcealtDriver(lhc.Driver):
         offset,size=self._get_chunk_coordinates()[whichchunk]
         
         
-        self.binfile.seek(offset)
-        raw_chunk=self.binfile.read(size)
-        
-        my_chunk=[]
-        for data_position in range(0,len(raw_chunk),2):
-            data_unit_bytes=raw_chunk[data_position:data_position+2]
-            #The unpack function converts 2-bytes in a signed int ('h').
-            #we use output[0] because unpack returns a 1-value tuple, and we want the number only
-            data_unit=struct.unpack('h',data_unit_bytes)[0]
-            my_chunk.append(data_unit)                             
+        #Nanoscope data are little-endian 16bit signed ints: we view them straight from the mapped file.
+        my_chunk=self.mapped.array(offset,size/2,'<i2')
         
-        return DataChunk(my_chunk)
+        return lhc.DataChunk(my_chunk,my_chunk.dtype)
 
     def _force(self):
 	#returns force vector
         Kspring=self.get_spring_constant()
-        return DataChunk([(meter*Kspring) for meter in self._deflection()])
+        return lhc.DataChunk(self._deflection()*Kspring)
 
     def _deflection(self):
         #for internal use (feeds _force)
         voltrange=1
         z_scale=self._get_Z_scale()
         deflsensitivity=self.get_deflection_sensitivity()
-        volts=[((float(lsb))*voltrange*z_scale) for lsb in self.data_chunks[self.forcechunk]]    
-        deflect=[volt*deflsensitivity for volt in volts]
-   	     
+        volts=self.data_chunks[self.forcechunk]*(float(voltrange)*z_scale)
+        deflect=volts*deflsensitivity
+        
         return deflect
              
     
@@ -166,37 +119,16 @@ class picoforcealtDriver(lhc.Driver):
         xext=arange(sampsline*xstep,0,-xstep)
         xret=arange(sampsline*xstep,0,-xstep)
          
-        return DataChunk(xext.tolist()+xret.tolist())
+        return lhc.DataChunk(np.concatenate((xext,xret)))
     
     def _get_Z_scale(self):
-        self.textfile.seek(0)
-        expr=re.compile(".*@4:Z scale")
-        
-        for line in self.textfile.readlines():
-            if expr.match(line):
-                zscale=float((line.split()[5]).strip("() []"))
-                break
-        return zscale
+        return self.header.get_hard_scale('@4:Z scale')
     
     def _get_rampsize(self):
-        self.textfile.seek(0)
-        expr=re.compile(".*@4:Ramp size:")
-        
-        for line in self.textfile.readlines():
-            if expr.match(line):
-                zsens=float((line.split()[7]).strip("() []"))
-                break
-        return zsens
+        return self.header.get_float('@4:Ramp size')
         
     def _get_Z_scan_sens(self):
-        self.textfile.seek(0)
-        expr=re.compile(".*@Sens. Zsens")
-        
-        for line in self.textfile.readlines():
-            if expr.match(line):
-                zsens=float((line.split()[3]).strip("() []"))
-                break
-        return zsens
+        return self.header.get_float('@Sens. Zsens')
     
     
                 
@@ -204,14 +136,7 @@ class picoforcealtDriver(lhc.Driver):
         '''
         gets deflection sensitivity
         '''    
-        self.textfile.seek(0)
-        
-        def_sensitivity_expr=re.compile(".*@Sens. DeflSens")
-        
-        for line in self.textfile.readlines():
-            if def_sensitivity_expr.match(line):
-                def_sensitivity=float(line.split()[3])
-                break
+        def_sensitivity=self.header.get_float('@Sens. DeflSens')
         #return it in SI units (that is: m/V, not nm/V)
         return def_sensitivity*(10**(-9))
         
@@ -221,15 +146,7 @@ class picoforcealtDriver(lhc.Driver):
         We actually find *three* spring constant values, one for each data chunk (F/t, Z/t, F/z).
         They are normally all equal, but we retain all three for future...
         '''
-        self.textfile.seek(0)
-        
-        springconstant_expr=re.compile(".*Spring Constant")
-        
-        constants=[]
-        
-        for line in self.textfile.readlines():
-            if springconstant_expr.match(line):
-                constants.append(float(line.split()[2]))
+        constants=[lns.value_number(value) for value in self.header.find('Spring Constant')]
         
         return constants[0]
     
@@ -237,12 +154,11 @@ class picoforcealtDriver(lhc.Driver):
         '''
         self-identification of file type magic
         '''
-        curve_file=file(self.filepath)
-        header=curve_file.read(30)
-        curve_file.close()
+        header=self.mapped.map[0:30]
         
         if header[2:17] == 'Force file list': #header of a picoforce file
             #here DONT translate chunk
+            self.header=lns.NanoscopeHeader(self.mapped.map)
             self.data_chunks=[self._get_data_chunk(num) for num in [0,1,2]]
             return True
         else:
@@ -252,8 +168,7 @@ class picoforcealtDriver(lhc.Driver):
         '''
         Explicitly closes all files
         '''
-        self.textfile.close()
-        self.binfile.close()
+        self.mapped.close()
     
     def default_plots(self):
         '''
@@ -274,5 +189,5 @@ class picoforcealtDriver(lhc.Driver):
 
     def deflection(self):
         #interface for correct plotmanip and others
-        deflectionchunk=DataChunk(self._deflection())
+        deflectionchunk=lhc.DataChunk(self._deflection())
         return deflectionchunk.ext(),deflectionchunk.ret()
@@ -72,14 +72,17 @@ class procplotsCommands:
         plot_graph=self.list_of_events['plot_graph']       
         wx.PostEvent(self.frame,plot_graph(plots=[outplot]))
         
-    def subtract_curves(self, sub_order):
+    def subtract_curves(self, sub_order, plot=None):
         '''
         subtracts the extension from the retraction
+        (of plot, or of the current main plot if plot is None)
         ''' 
-        xext=self.plots[0].vectors[0][0]
-        yext=self.plots[0].vectors[0][1]
-        xret=self.plots[0].vectors[1][0]
-        yret=self.plots[0].vectors[1][1]
+        if plot is None:
+            plot=self.plots[0]
+        xext=plot.vectors[0][0]
+        yext=plot.vectors[0][1]
+        xret=plot.vectors[1][0]
+        yret=plot.vectors[1][1]
         
         #we want the same number of points
         maxpoints_tot=min(len(xext),len(xret))
@@ -89,14 +92,14 @@ class procplotsCommands:
         yret=yret[0:maxpoints_tot]
     
         if sub_order:
-            ydiff=[yretval-yextval for yretval,yextval in zip(yret,yext)]
+            ydiff=lhc.DataChunk(yret)-lhc.DataChunk(yext)
         else: #reverse subtraction (not sure it's useful, but...)
-            ydiff=[yextval-yretval for yextval,yretval in zip(yext,yret)]    
+            ydiff=lhc.DataChunk(yext)-lhc.DataChunk(yret)
         
-        outplot=copy.deepcopy(self.plots[0])
+        outplot=copy.deepcopy(plot)
         outplot.vectors[0][0], outplot.vectors[1][0] = xext,xret #FIXME: if I use xret, it is not correct!
         outplot.vectors[1][1]=ydiff
-        outplot.vectors[0][1]=[0 for item in outplot.vectors[1][0]]
+        outplot.vectors[0][1]=lhc.DataChunk(np.zeros(len(outplot.vectors[1][0])))
         
         return outplot
 
@@ -120,10 +123,11 @@ class procplotsCommands:
         nplots=len(plot.vectors)
         c=0
         while c<nplots:
-            plot.vectors[c][1]=scipy.signal.medfilt(plot.vectors[c][1],median_filter)
+            plot.vectors[c][1]=lhc.DataChunk(scipy.signal.medfilt(plot.vectors[c][1],median_filter))
             c+=1
         
         return plot
+    plotmanip_median.config_keys=('medfilt',)
     
 
     def plotmanip_correct(self, plot, current, customvalue=None):
@@ -152,10 +156,13 @@ class procplotsCommands:
         defl_ext,defl_ret=current.curve.deflection()
         #halflen=len(deflall)/2
     
-        plot.vectors[0][0]=[(zpoint-deflpoint) for zpoint,deflpoint in zip(plot.vectors[0][0],defl_ext)]
-        plot.vectors[1][0]=[(zpoint-deflpoint) for zpoint,deflpoint in zip(plot.vectors[1][0],defl_ret)]
+        #as zip() did, the shorter vector decides the length
+        for vectors,defl in ((plot.vectors[0],defl_ext),(plot.vectors[1],defl_ret)):
+            points=min(len(vectors[0]),len(defl))
+            vectors[0]=lhc.DataChunk(vectors[0][:points])-np.asarray(defl[:points])
 
         return plot
+    plotmanip_correct.config_keys=('correct',)
 
 
     def plotmanip_centerzero(self, plot, current, customvalue=None):
@@ -185,12 +192,13 @@ class procplotsCommands:
 
 	level=levelret	
 
-	approach=[i-level for i in plot.vectors[0][1]]
-	retract=[i-level for i in plot.vectors[1][1]]
+	approach=lhc.DataChunk(plot.vectors[0][1])-level
+	retract=lhc.DataChunk(plot.vectors[1][1])-level
 	
 	plot.vectors[0][1]=approach	
 	plot.vectors[1][1]=retract	
         return plot
+    plotmanip_centerzero.config_keys=('centerzero',)
     
     '''
     def plotmanip_detriggerize(self, plot, current, customvalue=None):
@@ -497,7 +497,12 @@ class tutorialCommands:
               plot : a plot object
               current : (usually not used, deprecated)
               customvalue=None : a variable containing custom value(s) you need for your plot manipulators.
-            * The function must return a plot object.
+            * The function must return a plot object. Replace the vectors you modify (as below), do not
+              change them in place: Hooke keeps the output of each plot manipulator.
+            * Declare the configuration variables the function reads, after the function:
+              plotmanip_something.config_keys=('variable1','variable2')
+              When a variable changes, Hooke runs again only the plot manipulators reading it (and the
+              following ones). Without config_keys, any change of the configuration runs it again.
             * Add an entry in hooke.conf: if your function is "plotmanip_something" you will have
               to add <something/> in the plotmanips section: example
             
@@ -524,11 +529,13 @@ class tutorialCommands:
         
         #We do something to the plot, for demonstration's sake
         #If we needed variables, we would have used customvalue.
-        plot.vectors[0][1]=[abs(i) for i in plot.vectors[0][1]]
-        plot.vectors[1][1]=[abs(i) for i in plot.vectors[1][1]]
+        #Vectors are lhc.DataChunk numpy arrays: we can work on them as a whole, no need to loop.
+        plot.vectors[0][1]=abs(plot.vectors[0][1])
+        plot.vectors[1][1]=abs(plot.vectors[1][1])
         
         #Return the plot object.
         return plot
+    plotmanip_absvalue.config_keys=('tutorial_absvalue',)
             
         
 #TODO IN TUTORIAL:
@@ -58,6 +58,19 @@ class tutorialdriverDriver(lhc.Driver):
     The driver must inherit from the parent class lhc.Driver, so the syntax is
     class nameofthedriverDriver(lhc.Driver)
     '''
+    
+    '''
+    Sniffing rules are optional, but please define them.
+    They let Hooke understand that a file is not for our driver by looking at its first bytes only, without building the driver
+    (and reading the whole file) for nothing. The rules are class attributes:
+    extensions = tuple of the file extensions of the format, e.g. ('.txt',)
+    signature = (offset, string) if the format has a fixed magic string at the beginning of the file
+    first_line = the prefix of the first line of every file of the format
+    Here, every file begins with the TUTORIAL_FILE line.
+    is_me() below is still called to confirm the choice.
+    '''
+    first_line='TUTORIAL_FILE'
+    
     def __init__(self, filename):
         '''
         THIS METHOD MUST BE DEFINED.
@@ -99,7 +112,7 @@ class tutorialdriverDriver(lhc.Driver):
         '''
         
         myfile=open(self.filename, 'r')
-        headerline=myfile.readlines()[0] #we take the first line
+        headerline=myfile.readline() #we take the first line
         myfile.close()
             
         '''
@@ -174,6 +187,8 @@ class tutorialdriverDriver(lhc.Driver):
         The "correct" shape of the vector is [ [[x1,x2,x3...],[y1,y2,y3...]] , [[x1,x2,x3...],[y1,y2,y3...]] ], so we have to put stuff in this way into it.
         
         The add_set() method takes care of this , just use plot.add_set(x,y).
+        It also turns x and y in lhc.DataChunk arrays, that all drivers should return: they can
+        be indexed and sliced as lists, and plugins can work on them as numpy arrays.
         '''
         main_plot.add_set(gen_vectors['PLOT1'][0],gen_vectors['PLOT1'][1])
         main_plot.add_set(gen_vectors['PLOT1'][2],gen_vectors['PLOT1'][3])